@@ -2,6 +2,13 @@ import streamlit as st
 import pandas as pd
 from gmail_service import GmailService
 from spam_filter import SpamFilter
+from scan_jobs import CANCELLED, FAILED, ScanJobRegistry
+from results_store import DEFAULT_PAGE_SIZE, ResultsStore
+from message_cache import MessageCache
+from feedback import FeedbackStore, OnlineLearner
+from reputation import SenderReputation
+from near_duplicates import NearDuplicateIndex
+from rules import RuleSet
 import os
 import time
 
@@ -57,12 +64,19 @@ if 'gmail_service' not in st.session_state:
     st.session_state.gmail_service = None
 if 'spam_filter' not in st.session_state:
     st.session_state.spam_filter = None
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
+if 'results' not in st.session_state:
+    st.session_state.results = ResultsStore()
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 if 'user_email' not in st.session_state:
     st.session_state.user_email = ""
+# Background scan currently feeding st.session_state.results
+if 'scan_job_id' not in st.session_state:
+    st.session_state.scan_job_id = None
+    # How many of the job's results were already added
+    st.session_state.scan_offset = 0
+if 'scan_notes' not in st.session_state:
+    st.session_state.scan_notes = []
 if 'auth_url' not in st.session_state:
     st.session_state.auth_url = None
 
@@ -74,9 +88,11 @@ if "code" in _params and not st.session_state.authenticated:
     try:
         with st.spinner("Completing sign-in…"):
             _creds = GmailService.exchange_code(_code, state_param=_state)
-            _email = GmailService.get_service_email(_creds)
+            # One client for the whole session, also used to read the profile
+            _service = GmailService(_creds)
+            _email = _service.get_email_address()
             if _email:
-                st.session_state.gmail_service = GmailService(_creds)
+                st.session_state.gmail_service = _service
                 st.session_state.user_email = _email
                 st.session_state.authenticated = True
                 st.session_state.auth_url = None
@@ -87,11 +103,77 @@ if "code" in _params and not st.session_state.authenticated:
         st.info("Debugging Info: This error often occurs if the redirect URI in Google Cloud Console doesn't match the one used by Streamlit, or if the user is not added as a Test User.")
         st.query_params.clear()
 
+@st.cache_resource
+def get_message_cache():
+    """One SQLite-backed message/verdict cache shared by all sessions."""
+    return MessageCache()
+
+@st.cache_resource
+def get_reputation():
+    """Per-account sender/domain reputation, shared by all sessions and scan jobs."""
+    return SenderReputation()
+
+@st.cache_resource
+def get_rules():
+    """Allow/deny lists, header and keyword rules from rules.json, applied before the model."""
+    return RuleSet.from_file()
+
+@st.cache_resource
+def load_spam_filter():
+    """Load the model once per process and share it across sessions."""
+    return SpamFilter()
+
+@st.cache_resource
+def get_scan_jobs():
+    """Scan jobs run on background threads and outlive reruns; sessions keep their job id."""
+    return ScanJobRegistry()
+
+@st.cache_data
+def get_model_accuracy(model_version, data_dir):
+    """Memoized per model version; SpamFilter also persists it to disk."""
+    return load_spam_filter().get_accuracy(data_dir=data_dir)
+
+@st.cache_resource
+def get_account_filter(account):
+    """The account's model, personalised by its feedback; starts out as the shared model."""
+    return SpamFilter.for_account(account)
+
+@st.cache_resource
+def get_feedback_store():
+    return FeedbackStore()
+
+@st.cache_resource
+def get_online_learner(account):
+    """Background learner that folds the account's feedback into its own model."""
+    return OnlineLearner(get_account_filter(account), get_feedback_store(), account)
+
+def record_feedback(msg_ids, label):
+    """
+    Count the user's verdict for these emails against their senders, and
+    train the account's model on the ones where it overrides the model.
+    """
+    account = st.session_state.user_email
+    rows = [row for row in map(st.session_state.results.get, msg_ids) if row is not None]
+    get_reputation().record_user_action(account, [row['sender'] for row in rows], label)
+    # Confirmed verdicts teach the model nothing and would skew its class prior
+    overrides = [row for row in rows if row['label'] != label]
+    if not overrides:
+        return
+    # Prefer the full text we classified on; fall back to what the table shows
+    cached = get_message_cache().get_contents(account, [row['id'] for row in overrides])
+    examples = []
+    for row in overrides:
+        text = cached[row['id']].text if row['id'] in cached else f"Subject: {row['subject']}\n{row['snippet']}"
+        examples.append((row['id'], text, label))
+    learner = get_online_learner(account)
+    learner.store.add(account, examples)
+    learner.submit()
+
 def init_services():
     try:
         if st.session_state.spam_filter is None:
             with st.spinner('Loading Spam Filter Model...'):
-                st.session_state.spam_filter = SpamFilter()
+                st.session_state.spam_filter = load_spam_filter()
     except Exception as e:
         st.error(f"Error initializing services: {e}")
 
@@ -108,9 +190,10 @@ def finish_login(code: str):
     try:
         with st.spinner('Verifying...'):
             creds = GmailService.exchange_code(code.strip())
-            email = GmailService.get_service_email(creds)
+            service = GmailService(creds)
+            email = service.get_email_address()
             if email:
-                st.session_state.gmail_service = GmailService(creds)
+                st.session_state.gmail_service = service
                 st.session_state.user_email = email
                 st.session_state.authenticated = True
                 st.session_state.auth_url = None
@@ -121,67 +204,113 @@ def finish_login(code: str):
         st.error(f"Authentication failed: {e}")
         st.info("Tip: Ensure the code you pasted is correct and hasn't expired. If you see a 403 error on Google's page, check your Google Cloud Console 'Test Users' list.")
 
-def scan_emails():
+def scan_emails(max_emails=50, incremental=False, metadata_first=False, group_duplicates=False):
+    """Starts a background scan; its results stream into st.session_state.results."""
     if not st.session_state.gmail_service:
         st.warning("Please login first.")
         return
+    jobs = get_scan_jobs()
+    if st.session_state.scan_job_id:
+        jobs.cancel(st.session_state.scan_job_id)
+    job = jobs.start(
+        st.session_state.gmail_service, get_account_filter(st.session_state.user_email),
+        limit=max_emails, incremental=incremental, metadata_first=metadata_first,
+        cache=get_message_cache(), account=st.session_state.user_email, reputation=get_reputation(),
+        duplicates=NearDuplicateIndex() if group_duplicates else None, rules=get_rules(),
+    )
+    st.session_state.scan_job_id = job.id
+    st.session_state.scan_offset = 0
+    st.session_state.results = ResultsStore()
+    st.session_state.scan_notes = []
 
-    with st.spinner('Scanning unread emails...'):
-        gmail = st.session_state.gmail_service
-        filter_model = st.session_state.spam_filter
-        
-        raw_messages = gmail.get_unread_messages(max_results=50)
-        
-        processed_messages = []
-        if raw_messages:
-            progress_bar = st.progress(0)
-            for i, msg in enumerate(raw_messages):
-                msg_id = msg['id']
-                content = gmail.get_message_content(msg_id)
-                
-                if content:
-                    lines = content.split('\n')
-                    # Subject usually comes from the first line in our helper
-                    subject = lines[0].replace("Subject: ", "") if lines else "No Subject"
-                    # Body is the rest
-                    body = "\n".join(lines[1:])[:200] + "..." # Snippet
-                    
-                    is_spam = filter_model.is_spam(content)
-                    
-                    processed_messages.append({
-                        'id': msg_id,
-                        'Subject': subject,
-                        'Snippet': body,
-                        'Prediction': 'SPAM' if is_spam else 'HAM',
-                        'Select': False 
-                    })
-                
-                progress_bar.progress((i + 1) / len(raw_messages))
-            
-            st.session_state.messages = processed_messages
-            st.success(f"Scanned {len(processed_messages)} emails.")
-        else:
-            st.info("No unread messages found.")
-            st.session_state.messages = []
+def _finish_scan(job):
+    """Turns the finished job's outcome into notes shown above the results."""
+    scanner = job.scanner
+    notes = []
+    if scanner.stats['rules_path']:
+        hits = get_rules().report()['hits']
+        notes.append(('caption', f"{scanner.stats['rules_path']} emails decided by rules "
+                                 f"(all scans so far: " + ", ".join(f"{rule} {n}" for rule, n in hits.items()) + ")."))
+    if scanner.metadata_first:
+        notes.append(('caption', f"{scanner.stats['reputation_path']} emails classified from the sender's history, "
+                                 f"{scanner.stats['metadata_path']} from headers/snippet, "
+                                 f"{scanner.stats['full_path'] + scanner.stats['duplicate_path']} needed the full body."))
+    if scanner.duplicates is not None and scanner.stats['duplicate_hits']:
+        notes.append(('caption', f"{scanner.stats['duplicate_hits']} emails took the verdict of a near-identical "
+                                 f"email ({len(scanner.duplicates)} distinct messages)."))
+    cached = scanner.stats['verdict_cache_hits']
+    if cached:
+        notes.append(('caption', f"{cached} emails were answered from the local cache."))
+    if job.incremental and not scanner.incremental:
+        notes.append(('info', "No usable scan history for this account, so a full scan was run."))
+    if scanner.errors:
+        notes.append(('warning', f"Could not fetch {len(scanner.errors)} emails."))
+    count = len(st.session_state.results)
+    if job.status == FAILED:
+        notes.append(('error', f"Scan failed after {count} emails: {job.error}"))
+    elif job.status == CANCELLED:
+        notes.append(('info', f"Scan cancelled after {count} emails."))
+    elif count:
+        notes.append(('success', f"Scanned {count} emails."))
+    else:
+        notes.append(('info', "No new unread messages found." if job.incremental else "No unread messages found."))
+    st.session_state.scan_notes = notes
+    st.session_state.scan_job_id = None
+
+def clear_scan():
+    """Cancels any running scan and drops its results, e.g. before another account signs in."""
+    if st.session_state.scan_job_id:
+        get_scan_jobs().cancel(st.session_state.scan_job_id)
+    st.session_state.scan_job_id = None
+    st.session_state.scan_offset = 0
+    st.session_state.results = ResultsStore()
+    st.session_state.scan_notes = []
+
+@st.fragment(run_every=1.0)
+def scan_progress():
+    """Polls the running scan, appending new results; only this fragment reruns meanwhile."""
+    job = get_scan_jobs().get(st.session_state.scan_job_id)
+    if job is None:
+        st.session_state.scan_job_id = None
+        st.rerun()
+    # Read before draining so no result that lands in between is left behind
+    finished = job.done
+    new_results = job.results_since(st.session_state.scan_offset)
+    st.session_state.scan_offset += len(new_results)
+    results = st.session_state.results
+    results.add(new_results)
+    if finished:
+        _finish_scan(job)
+        st.rerun()
+
+    st.progress(min(len(results) / job.limit, 1.0) if job.limit else 0.0,
+                text=f"Scanning... {len(results)} emails so far, {results.spam_count()} spam")
+    if st.button("Cancel scan"):
+        job.cancel()
+    latest = results.page(results.query()[-20:], 0, 20)
+    if latest:
+        st.dataframe(pd.DataFrame({'Subject': [r['subject'] for r in latest],
+                                   'Prediction': ['SPAM' if r['label'] == 1 else 'HAM' for r in latest]}),
+                     hide_index=True, use_container_width=True)
 
 def move_spam():
-    if not st.session_state.messages:
+    results = st.session_state.results
+    if not len(results):
         return
-        
-    spam_msgs = [msg for msg in st.session_state.messages if msg['Prediction'] == 'SPAM']
-    if not spam_msgs:
+
+    spam_ids = results.spam_ids()
+    if not spam_ids:
         st.info("No spam detected to move.")
         return
-        
-    count = 0
-    with st.spinner(f"Moving {len(spam_msgs)} spam emails to Spam folder..."):
-        for msg in spam_msgs:
-            st.session_state.gmail_service.move_to_spam(msg['id'])
-            count += 1
-    
-    st.success(f"Moved {count} emails to Spam.")
-    # Clear local list or re-scan
-    st.session_state.messages = [] # Clear for now
+
+    with st.spinner(f"Moving {len(spam_ids)} spam emails to Spam folder..."):
+        moved, errors = st.session_state.gmail_service.move_to_spam_many(spam_ids)
+
+    st.success(f"Moved {len(moved)} emails to Spam.")
+    if errors:
+        st.error(f"Failed to move {len(errors)} emails.")
+    results.remove(moved)
+    st.session_state.scan_notes = []
     time.sleep(2)
     st.rerun()
 
@@ -195,12 +324,14 @@ with st.sidebar:
         st.success(f"Logged in as: {st.session_state.user_email}")
         
         if st.button("Switch Account"):
+            clear_scan()
             st.session_state.authenticated = False
             st.session_state.gmail_service = None
             st.session_state.user_email = ""
             start_login()
 
         if st.button("Logout"):
+            clear_scan()
             st.session_state.gmail_service = None
             st.session_state.authenticated = False
             st.session_state.user_email = ""
@@ -240,7 +371,7 @@ with st.sidebar:
     # Model accuracy
     if st.session_state.spam_filter:
         with st.spinner("Computing accuracy..."):
-            acc = st.session_state.spam_filter.get_accuracy(data_dir=os.path.dirname(__file__))
+            acc = get_model_accuracy(st.session_state.spam_filter.model_version, os.path.dirname(__file__))
         if acc is not None:
             st.metric("Model Accuracy", f"{acc}%")
         else:
@@ -255,35 +386,61 @@ col1, col2, col3 = st.columns(3)
 with col1:
     st.metric("Status", "Connected" if st.session_state.authenticated else "Disconnected")
 with col2:
-    st.metric("Emails Scanned", len(st.session_state.messages) if st.session_state.messages else 0)
+    st.metric("Emails Scanned", len(st.session_state.results))
 with col3:
-    spam_count = len([m for m in st.session_state.messages if m['Prediction'] == 'SPAM']) if st.session_state.messages else 0
+    spam_count = st.session_state.results.spam_count()
     st.metric("Spam Detected", spam_count, delta_color="inverse")
 
 st.markdown("---")
 
 if st.session_state.authenticated:
-    col_scan, col_action = st.columns([1, 4])
+    col_scan, col_limit, col_action = st.columns([1, 1, 3])
+    with col_limit:
+        max_emails = st.number_input("Max emails to scan", min_value=10, max_value=100000, value=500, step=50)
+        incremental = st.checkbox("Only new since last scan", value=True)
+        metadata_first = st.checkbox("Fast mode (headers first)", value=False,
+                                     help="Classify from subject and snippet; fetch full bodies only when unsure")
+        group_duplicates = st.checkbox("Group near-duplicates", value=True,
+                                       help="Classify one email per group of near-identical emails, e.g. a spam campaign")
     with col_scan:
         if st.button("🔍 Scan Inbox", use_container_width=True):
-            scan_emails()
-    
-    if st.session_state.messages:
-        # Display Data
-        
-        # Determine row styling? Streamlit dataframe doesn't support row styling easily yet without pandas styler
-        # We'll just show a clean table
-        
-        df = pd.DataFrame(st.session_state.messages)
-        
-        # Add a selection mechanism? 
-        # For simplicity in this v1, we'll just have bulk actions based on prediction
-        # or we can use st.data_editor if new streamlit
-        
+            scan_emails(int(max_emails), incremental, metadata_first, group_duplicates)
+
+    if st.session_state.scan_job_id:
+        scan_progress()
+    for kind, note in st.session_state.scan_notes:
+        getattr(st, kind)(note)
+
+    results = st.session_state.results
+    if len(results) and not st.session_state.scan_job_id:
         st.subheader("Scan Results")
-        
+
+        f1, f2, f3 = st.columns([1, 2, 2])
+        with f1:
+            show = st.selectbox("Show", ["All", "Spam only", "Ham only"])
+        with f2:
+            sender_filter = st.text_input("Sender contains").strip()
+        with f3:
+            min_confidence = st.slider("Minimum confidence", 0.5, 1.0, 0.5, 0.01)
+        label = {"All": None, "Spam only": 1, "Ham only": 0}[show]
+        rows = results.query(label, sender_filter or None, min_confidence if min_confidence > 0.5 else None)
+
+        # Only one page of rows is ever turned into a DataFrame
+        n_pages = max(1, -(-len(rows) // DEFAULT_PAGE_SIZE))
+        page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1) - 1
+        page_rows = results.page(rows, page)
+        df = pd.DataFrame({
+            'Select': [r['selected'] for r in page_rows],
+            'Subject': [r['subject'] for r in page_rows],
+            'From': [r['sender'] for r in page_rows],
+            'Snippet': [r['snippet'] + "..." for r in page_rows],
+            'Prediction': ['SPAM' if r['label'] == 1 else 'HAM' for r in page_rows],
+            'Confidence': [r['confidence'] for r in page_rows],
+            'Copies': [r['copies'] for r in page_rows],
+        }, index=[r['id'] for r in page_rows])
+
         edited_df = st.data_editor(
-            df[['Subject', 'Snippet', 'Prediction', 'Select']],
+            df,
             column_config={
                 "Select": st.column_config.CheckboxColumn(
                     "Select",
@@ -297,28 +454,42 @@ if st.session_state.authenticated:
                 "Prediction": st.column_config.TextColumn(
                     "Type",
                     width="small"
-                )
+                ),
+                "Confidence": st.column_config.ProgressColumn(
+                    "Confidence", min_value=0.5, max_value=1.0, format="%.2f"
+                ),
+                "Copies": st.column_config.NumberColumn(
+                    "Copies", help="Near-identical emails in this scan, including this one", width="small"
+                ),
             },
+            disabled=['Subject', 'From', 'Snippet', 'Prediction', 'Confidence', 'Copies'],
             hide_index=True,
             use_container_width=True,
-            num_rows="dynamic"
+            num_rows="fixed",
+            key=f"results_{results.version}_{label}_{sender_filter}_{min_confidence}_{page}",
         )
-        
+        # The DataFrame is indexed by message id, so edits map back by id, not position
+        if page_rows:
+            selected = edited_df['Select'].astype(bool)
+            results.select(edited_df.index[selected], True)
+            results.select(edited_df.index[~selected], False)
+        selected_ids = results.selected_ids()
+
+        st.caption(f"{len(rows)} matching emails, {len(selected_ids)} selected")
+        if selected_ids and st.button("Clear selection"):
+            results.select(selected_ids, False)
+            st.rerun()
+        if st.checkbox("Include near-duplicates of selected emails", value=True):
+            # Clears a whole campaign from one selected copy
+            with_copies = results.cluster_ids(selected_ids)
+            if len(with_copies) > len(selected_ids):
+                st.caption(f"Actions apply to {len(with_copies)} emails including near-duplicates.")
+            selected_ids = with_copies
+
         # Action Buttons
         st.markdown("### Actions")
-        c1, c2, c3 = st.columns(3)
+        c1, c2, c3, c4 = st.columns(4)
         
-        # Helper to get selected attributes
-        # We need the real IDs. Since we didn't sort, we can use the index from the edited_df
-        # providing the user didn't shuffle things (Streamlit data editor doesn't sort by default unless configured)
-        # To be safe, let's look up by Subject/Snippet or just trust index for now in this v1.
-        
-        # Improved: let's re-map selection to IDs based on index, assuming direct mapping
-        selected_rows = edited_df[edited_df['Select']]
-        selected_indices = selected_rows.index.tolist()
-        
-        selected_ids = [st.session_state.messages[i]['id'] for i in selected_indices if i < len(st.session_state.messages)]
-
         with c1:
             if st.button("Move ALL Detected Spam to Spam Folder"):
                 move_spam()
@@ -328,13 +499,14 @@ if st.session_state.authenticated:
                 if not selected_ids:
                     st.warning("No emails selected.")
                 else:
-                    count = 0
                     with st.spinner(f"Moving {len(selected_ids)} selected emails to Spam..."):
-                        for msg_id in selected_ids:
-                            st.session_state.gmail_service.move_to_spam(msg_id)
-                            count += 1
-                    st.success(f"Moved {count} emails to Spam.")
-                    st.session_state.messages = [] # Force rescan
+                        moved, errors = st.session_state.gmail_service.move_to_spam_many(selected_ids)
+                    record_feedback(moved, 1)
+                    st.success(f"Moved {len(moved)} emails to Spam.")
+                    if errors:
+                        st.error(f"Failed to move {len(errors)} emails.")
+                    results.remove(moved)
+                    st.session_state.scan_notes = []
                     time.sleep(1)
                     st.rerun()
 
@@ -343,13 +515,26 @@ if st.session_state.authenticated:
                 if not selected_ids:
                     st.warning("No emails selected.")
                 else:
-                    count = 0
                     with st.spinner(f"Trashing {len(selected_ids)} selected emails..."):
-                        for msg_id in selected_ids:
-                            st.session_state.gmail_service.trash_message(msg_id)
-                            count += 1
-                    st.success(f"Trashed {count} emails.")
-                    st.session_state.messages = [] # Force rescan
+                        trashed, errors = st.session_state.gmail_service.trash_many(selected_ids)
+                    st.success(f"Trashed {len(trashed)} emails.")
+                    if errors:
+                        st.error(f"Failed to trash {len(errors)} emails.")
+                    results.remove(trashed)
+                    st.session_state.scan_notes = []
+                    time.sleep(1)
+                    st.rerun()
+
+        with c4:
+            if st.button("Mark SELECTED as Not Spam"):
+                if not selected_ids:
+                    st.warning("No emails selected.")
+                else:
+                    record_feedback(selected_ids, 0)
+                    results.relabel(selected_ids, 0)
+                    results.select(selected_ids, False)
+                    st.success(f"Marked {len(selected_ids)} emails as not spam.")
+                    st.session_state.scan_notes = []
                     time.sleep(1)
                     st.rerun()
         
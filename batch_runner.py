@@ -0,0 +1,189 @@
+"""
+Headless multi-account spam cleanup.
+
+Processes every stored account token (token_<email>.json, as written by
+run_remover.py) in a pool of worker threads. All accounts share the
+rules, message cache and sender reputation index; each account is scanned
+with its own feedback-personalised model, as in the app, and gets its own quota
+bucket and at most --account-workers concurrent fetches, so one large
+mailbox cannot starve the others or exceed its per-user Gmail quota.
+
+Usage: python batch_runner.py [--tokens-dir DIR] [--accounts N] [--interval SECONDS]
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from gmail_service import BATCH_SIZE, GmailService
+from message_cache import MessageCache
+from quota import PER_USER_UNITS_PER_SECOND, TokenBucket
+from reputation import SenderReputation
+from near_duplicates import NearDuplicateIndex
+from rules import RULES_FILE, RuleSet
+from scanner import ConcurrentScanner, MailboxScanner, SpamMover
+from spam_filter import SpamFilter, account_model_path
+
+# {account: (artifact mtime, SpamFilter)}, see get_account_filter
+_account_filters = {}
+_account_filters_lock = threading.Lock()
+
+
+def get_account_filter(account):
+    """
+    The account's model, as app.py's get_account_filter, loaded once and
+    reloaded when its artifact changes (e.g. the app applied feedback), so
+    verdicts cached by either share the same model version.
+    """
+    path = account_model_path(account)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    with _account_filters_lock:
+        cached = _account_filters.get(account)
+        if cached is None or cached[0] != mtime:
+            cached = _account_filters[account] = (mtime, SpamFilter.for_account(account))
+        return cached[1]
+
+
+def find_tokens(tokens_dir):
+    return sorted(glob.glob(os.path.join(tokens_dir, 'token_*.json')))
+
+
+def clean_account(token_path, args, cache=None, reputation=None, rules=None):
+    """Scans one account and moves its spam. Returns a summary dict; never raises."""
+    start = time.perf_counter()
+    summary = {'token': token_path, 'account': None, 'scanned': 0, 'spam': 0, 'moved': 0,
+               'failed': 0, 'quota_units': 0, 'seconds': 0.0, 'error': None}
+    mover = None
+    try:
+        gmail = GmailService.from_token_file(token_path, interactive=False, rate_limiter=TokenBucket(args.rate))
+        account = gmail.get_email_address()
+        if account is None:
+            raise ValueError(f"could not read the account profile: {gmail.last_error}")
+        summary['account'] = account
+        spam_filter = get_account_filter(account)
+
+        # Campaigns are grouped per account and per run
+        duplicates = NearDuplicateIndex() if args.group_duplicates else None
+        if args.account_workers:
+            scanner = ConcurrentScanner(gmail, spam_filter, workers=args.account_workers,
+                                        chunk_size=args.chunk_size, cache=cache, account=account,
+                                        metadata_first=args.metadata_first, reputation=reputation,
+                                        duplicates=duplicates, rules=rules)
+            pages = scanner.iter_results(args.query, limit=args.limit)
+        else:
+            scanner = MailboxScanner(gmail, spam_filter, page_size=args.page_size, cache=cache,
+                                     account=account, metadata_first=args.metadata_first, reputation=reputation,
+                                     duplicates=duplicates, rules=rules)
+            if args.incremental:
+                pages = scanner.iter_incremental_pages(account, limit=args.limit)
+            else:
+                pages = scanner.iter_pages(args.query, limit=args.limit)
+        if not args.dry_run:
+            # Held until the listing is done, so moves cannot shift later pages
+            mover = SpamMover(gmail, after=scanner.listed)
+
+        for page in pages:
+            spam_ids = [r['id'] for r in page if r['label'] == 1]
+            summary['scanned'] += len(page)
+            summary['spam'] += len(spam_ids)
+            if mover is not None:
+                mover.put(spam_ids)
+        summary['failed'] += len(scanner.errors)
+    except Exception as e:
+        summary['error'] = str(e)
+    finally:
+        if mover is not None:
+            moved, errors = mover.close()
+            summary['moved'] = len(moved)
+            summary['failed'] += len(errors)
+    if summary['account'] is not None:
+        summary['quota_units'] = sum(gmail.quota_used.values())
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def run_once(token_paths, args, cache=None, reputation=None, rules=None):
+    """Cleans all accounts, up to args.accounts at a time. Returns their summaries."""
+    summaries = []
+    with ThreadPoolExecutor(max_workers=args.accounts) as pool:
+        futures = [pool.submit(clean_account, path, args, cache, reputation, rules) for path in token_paths]
+        for future in as_completed(futures):
+            s = future.result()
+            summaries.append(s)
+            name = s['account'] or os.path.basename(s['token'])
+            if s['error']:
+                print(f"  {name}: FAILED ({s['error']})")
+            else:
+                print(f"  {name}: {s['scanned']} scanned, {s['spam']} spam, {s['moved']} moved, "
+                      f"{s['failed']} failed, {s['quota_units']} quota units in {s['seconds']:.1f}s")
+    return summaries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Clean spam from many Gmail accounts without a browser.")
+    parser.add_argument('--tokens-dir', default='.', help="Directory holding token_<email>.json files")
+    parser.add_argument('--token', action='append', help="Explicit token file (repeatable; overrides --tokens-dir)")
+    parser.add_argument('--accounts', type=int, default=4, help="Accounts processed concurrently")
+    parser.add_argument('--account-workers', type=int, default=0,
+                        help="Concurrent fetches within one account (default: sequential)")
+    parser.add_argument('--chunk-size', type=int, default=25, help="Messages per concurrent fetch")
+    parser.add_argument('--rate', type=float, default=PER_USER_UNITS_PER_SECOND,
+                        help="Gmail quota units per second per account")
+    parser.add_argument('--query', default='is:unread', help="Gmail search query to scan")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many messages per account")
+    parser.add_argument('--page-size', type=int, default=BATCH_SIZE, help="Messages listed and fetched per page")
+    parser.add_argument('--incremental', action='store_true', help="Only scan unread mail that arrived since the last run")
+    parser.add_argument('--metadata-first', action='store_true', help="Classify from headers/snippet and fetch full bodies only when unsure")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the local message/verdict cache")
+    parser.add_argument('--group-duplicates', action='store_true',
+                        help="Classify one message per group of near-identical messages")
+    parser.add_argument('--rules', default=RULES_FILE, help="JSON file of allow/deny lists, header and keyword rules")
+    parser.add_argument('--no-rules', action='store_true', help="Skip the rules stage")
+    parser.add_argument('--no-reputation', action='store_true', help="Do not read or write the sender reputation index")
+    parser.add_argument('--dry-run', action='store_true', help="Classify only; do not move anything")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="Run again every this many seconds (default: run once)")
+    args = parser.parse_args()
+    if args.account_workers and args.incremental:
+        parser.error("--incremental cannot be combined with --account-workers")
+    return args
+
+
+def main():
+    args = parse_args()
+    cache = None if args.no_cache else MessageCache()
+    reputation = None if args.no_reputation else SenderReputation()
+    rules = None if args.no_rules else RuleSet.from_file(args.rules)
+    try:
+        while True:
+            token_paths = args.token or find_tokens(args.tokens_dir)
+            if not token_paths:
+                print("No account tokens found.")
+            else:
+                started = time.monotonic()
+                print(f"Cleaning {len(token_paths)} accounts...")
+                summaries = run_once(token_paths, args, cache, reputation, rules)
+                print(f"Done in {time.monotonic() - started:.1f}s: "
+                      f"{sum(s['moved'] for s in summaries)} moved, "
+                      f"{sum(1 for s in summaries if s['error'])} accounts failed.")
+                if rules is not None:
+                    report = rules.report()
+                    # Cumulative since startup
+                    print(f"Rules: {report['checked']} checked, hits "
+                          + (", ".join(f"{rule} {hits}" for rule, hits in report['hits'].items()) or "none")
+                          + f", {sum(report['ms'].values()):.1f} ms")
+            if not args.interval:
+                return
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        if cache is not None:
+            cache.close()
+        if reputation is not None:
+            reputation.close()
+
+
+if __name__ == "__main__":
+    main()
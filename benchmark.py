@@ -0,0 +1,417 @@
+"""
+Benchmark suite for message parsing, classification and the scan loop.
+
+A SyntheticMailbox generates Gmail API message resources with realistic
+sizes and MIME shapes (plain, multipart/alternative, HTML-only newsletters,
+attachments, nested multiparts). FakeGmailHttp serves them to a real
+GmailService as if it were the Gmail API, batch requests included, so the
+whole client stack runs without network access. Each benchmark reports
+throughput and latency percentiles; all results are written to one JSON
+file so runs can be compared.
+
+Usage: python benchmark.py [--messages N] [--latency SECONDS] [--output FILE]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from email.parser import BytesParser
+from urllib.parse import parse_qs, urlparse
+import httplib2
+import numpy as np
+import sklearn
+from fast_scorer import FastSpamScorer
+from gmail_service import BATCH_SIZE, GmailService
+from mime_parser import parse_message
+from quota import TokenBucket
+from scanner import ConcurrentScanner, MailboxScanner
+from spam_filter import SpamFilter
+
+HAM_WORDS = (
+    'meeting', 'project', 'schedule', 'review', 'attached', 'report', 'thanks', 'team', 'update',
+    'deadline', 'agenda', 'notes', 'budget', 'call', 'tomorrow', 'draft', 'contract', 'invoice',
+    'question', 'lunch', 'weekend', 'family', 'photos', 'flight', 'hotel', 'conference', 'slides',
+    'feedback', 'release', 'database', 'server', 'deploy', 'customer', 'quarter', 'forecast',
+)
+SPAM_WORDS = (
+    'free', 'winner', 'cash', 'prize', 'offer', 'click', 'credit', 'limited', 'viagra', 'urgent',
+    'guaranteed', 'million', 'dollars', 'bonus', 'investment', 'lottery', 'unsubscribe', 'deal',
+    'discount', 'pharmacy', 'loan', 'casino', 'claim', 'exclusive', 'congratulations', 'bitcoin',
+)
+FILLER_WORDS = ('the', 'and', 'for', 'you', 'this', 'with', 'your', 'our', 'will', 'please', 'have', 'from')
+
+# Share of each MIME shape in the generated mailbox
+SHAPES = {'plain': 0.30, 'alternative': 0.35, 'html': 0.15, 'mixed': 0.15, 'nested': 0.05}
+# Throttling is not what is being measured
+UNLIMITED_RATE = 1e12
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+def _text_part(mime_type, text):
+    return {
+        'mimeType': mime_type,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="UTF-8"'}],
+        'body': {'size': len(text.encode('utf-8')), 'data': _b64(text)},
+    }
+
+
+def _attachment_part(rng):
+    size = int(rng.lognormvariate(11, 1))
+    return {
+        'mimeType': 'application/pdf',
+        'filename': f'document-{rng.randint(1, 999)}.pdf',
+        'headers': [{'name': 'Content-Disposition', 'value': 'attachment'}],
+        # Gmail leaves attachment data out of format='full'
+        'body': {'size': size, 'attachmentId': f'att-{rng.getrandbits(48):x}'},
+    }
+
+
+def _multipart(mime_type, parts):
+    return {'mimeType': mime_type, 'headers': [], 'body': {'size': 0}, 'parts': parts}
+
+
+class SyntheticMailbox:
+    """Deterministic (per seed) set of Gmail format='full' message resources."""
+
+    def __init__(self, n_messages=1000, spam_ratio=0.3, seed=0):
+        rng = random.Random(seed)
+        shapes, weights = zip(*SHAPES.items())
+        self.messages = {}
+        self.labels = {}
+        self.shapes = {}
+        for i in range(n_messages):
+            msg_id = f'{i:016x}'
+            spam = rng.random() < spam_ratio
+            shape = rng.choices(shapes, weights)[0]
+            self.messages[msg_id] = self._message(rng, msg_id, spam, shape)
+            self.labels[msg_id] = int(spam)
+            self.shapes[msg_id] = shape
+
+    @property
+    def ids(self):
+        return list(self.messages)
+
+    @staticmethod
+    def _words(rng, spam, n):
+        topical = SPAM_WORDS if spam else HAM_WORDS
+        return ' '.join(rng.choice(topical) if rng.random() < 0.4 else rng.choice(FILLER_WORDS)
+                        for _ in range(n))
+
+    @classmethod
+    def _html(cls, rng, spam, n_words):
+        # Newsletter-style markup: several times the size of its text
+        blocks = []
+        while n_words > 0:
+            words = min(n_words, rng.randint(20, 80))
+            n_words -= words
+            blocks.append(f'<tr><td style="padding:8px;font-family:Arial,sans-serif;color:#333333">'
+                          f'<p>{cls._words(rng, spam, words)}</p>'
+                          f'<a href="https://example.com/{rng.getrandbits(32):x}">Read more &raquo;</a></td></tr>')
+        return ('<html><head><style>td{font-size:14px}</style></head><body><table>'
+                + ''.join(blocks) + '</table></body></html>')
+
+    @classmethod
+    def _message(cls, rng, msg_id, spam, shape):
+        # Body length in words is roughly log-normal: mostly short, a long tail
+        n_words = max(5, int(rng.lognormvariate(5, 1)))
+        if shape == 'html':
+            n_words *= 4
+        text = cls._words(rng, spam, n_words)
+        plain = _text_part('text/plain', text)
+        html = _text_part('text/html', cls._html(rng, spam, n_words))
+        if shape == 'plain':
+            payload = plain
+        elif shape == 'html':
+            payload = html
+        elif shape == 'alternative':
+            payload = _multipart('multipart/alternative', [plain, html])
+        elif shape == 'mixed':
+            payload = _multipart('multipart/mixed', [
+                _multipart('multipart/alternative', [plain, html]), _attachment_part(rng)])
+        else:
+            inline = {'mimeType': 'image/png', 'filename': 'logo.png', 'headers': [],
+                      'body': {'size': 4096, 'attachmentId': 'att-logo'}}
+            payload = _multipart('multipart/mixed', [
+                _multipart('multipart/related', [_multipart('multipart/alternative', [plain, html]), inline]),
+                _attachment_part(rng)])
+        subject = cls._words(rng, spam, rng.randint(3, 9)).capitalize()
+        sender = 'deals@promo-mail.biz' if spam else 'colleague@example.com'
+        payload['headers'] = payload['headers'] + [
+            {'name': 'Subject', 'value': subject},
+            {'name': 'From', 'value': sender},
+            {'name': 'Date', 'value': 'Mon, 12 Oct 2026 09:00:00 +0000'},
+        ]
+        return {
+            'id': msg_id, 'threadId': msg_id, 'labelIds': ['INBOX', 'UNREAD'],
+            'snippet': text[:160], 'sizeEstimate': len(json.dumps(payload)), 'historyId': '1', 'payload': payload,
+        }
+
+
+class FakeGmailHttp:
+    """
+    httplib2.Http stand-in that answers Gmail API requests from a
+    SyntheticMailbox: messages.list, messages.get (full and metadata),
+    modify, batchModify, trash, getProfile and batch requests. history.list
+    always answers 404 so incremental scans fall back to a full scan.
+    Response bodies are serialized once per distinct request and reused,
+    so the fake itself adds little to what is measured. `latency` seconds
+    are slept per HTTP round trip.
+    """
+
+    def __init__(self, mailbox, latency=0.0):
+        self.mailbox = mailbox
+        self.latency = latency
+        self.requests = 0
+        self._ids = mailbox.ids
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def _json(self, status, body):
+        return status, json.dumps(body).encode('utf-8') if body is not None else b''
+
+    def _message_get(self, msg_id, query):
+        message = self.mailbox.messages.get(msg_id)
+        if message is None:
+            return self._json(404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}})
+        if query.get('format', ['full'])[0] != 'metadata':
+            return self._json(200, message)
+        wanted = set(query.get('metadataHeaders', []))
+        payload = {'mimeType': message['payload']['mimeType'],
+                   'headers': [h for h in message['payload']['headers'] if h['name'] in wanted]}
+        return self._json(200, {**message, 'payload': payload})
+
+    def _dispatch(self, method, uri, body):
+        parsed = urlparse(uri)
+        path = parsed.path.split('/gmail/v1/users/me/', 1)[-1]
+        query = parse_qs(parsed.query)
+        if path == 'profile':
+            return self._json(200, {'emailAddress': 'bench@example.com', 'historyId': '1',
+                                    'messagesTotal': len(self._ids)})
+        if path == 'history':
+            return self._json(404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}})
+        if path == 'messages' and method == 'GET':
+            start = int(query.get('pageToken', ['0'])[0])
+            count = int(query.get('maxResults', ['100'])[0])
+            page = self._ids[start:start + count]
+            result = {'messages': [{'id': i, 'threadId': i} for i in page],
+                      'resultSizeEstimate': len(self._ids)}
+            if start + count < len(self._ids):
+                result['nextPageToken'] = str(start + count)
+            return self._json(200, result)
+        if path == 'messages/batchModify':
+            return self._json(204, None)
+        if path.startswith('messages/'):
+            parts = path.split('/')
+            if len(parts) == 3 and parts[2] in ('modify', 'trash'):
+                return self._message_get(parts[1], {'format': ['minimal']})
+            return self._message_get(parts[1], query)
+        return self._json(404, {'error': {'code': 404, 'message': f'Unknown path {path}'}})
+
+    def _cached(self, method, uri, body):
+        if method != 'GET':
+            return self._dispatch(method, uri, body)
+        response = self._responses.get(uri)
+        if response is None:
+            response = self._responses[uri] = self._dispatch(method, uri, body)
+        return response
+
+    def _batch(self, body, headers):
+        content_type = next(v for k, v in headers.items() if k.lower() == 'content-type')
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+        out = []
+        for part in message.get_payload():
+            inner = part.get_payload()
+            request_line, _, rest = inner.partition('\n')
+            method, path, _ = request_line.strip().split(' ')
+            inner_body = rest.split('\r\n\r\n', 1)[1] if '\r\n\r\n' in rest else None
+            status, content = self._cached(method, 'https://gmail.googleapis.com' + path, inner_body)
+            out.append(f'--BENCH\r\nContent-Type: application/http\r\n'
+                       f'Content-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                       f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n'.encode()
+                       + content + b'\r\n')
+        content = b''.join(out) + b'--BENCH--'
+        return httplib2.Response({'status': '200', 'content-type': 'multipart/mixed; boundary=BENCH'}), content
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if urlparse(uri).path.startswith('/batch'):
+            return self._batch(body, headers or {})
+        status, content = self._cached(method, uri, body)
+        return httplib2.Response({'status': str(status), 'content-type': 'application/json'}), content
+
+    def close(self):
+        pass
+
+
+def _summarize(seconds, items=None):
+    """Latency percentiles (ms) and throughput for per-call timings."""
+    samples = np.asarray(seconds, dtype=np.float64) * 1000
+    total = float(samples.sum()) / 1000
+    items = len(samples) if items is None else items
+    return {
+        'calls': len(samples),
+        'items': items,
+        'total_s': round(total, 6),
+        'mean_ms': round(float(samples.mean()), 4),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p90_ms': round(float(np.percentile(samples, 90)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'max_ms': round(float(samples.max()), 4),
+        'items_per_s': round(items / total, 2) if total else None,
+    }
+
+
+def _timed(fn, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _gmail(mailbox, latency=0.0):
+    http = FakeGmailHttp(mailbox, latency)
+    return GmailService(http=http, rate_limiter=TokenBucket(UNLIMITED_RATE)), http
+
+
+def bench_parse(mailbox):
+    """parse_message over every generated payload, overall and per MIME shape."""
+    results = {'all': _summarize(_timed(parse_message, [(m,) for m in mailbox.messages.values()]))}
+    for shape in SHAPES:
+        messages = [(m,) for msg_id, m in mailbox.messages.items() if mailbox.shapes[msg_id] == shape]
+        if messages:
+            results[shape] = _summarize(_timed(parse_message, messages))
+    return results
+
+
+def bench_get_message_content(mailbox, n):
+    """get_message_content round trips through the client stack and the fake transport."""
+    gmail, _ = _gmail(mailbox)
+    ids = mailbox.ids[:n]
+    gmail.get_message_content(ids[0])  # warm up the client
+    return _summarize(_timed(gmail.get_message_content, [(msg_id,) for msg_id in ids]))
+
+
+def bench_predict(spam_filter, texts, batch_sizes):
+    results = {
+        'single': _summarize(_timed(spam_filter.predict, [(t,) for t in texts])),
+        'fast_single': _summarize(_timed(FastSpamScorer(spam_filter.model, spam_filter.vectorizer).predict,
+                                         [(t,) for t in texts])),
+    }
+    for size in batch_sizes:
+        chunks = [(texts[i:i + size],) for i in range(0, len(texts), size)]
+        results[f'batch_{size}'] = _summarize(_timed(spam_filter.predict_many, chunks), items=len(texts))
+    return results
+
+
+def _scan(scanner, pages):
+    timings, items = [], 0
+    start = time.perf_counter()
+    for page in pages:
+        now = time.perf_counter()
+        timings.append(now - start)
+        start = now
+        items += len(page)
+    return timings, items
+
+
+def bench_scan(mailbox, spam_filter, latency, page_size, workers):
+    """Full scan loop (list, fetch, parse, classify) against the fake service."""
+    results = {}
+    gmail, http = _gmail(mailbox, latency)
+    scanner = MailboxScanner(gmail, spam_filter, page_size=page_size)
+    timings, items = _scan(scanner, scanner.iter_pages())
+    results['sequential'] = {**_summarize(timings, items), 'http_requests': http.requests}
+    if workers:
+        gmail, http = _gmail(mailbox, latency)
+        scanner = ConcurrentScanner(gmail, spam_filter, workers=workers)
+        timings, items = _scan(scanner, scanner.iter_results())
+        results[f'concurrent_{workers}'] = {**_summarize(timings, items), 'http_requests': http.requests}
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args):
+    print(f"Generating {args.messages} synthetic messages...")
+    mailbox = SyntheticMailbox(args.messages, args.spam_ratio, args.seed)
+    spam_filter = SpamFilter()
+    texts = [parse_message(m).text for m in mailbox.messages.values()]
+
+    results = {}
+    print("Benchmarking parse_message...")
+    results['parse'] = bench_parse(mailbox)
+    print("Benchmarking get_message_content...")
+    results['get_message_content'] = bench_get_message_content(mailbox, min(args.messages, 500))
+    print("Benchmarking predict...")
+    results['predict'] = bench_predict(spam_filter, texts, args.batch_sizes)
+    print("Benchmarking scan loop...")
+    results['scan'] = bench_scan(mailbox, spam_filter, args.latency, args.page_size, args.workers)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'model_version': spam_filter.model_version,
+            'params': {name: value for name, value in vars(args).items() if name != 'output'},
+        },
+        'results': results,
+    }
+
+
+def print_report(report):
+    print(f"\n{'Benchmark':<36}{'items/s':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for group, entries in report['results'].items():
+        if 'calls' in entries:
+            entries = {'': entries}
+        for name, r in entries.items():
+            label = f"{group}.{name}" if name else group
+            print(f"{label:<36}{r['items_per_s'] or 0:>12.1f}{r['p50_ms']:>10.3f}{r['p90_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark parsing, classification and scanning.")
+    parser.add_argument('--messages', type=int, default=1000, help="Synthetic mailbox size")
+    parser.add_argument('--spam-ratio', type=float, default=0.3, help="Share of spam in the mailbox")
+    parser.add_argument('--seed', type=int, default=0, help="Mailbox generator seed")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help="predict_many batch sizes to measure")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds per HTTP round trip")
+    parser.add_argument('--page-size', type=int, default=BATCH_SIZE, help="Scan page size")
+    parser.add_argument('--workers', type=int, default=8, help="Workers for the concurrent scan (0 to skip)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON report")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmarks(args)
+    print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
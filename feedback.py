@@ -0,0 +1,118 @@
+"""
+User feedback and online learning.
+
+When the user overrides the model, moving a message it called ham to Spam or
+marking one it called spam as not spam, the message is recorded as a
+labelled example in a SQLite FeedbackStore. Verdicts the user merely
+confirms are not recorded, so the examples do not pull the class prior
+towards either label. OnlineLearner drains an account's pending examples on
+a background thread and feeds them to that account's
+SpamFilter.partial_update, which publishes a new model version without a
+full retrain.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+FEEDBACK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feedback.sqlite3')
+
+
+class FeedbackStore:
+    def __init__(self, path=FEEDBACK_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account TEXT NOT NULL,
+                msg_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                created REAL NOT NULL,
+                applied_version TEXT
+            );
+            CREATE INDEX IF NOT EXISTS feedback_pending ON feedback (applied_version);
+        ''')
+
+    def add(self, account, examples):
+        """Records [(msg_id, text, label), ...] for later training."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT INTO feedback (account, msg_id, text, label, created) VALUES (?, ?, ?, ?, ?)',
+                [(account, msg_id, text, int(label), now) for msg_id, text, label in examples],
+            )
+            self._conn.commit()
+
+    def pending(self, account, limit=1000):
+        """Returns up to `limit` of `account`'s unapplied examples as (row_id, text, label)."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT id, text, label FROM feedback WHERE applied_version IS NULL AND account = ? '
+                'ORDER BY id LIMIT ?',
+                (account, limit),
+            ).fetchall()
+
+    def mark_applied(self, row_ids, model_version):
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE feedback SET applied_version = ? WHERE id = ?',
+                [(model_version, row_id) for row_id in row_ids],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OnlineLearner:
+    """Applies an account's pending feedback to its SpamFilter on a background thread."""
+
+    def __init__(self, spam_filter, store, account, batch_size=1000):
+        self.spam_filter = spam_filter
+        self.store = store
+        self.account = account
+        self.batch_size = batch_size
+        self.last_error = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def submit(self):
+        """Makes sure a worker is (or will be) draining the pending feedback."""
+        with self._lock:
+            self._wake.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='online-learner', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._wake.is_set():
+                    # Nothing new was submitted while we were training
+                    self._thread = None
+                    return
+                self._wake.clear()
+            self.apply_pending()
+
+    def apply_pending(self):
+        """Trains on all pending feedback now. Returns the number of examples applied."""
+        applied = 0
+        while True:
+            rows = self.store.pending(self.account, self.batch_size)
+            if not rows:
+                return applied
+            try:
+                version = self.spam_filter.partial_update([text for _, text, _ in rows],
+                                                          [label for _, _, label in rows])
+            except Exception as e:
+                self.last_error = e
+                print(f"Online update failed: {e}")
+                return applied
+            self.store.mark_applied([row_id for row_id, _, _ in rows], version)
+            applied += len(rows)
@@ -1,14 +1,25 @@
 import os
-import base64
+import functools
+import html
 import json
+import random
+import threading
+import time
+import httplib2
 import streamlit as st
+from google.auth.exceptions import GoogleAuthError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from google_auth_oauthlib.flow import Flow, InstalledAppFlow
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
+from mime_parser import parse_message
+from quota import QUOTA_UNITS, TokenBucket
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+CREDENTIALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials.json')
 
 def _get_client_config():
     """Load OAuth client config from Streamlit Secrets or fallback to credentials.json."""
@@ -24,9 +35,8 @@ def _get_client_config():
             }
         }
     # Local dev fallback
-    creds_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'credentials.json')
-    if os.path.exists(creds_path):
-        with open(creds_path) as f:
+    if os.path.exists(CREDENTIALS_FILE):
+        with open(CREDENTIALS_FILE) as f:
             data = json.load(f)
         # Wrap "installed" type as "web" so Flow works the same way
         key = "web" if "web" in data else "installed"
@@ -54,12 +64,252 @@ def _get_redirect_uri():
     return redirect_uri
 
 
+def save_token(creds, token_path):
+    """Writes authorized-user credentials to token_path, readable by the owner only."""
+    tmp_path = token_path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(creds.to_json())
+    os.replace(tmp_path, token_path)
+
+
+def load_token(token_path):
+    """
+    Loads credentials saved by save_token, refreshing (and re-saving) them
+    if the access token expired. Returns None when the file is missing or
+    the credentials cannot be made valid, e.g. a revoked refresh token.
+    """
+    if not os.path.exists(token_path):
+        return None
+    try:
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+        if not creds.valid and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            save_token(creds, token_path)
+    except (ValueError, GoogleAuthError) as e:
+        print(f"Could not load token {token_path}: {e}")
+        return None
+    return creds if creds.valid else None
+
+
+# Gmail rejects batch requests with more than 100 calls in them
+BATCH_SIZE = 100
+# users.messages.batchModify accepts at most 1000 ids per call
+BATCH_MODIFY_SIZE = 1000
+# Headers requested when fetching format='metadata'
+METADATA_HEADERS = ['Subject', 'From']
+
+
+# Seconds before a stalled Gmail connection is given up on
+HTTP_TIMEOUT = 60
+# Retried with backoff: rate limiting and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Gmail also signals rate limiting as 403 with one of these reasons
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 32.0
+# Connection-level failures (timeouts, resets) are retried as well
+TRANSPORT_ERRORS = (HttpError, OSError, httplib2.HttpLib2Error)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _PooledHttp:
+    """
+    httplib2.Http stand-in shared by every GmailService in the process.
+    httplib2.Http is not thread-safe, so each thread gets its own one,
+    whose keep-alive connections are then reused by all services and
+    accounts on that thread instead of opening a new connection each time.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=self._timeout)
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def close(self):
+        """Closes the calling thread's connections."""
+        self._http().close()
+
+    def __getattr__(self, name):
+        # timeout, connections, follow_redirects, ... of this thread's Http
+        return getattr(self._http(), name)
+
+
+_POOLED_HTTP = _PooledHttp()
+
+
+@functools.lru_cache(maxsize=None)
+def _discovery_document():
+    """Gmail v1 discovery document bundled with google-api-python-client, read once."""
+    return discovery_cache.get_static_doc('gmail', 'v1')
+
+
+def _build_service(http):
+    document = _discovery_document()
+    if document is None:
+        # Client library without bundled documents: let build() fetch and cache it
+        return build('gmail', 'v1', http=http)
+    return build_from_document(document, http=http)
+
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class GmailApiError(Exception):
+    """
+    A Gmail call that failed for good, either because the error is not
+    retryable or because the retries ran out.
+    """
+
+    def __init__(self, method, status=None, reason=None, message='', msg_id=None,
+                 retryable=False, attempts=1, retry_after=None):
+        self.method = method
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.msg_id = msg_id
+        self.retryable = retryable
+        self.attempts = attempts
+        self.retry_after = retry_after
+        super().__init__(f"{method} failed with {status or reason} after {attempts} attempt(s): {message}")
+
+    @property
+    def rate_limited(self):
+        return self.status == 429 or self.reason in RATE_LIMIT_REASONS
+
+    @classmethod
+    def from_exception(cls, error, method, msg_id=None, attempts=1):
+        if not isinstance(error, HttpError):
+            return cls(method, reason=type(error).__name__, message=str(error), msg_id=msg_id,
+                       retryable=True, attempts=attempts)
+        status = error.resp.status
+        reason, message = None, ''
+        try:
+            details = json.loads(error.content.decode('utf-8'))['error']
+            message = details.get('message', '')
+            reason = (details.get('errors') or [{}])[0].get('reason')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            message = str(error)
+        retry_after = error.resp.get('retry-after')
+        retryable = status in RETRYABLE_STATUSES or (status == 403 and reason in RATE_LIMIT_REASONS)
+        return cls(method, status, reason, message, msg_id, retryable, attempts,
+                   float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+
 class GmailService:
-    def __init__(self, credentials=None):
+    def __init__(self, credentials=None, http=None, rate_limiter=None):
+        """
+        Pass `http` (e.g. googleapiclient.http.HttpMockSequence) to run
+        against a fake transport instead of real credentials. Otherwise
+        requests go through the process-wide pool of keep-alive
+        connections, one per thread.
+        Every call is charged its Gmail quota units on `rate_limiter`
+        (a quota.TokenBucket, by default one at the per-user limit) before
+        it is sent, and retried with backoff on rate-limit, server and
+        connection errors. Single-call methods keep returning an empty
+        value on failure and leave the GmailApiError in self.last_error;
+        listing (iter_message_pages) raises it instead.
+        """
         self.creds = credentials
-        if not self.creds or not self.creds.valid:
-            raise ValueError("Valid credentials must be provided.")
-        self.service = build('gmail', 'v1', credentials=self.creds)
+        self._http = http
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket()
+        self.last_error = None
+        if http is None:
+            if not self.creds or not self.creds.valid:
+                raise ValueError("Valid credentials must be provided.")
+            http = AuthorizedHttp(self.creds, http=_POOLED_HTTP)
+        self._set_service(_build_service(http))
+
+    def _set_service(self, service):
+        self.service = service
+        # Resource objects are rebuilt from the discovery document on every
+        # users()/messages() call, so build them once
+        self._users = service.users()
+        self._messages = self._users.messages()
+        self._history = self._users.history()
+
+    @classmethod
+    def from_token_file(cls, token_path, interactive=True, client_secrets=CREDENTIALS_FILE, rate_limiter=None):
+        """
+        Headless credential path that does not touch Streamlit. Uses the
+        token stored at token_path; if there is none (or it is no longer
+        valid) and `interactive` is set, runs the installed-app OAuth flow
+        in a local browser and stores the new token there.
+        Raises ValueError when no valid credentials can be obtained.
+        """
+        creds = load_token(token_path)
+        if creds is None:
+            if not interactive:
+                raise ValueError(f"No valid token in {token_path}; authorize it with run_remover.py first.")
+            flow = InstalledAppFlow.from_client_secrets_file(client_secrets, SCOPES)
+            creds = flow.run_local_server(port=0)
+            save_token(creds, token_path)
+        return cls(creds, rate_limiter=rate_limiter)
+
+    def clone(self):
+        """
+        Returns a GmailService for the same account to hand to another
+        thread. It shares the built client and the rate limiter; requests
+        still run on the calling thread's own pooled connection.
+        """
+        clone = GmailService.__new__(GmailService)
+        clone.creds = self.creds
+        clone._http = self._http
+        clone.rate_limiter = self.rate_limiter
+        clone.last_error = None
+        clone.service, clone._users = self.service, self._users
+        clone._messages, clone._history = self._messages, self._history
+        return clone
+
+    @property
+    def quota_used(self):
+        """Quota units spent so far per method, across clones sharing the rate limiter."""
+        return dict(self.rate_limiter.used)
+
+    def _throttle(self, method, calls=1):
+        self.rate_limiter.acquire(QUOTA_UNITS[method] * calls, method)
+
+    def _wait_before_retry(self, failure, attempt):
+        delay = max(_backoff(attempt), failure.retry_after or 0)
+        if failure.rate_limited:
+            # Drain the shared bucket so every worker on this account slows down
+            self.rate_limiter.penalize(delay)
+        else:
+            time.sleep(delay)
+
+    def _execute(self, request, method, msg_id=None):
+        """
+        Throttles and executes one request, retrying retryable failures.
+        Raises GmailApiError once the call cannot succeed.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self._throttle(method)
+            try:
+                return request.execute()
+            except TRANSPORT_ERRORS as error:
+                failure = GmailApiError.from_exception(error, method, msg_id, attempt + 1)
+                if not failure.retryable or attempt == MAX_RETRIES:
+                    raise failure from error
+            self._wait_before_retry(failure, attempt)
+
+    def _fail(self, error):
+        print(f'An error occurred: {error}')
+        self.last_error = error
 
     @staticmethod
     def get_auth_url():
@@ -127,68 +377,262 @@ class GmailService:
 
     @staticmethod
     def get_service_email(creds):
+        """Prefer GmailService(creds).get_email_address() when the service is kept."""
         try:
-            service = build('gmail', 'v1', credentials=creds)
-            profile = service.users().getProfile(userId='me').execute()
-            return profile.get('emailAddress')
+            service = GmailService(creds)
+            email = service.get_email_address()
+            if email is None:
+                st.error(f"Failed to retrieve user profile: {service.last_error}")
+            return email
         except Exception as e:
             st.error(f"Failed to retrieve user profile: {e}")
             return None
 
     def get_unread_messages(self, max_results=20):
         try:
-            results = self.service.users().messages().list(
+            results = self._execute(self._messages.list(
                 userId='me', q='is:unread', maxResults=max_results
-            ).execute()
+            ), 'messages.list')
             return results.get('messages', [])
-        except HttpError as error:
-            print(f'An error occurred: {error}')
+        except GmailApiError as error:
+            self._fail(error)
             return []
 
+    def iter_message_pages(self, query='is:unread', page_size=BATCH_SIZE, limit=None):
+        """
+        Lazily lists messages matching `query`, following nextPageToken.
+        Yields one list of message stubs ({'id', 'threadId'}) per page and
+        stops after `limit` messages in total (None = whole mailbox).
+        Raises GmailApiError if a page cannot be listed, so a failed listing
+        is never mistaken for the end of the mailbox.
+        """
+        page_token = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            max_results = page_size if remaining is None else min(page_size, remaining)
+            try:
+                results = self._execute(self._messages.list(
+                    userId='me', q=query, maxResults=max_results, pageToken=page_token
+                ), 'messages.list')
+            except GmailApiError as error:
+                self.last_error = error
+                raise
+            messages = results.get('messages', [])
+            if messages:
+                if remaining is not None:
+                    messages = messages[:remaining]
+                    remaining -= len(messages)
+                yield messages
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    def iter_messages(self, query='is:unread', page_size=BATCH_SIZE, limit=None):
+        """Generator over message stubs across all result pages."""
+        for page in self.iter_message_pages(query, page_size, limit):
+            yield from page
+
+    def get_history_id(self):
+        """Returns the mailbox's current historyId, or None on error."""
+        try:
+            profile = self._execute(self._users.getProfile(userId='me'), 'getProfile')
+            return profile.get('historyId')
+        except GmailApiError as error:
+            self._fail(error)
+            return None
+
+    def get_added_message_ids(self, start_history_id, label_id='UNREAD'):
+        """
+        Lists ids of messages added since `start_history_id` via
+        users.history.list, keeping only those that carry `label_id`.
+        Returns: list of ids in arrival order, or None if the history id
+        is too old (Gmail answers 404) or the call failed, in which case a
+        full scan is needed.
+        """
+        msg_ids = {}
+        page_token = None
+        while True:
+            try:
+                results = self._execute(self._history.list(
+                    userId='me', startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'], pageToken=page_token
+                ), 'history.list')
+            except GmailApiError as error:
+                if error.status != 404:
+                    self._fail(error)
+                return None
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message = added['message']
+                    labels = message.get('labelIds', [])
+                    if label_id in labels and 'SPAM' not in labels and 'TRASH' not in labels:
+                        msg_ids[message['id']] = None
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return list(msg_ids)
+
     def get_message_content(self, msg_id):
+        """Returns the message as a mime_parser.ParsedMessage, or None on error."""
         try:
-            message = self.service.users().messages().get(
+            message = self._execute(self._messages.get(
                 userId='me', id=msg_id, format='full'
-            ).execute()
-            payload = message['payload']
-            headers = payload.get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
-            body = ''
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        data = part['body'].get('data')
-                        if data:
-                            body = base64.urlsafe_b64decode(data).decode('utf-8')
-                        break
+            ), 'messages.get', msg_id)
+            return parse_message(message)
+        except GmailApiError as error:
+            self._fail(error)
+            return None
+
+    def _run_batch(self, msg_ids, make_request, method, batch_size=BATCH_SIZE):
+        """
+        Executes make_request(msg_id) for every id through Gmail batch HTTP
+        requests of at most `batch_size` (max 100) calls each. `method` is
+        the QUOTA_UNITS key each call is charged as. Calls that fail with a
+        retryable error are collected and sent again in a later batch after
+        a backoff, so one 429 does not drop its message.
+        Returns: (responses, errors), both dicts keyed by msg_id, with
+        GmailApiError values in errors.
+        """
+        responses = {}
+        errors = {}
+        attempt = 0
+
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = GmailApiError.from_exception(exception, method, request_id, attempt + 1)
             else:
-                data = payload['body'].get('data')
-                if data:
-                    body = base64.urlsafe_b64decode(data).decode('utf-8')
-            return f"Subject: {subject}\n{body}"
-        except HttpError as error:
-            print(f'An error occurred: {error}')
-            return ''
+                responses[request_id] = response
+
+        # request_id must be unique within a batch
+        pending = list(dict.fromkeys(msg_ids))
+        while True:
+            for chunk in _chunks(pending, min(batch_size, BATCH_SIZE)):
+                batch = self.service.new_batch_http_request(callback=_callback)
+                for msg_id in chunk:
+                    batch.add(make_request(msg_id), request_id=msg_id)
+                # Each call inside a batch is charged as a separate request
+                self._throttle(method, len(chunk))
+                try:
+                    batch.execute()
+                except TRANSPORT_ERRORS as error:
+                    for msg_id in chunk:
+                        if msg_id not in responses:
+                            errors.setdefault(msg_id, GmailApiError.from_exception(error, method, msg_id, attempt + 1))
+            retry = [msg_id for msg_id in pending if msg_id in errors and errors[msg_id].retryable]
+            if not retry or attempt == MAX_RETRIES:
+                return responses, errors
+            failures = [errors.pop(msg_id) for msg_id in retry]
+            # Honour the longest Retry-After and any rate limiting seen in this round
+            worst = max(failures, key=lambda f: (f.rate_limited, f.retry_after or 0))
+            self._wait_before_retry(worst, attempt)
+            pending = retry
+            attempt += 1
+
+    def get_messages_content(self, msg_ids, batch_size=BATCH_SIZE):
+        """
+        Fetches many messages using Gmail batch HTTP requests, up to
+        `batch_size` (max 100) messages per round trip.
+        Returns: (contents, errors) where contents is a list aligned with
+        msg_ids of mime_parser.ParsedMessage (None for failures) and errors
+        maps msg_id -> GmailApiError (or the parse error).
+        """
+        msg_ids = list(msg_ids)
+        messages = self._messages
+        responses, errors = self._run_batch(
+            msg_ids,
+            lambda msg_id: messages.get(userId='me', id=msg_id, format='full'),
+            'messages.get', batch_size,
+        )
+        contents = {}
+        for msg_id, message in responses.items():
+            try:
+                contents[msg_id] = parse_message(message)
+            except (KeyError, ValueError) as error:
+                errors[msg_id] = error
+        return [contents.get(msg_id) for msg_id in msg_ids], errors
+
+    def get_messages_metadata(self, msg_ids, batch_size=BATCH_SIZE, headers=METADATA_HEADERS):
+        """
+        Fetches format='metadata' (selected headers plus snippet, no bodies)
+        for many messages through batch HTTP requests.
+        Returns: (metadata, errors) where metadata is a list aligned with
+        msg_ids of dicts {'subject', 'from', 'snippet', 'headers'} (None for
+        failures) and errors maps msg_id -> GmailApiError.
+        """
+        msg_ids = list(msg_ids)
+        messages = self._messages
+        responses, errors = self._run_batch(
+            msg_ids,
+            lambda msg_id: messages.get(userId='me', id=msg_id, format='metadata', metadataHeaders=headers),
+            'messages.get', batch_size,
+        )
+        metadata = {}
+        for msg_id, message in responses.items():
+            header_map = {h['name']: h['value'] for h in message.get('payload', {}).get('headers', [])}
+            metadata[msg_id] = {
+                'subject': header_map.get('Subject', ''),
+                'from': header_map.get('From', ''),
+                # Gmail returns the snippet HTML-escaped
+                'snippet': html.unescape(message.get('snippet', '')),
+                'headers': header_map,
+            }
+        return [metadata.get(msg_id) for msg_id in msg_ids], errors
 
     def move_to_spam(self, msg_id):
         try:
-            self.service.users().messages().modify(
+            self._execute(self._messages.modify(
                 userId='me', id=msg_id,
                 body={'removeLabelIds': ['INBOX', 'UNREAD'], 'addLabelIds': ['SPAM']}
-            ).execute()
-        except HttpError as error:
-            print(f'An error occurred: {error}')
+            ), 'messages.modify', msg_id)
+        except GmailApiError as error:
+            self._fail(error)
+
+    def move_to_spam_many(self, msg_ids):
+        """
+        Moves many messages to Spam with users.messages.batchModify,
+        up to 1000 ids per call.
+        Returns: (succeeded, errors) — list of moved ids and a dict of
+        msg_id -> GmailApiError for ids whose batchModify call failed.
+        """
+        succeeded = []
+        errors = {}
+        unique_ids = list(dict.fromkeys(msg_ids))
+        for chunk in _chunks(unique_ids, BATCH_MODIFY_SIZE):
+            try:
+                self._execute(self._messages.batchModify(
+                    userId='me',
+                    body={'ids': chunk, 'removeLabelIds': ['INBOX', 'UNREAD'], 'addLabelIds': ['SPAM']}
+                ), 'messages.batchModify')
+                succeeded.extend(chunk)
+            except GmailApiError as error:
+                self._fail(error)
+                for msg_id in chunk:
+                    errors[msg_id] = error
+        return succeeded, errors
 
     def trash_message(self, msg_id):
         try:
-            self.service.users().messages().trash(userId='me', id=msg_id).execute()
-        except HttpError as error:
-            print(f'An error occurred: {error}')
+            self._execute(self._messages.trash(userId='me', id=msg_id), 'messages.trash', msg_id)
+        except GmailApiError as error:
+            self._fail(error)
+
+    def trash_many(self, msg_ids):
+        """
+        Trashes many messages through batched HTTP requests (100 per round trip).
+        Returns: (succeeded, errors) — list of trashed ids and a dict of
+        msg_id -> GmailApiError.
+        """
+        msg_ids = list(msg_ids)
+        messages = self._messages
+        responses, errors = self._run_batch(
+            msg_ids, lambda msg_id: messages.trash(userId='me', id=msg_id), 'messages.trash'
+        )
+        succeeded = [msg_id for msg_id in dict.fromkeys(msg_ids) if msg_id in responses]
+        return succeeded, errors
 
     def get_email_address(self):
         try:
-            profile = self.service.users().getProfile(userId='me').execute()
+            profile = self._execute(self._users.getProfile(userId='me'), 'getProfile')
             return profile.get('emailAddress')
-        except HttpError as error:
-            print(f'An error occurred: {error}')
+        except GmailApiError as error:
+            self._fail(error)
             return None
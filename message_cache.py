@@ -0,0 +1,195 @@
+"""
+Persistent SQLite cache of fetched message text and SpamFilter verdicts.
+
+Content (the message text, sender and rule headers) is keyed by (account,
+message id) and verdicts additionally by model version, so retraining the
+model invalidates verdicts but keeps the text. Results decided from
+metadata alone (rules, sender reputation or subject + snippet) are stored
+whole next to the verdicts, since those messages have no cached content, and
+are dropped after METADATA_RETENTION_DAYS. An account's verdicts of
+other model versions are purged as soon as one of a new version is stored
+for it. When the stored text grows beyond `max_bytes` the least recently
+used messages are evicted, together with their verdicts.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from mime_parser import ParsedMessage
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'message_cache.sqlite3')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Metadata-stage results are kept this long; they have no content row to be evicted with
+METADATA_RETENTION_DAYS = 30
+
+# SQLite limits the number of host parameters per statement
+_QUERY_CHUNK = 500
+
+
+class MessageCache:
+    def __init__(self, path=CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Model version of the last verdicts stored per account; others are purged when it changes
+        self._model_versions = {}
+        # Streamlit reruns the script on different threads
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS contents (
+                account TEXT NOT NULL,
+                msg_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                sender TEXT NOT NULL DEFAULT '',
+                headers TEXT,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (account, msg_id)
+            );
+            CREATE INDEX IF NOT EXISTS contents_accessed ON contents (accessed);
+            CREATE TABLE IF NOT EXISTS verdicts (
+                account TEXT NOT NULL,
+                msg_id TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                label INTEGER NOT NULL,
+                spam_prob REAL NOT NULL,
+                path TEXT NOT NULL DEFAULT 'full',
+                result TEXT,
+                created REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (account, msg_id, model_version)
+            );
+        ''')
+        # Caches written before the sender and headers were stored
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(contents)')}
+        if 'sender' not in columns:
+            self._conn.execute("ALTER TABLE contents ADD COLUMN sender TEXT NOT NULL DEFAULT ''")
+        if 'headers' not in columns:
+            self._conn.execute('ALTER TABLE contents ADD COLUMN headers TEXT')
+        # ... and before metadata-stage results were
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(verdicts)')}
+        if 'path' not in columns:
+            self._conn.executescript('''
+                ALTER TABLE verdicts ADD COLUMN path TEXT NOT NULL DEFAULT 'full';
+                ALTER TABLE verdicts ADD COLUMN result TEXT;
+                ALTER TABLE verdicts ADD COLUMN created REAL NOT NULL DEFAULT 0;
+            ''')
+        self._conn.commit()
+
+    def _select(self, sql, account, msg_ids, *extra):
+        rows = []
+        for start in range(0, len(msg_ids), _QUERY_CHUNK):
+            chunk = msg_ids[start:start + _QUERY_CHUNK]
+            marks = ','.join('?' * len(chunk))
+            rows.extend(self._conn.execute(sql.format(marks=marks), (account, *extra, *chunk)).fetchall())
+        return rows
+
+    def get_contents(self, account, msg_ids):
+        """Returns {msg_id: ParsedMessage} for the ids that are cached."""
+        msg_ids = list(msg_ids)
+        with self._lock:
+            rows = self._select(
+                'SELECT msg_id, text, sender, headers FROM contents WHERE account = ? AND msg_id IN ({marks})',
+                account, msg_ids,
+            )
+            now = time.time()
+            self._conn.executemany(
+                'UPDATE contents SET accessed = ? WHERE account = ? AND msg_id = ?',
+                [(now, account, row[0]) for row in rows],
+            )
+            self._conn.commit()
+        return {
+            msg_id: ParsedMessage.from_text(text, sender, None if headers is None else json.loads(headers))
+            for msg_id, text, sender, headers in rows
+        }
+
+    def put_contents(self, account, contents):
+        """Stores {msg_id: ParsedMessage} and evicts old entries if over max_bytes."""
+        now = time.time()
+        rows = []
+        for msg_id, message in contents.items():
+            text = message.text
+            headers = None if message.headers is None else json.dumps(message.headers)
+            rows.append((account, msg_id, text, message.sender, headers, len(text.encode('utf-8')), now))
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO contents (account, msg_id, text, sender, headers, size, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def get_verdicts(self, account, msg_ids, model_version):
+        """Returns {msg_id: (label, spam_prob)} of full-body verdicts cached for this model version."""
+        with self._lock:
+            rows = self._select(
+                "SELECT msg_id, label, spam_prob FROM verdicts "
+                "WHERE account = ? AND model_version = ? AND path = 'full' AND msg_id IN ({marks})",
+                account, list(msg_ids), model_version,
+            )
+        return {msg_id: (label, spam_prob) for msg_id, label, spam_prob in rows}
+
+    def put_verdicts(self, account, model_version, verdicts):
+        """Stores {msg_id: (label, spam_prob)} of full-body verdicts for this model version."""
+        now = time.time()
+        self._put(account, model_version, [(account, msg_id, model_version, int(label), float(prob), 'full', None, now)
+                                           for msg_id, (label, prob) in verdicts.items()])
+
+    def get_metadata_results(self, account, msg_ids, model_version):
+        """Returns {msg_id: result} of MailboxScanner metadata-stage results cached for this model version."""
+        with self._lock:
+            rows = self._select(
+                "SELECT msg_id, result FROM verdicts "
+                "WHERE account = ? AND model_version = ? AND path != 'full' AND msg_id IN ({marks})",
+                account, list(msg_ids), model_version,
+            )
+        return {msg_id: json.loads(result) for msg_id, result in rows}
+
+    def put_metadata_results(self, account, model_version, results):
+        """Stores {msg_id: result} of MailboxScanner's metadata stage for this model version."""
+        now = time.time()
+        self._put(account, model_version, [
+            (account, msg_id, model_version, int(result['label']), float(result['spam_prob']), result['path'],
+             json.dumps(result), now)
+            for msg_id, result in results.items()
+        ])
+
+    def _put(self, account, model_version, rows):
+        with self._lock:
+            if model_version != self._model_versions.get(account):
+                self._conn.execute('DELETE FROM verdicts WHERE account = ? AND model_version != ?',
+                                   (account, model_version))
+                self._model_versions[account] = model_version
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO verdicts '
+                '(account, msg_id, model_version, label, spam_prob, path, result, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+            self._conn.execute("DELETE FROM verdicts WHERE path != 'full' AND created < ?",
+                               (time.time() - METADATA_RETENTION_DAYS * 86400,))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM contents').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Keeps the most recently used messages that fit in max_bytes, all in SQLite
+        self._conn.execute('''
+            DELETE FROM contents WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, SUM(size) OVER (ORDER BY accessed DESC, rowid DESC) AS kept FROM contents
+                ) WHERE kept > ?
+            )
+        ''', (self.max_bytes,))
+        self._conn.execute('''
+            DELETE FROM verdicts WHERE path = 'full' AND NOT EXISTS (
+                SELECT 1 FROM contents WHERE contents.account = verdicts.account AND contents.msg_id = verdicts.msg_id
+            )
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
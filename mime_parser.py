@@ -0,0 +1,125 @@
+"""
+Text extraction from Gmail format='full' message resources.
+
+The MIME tree is walked iteratively to any depth, preferring the first
+text/plain body and falling back to HTML stripped to text with regexes
+(no DOM). Each body is capped before it is base64-decoded, so a large
+newsletter costs no more than MAX_BODY_BYTES of work.
+"""
+import base64
+import html
+import re
+from collections import namedtuple
+from rules import RULE_HEADERS
+
+# Decoded bytes kept per body; the classifier gains nothing from more
+MAX_BODY_BYTES = 64 * 1024
+
+_CHARSET = re.compile(r'charset\s*=\s*"?([\w.:-]+)', re.I)
+_INVISIBLE = re.compile(r'<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->', re.I | re.S)
+_BLOCK_TAG = re.compile(r'<\s*(br|/?p|/?div|/?tr|/?li|/?h[1-6]|/?table|/?blockquote)\b[^>]*>', re.I)
+_TAG = re.compile(r'<[^>]*>')
+_SPACES = re.compile(r'[ \t\r\f\v\xa0]+')
+_BLANK_LINES = re.compile(r'\s*\n\s*')
+
+
+class ParsedMessage(namedtuple('ParsedMessage', 'subject sender body size headers', defaults=(None,))):
+    """
+    subject and sender come from the headers, body is the best text body
+    (at most MAX_BODY_BYTES of it) and size is that body's full size in
+    bytes as reported by Gmail, before capping. headers maps the
+    rules.RULE_HEADERS the message has to their values, or is None when
+    they are not known.
+    """
+    __slots__ = ()
+
+    @property
+    def text(self):
+        """'Subject: ...' followed by the body, the form the model is trained on."""
+        return f"Subject: {self.subject}\n{self.body}"
+
+    @property
+    def snippet(self):
+        return self.body[:200]
+
+    @classmethod
+    def from_text(cls, text, sender='', headers=None):
+        """Rebuilds a message from .text and its sender and headers, e.g. when it comes out of the cache."""
+        first, _, body = text.partition('\n')
+        subject = first[len('Subject: '):] if first.startswith('Subject: ') else first
+        return cls(subject, sender, body, len(body), headers)
+
+
+def html_to_text(markup):
+    markup = _INVISIBLE.sub(' ', markup)
+    markup = _BLOCK_TAG.sub('\n', markup)
+    text = html.unescape(_TAG.sub(' ', markup))
+    text = _SPACES.sub(' ', text)
+    return _BLANK_LINES.sub('\n', text).strip()
+
+
+def _header(headers, name):
+    name = name.lower()
+    return next((h['value'] for h in headers if h['name'].lower() == name), '')
+
+
+def _decode_body(part, max_bytes):
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    # Every 4 base64 characters hold 3 bytes: cut the encoded string first
+    data = data[:(max_bytes + 2) // 3 * 4]
+    # Whole base64 blocks can decode to up to 2 bytes past the cap
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))[:max_bytes]
+    match = _CHARSET.search(_header(part.get('headers', []), 'Content-Type'))
+    try:
+        return raw.decode(match.group(1) if match else 'utf-8', errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def _is_attachment(part):
+    return bool(part.get('filename')) or \
+        _header(part.get('headers', []), 'Content-Disposition').lower().startswith('attachment')
+
+
+def find_text_parts(payload):
+    """
+    Returns the first text/plain and first text/html parts (or None) in
+    document order, searching nested multiparts and skipping attachments.
+    """
+    plain = rich = None
+    stack = [payload]
+    while stack and (plain is None or rich is None):
+        part = stack.pop()
+        # RFC 2045: no Content-Type means text/plain
+        mime_type = part.get('mimeType') or 'text/plain'
+        if part.get('parts'):
+            # Reversed so the first child is popped first
+            stack.extend(reversed(part['parts']))
+        elif _is_attachment(part) or not part.get('body', {}).get('data'):
+            continue
+        elif mime_type == 'text/plain' and plain is None:
+            plain = part
+        elif mime_type == 'text/html' and rich is None:
+            rich = part
+    return plain, rich
+
+
+def parse_message(message, max_bytes=MAX_BODY_BYTES):
+    """Turns a format='full' message resource into a ParsedMessage."""
+    payload = message.get('payload', {})
+    headers = payload.get('headers', [])
+    plain, rich = find_text_parts(payload)
+    body, size = '', 0
+    if plain is not None:
+        body, size = _decode_body(plain, max_bytes), plain['body'].get('size', 0)
+    # Some senders ship an empty text/plain alternative next to the real HTML
+    if not body.strip() and rich is not None:
+        body, size = html_to_text(_decode_body(rich, max_bytes)), rich['body'].get('size', 0)
+    wanted = {name.lower() for name in RULE_HEADERS}
+    kept = {}
+    for header in headers:
+        if header['name'].lower() in wanted:
+            kept.setdefault(header['name'], header['value'])
+    return ParsedMessage(_header(headers, 'Subject'), _header(headers, 'From'), body, size, kept)
@@ -0,0 +1,286 @@
+"""
+Compact, pickle-free inference artifact for the spam model.
+
+The trained vectorizer + classifier pair is exported to a single binary
+file: a small JSON header followed by raw NumPy arrays. A CountVectorizer
+vocabulary is stored as a sorted array of 64-bit token hashes (feature
+columns are reordered to match); a HashingVectorizer needs no vocabulary
+at all and is rebuilt from its parameters. NB log-probabilities and linear
+weights are stored as float32. Loading memory-maps the arrays, so there is
+no unpickling and replicas of the app share the pages through the OS page
+cache.
+
+Usage: python model_artifact.py  (exports spam_model.pkl + vectorizer.pkl)
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+MAGIC = b'GSRMODEL'
+FORMAT_VERSION = 1
+_ALIGN = 64
+
+_here = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_PATH = os.path.join(_here, 'spam_model.bin')
+
+
+def token_hash(token):
+    """Stable 64-bit hash of a token, used as the vocabulary key."""
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class CompactVectorizer:
+    """Drop-in for CountVectorizer.transform backed by a hashed vocabulary."""
+
+    def __init__(self, vocab_hashes, token_pattern, lowercase=True):
+        self.vocab_hashes = vocab_hashes
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self._findall = re.compile(token_pattern).findall
+
+    def transform(self, texts):
+        if isinstance(texts, str):
+            raise ValueError("Iterable over raw text documents expected, string object received.")
+        rows, token_ids = [], []
+        # Each distinct token in the batch is hashed and looked up only once
+        batch_vocab = {}
+        n_docs = 0
+        for row, text in enumerate(texts):
+            n_docs += 1
+            if self.lowercase:
+                text = text.lower()
+            for token in self._findall(text):
+                rows.append(row)
+                token_ids.append(batch_vocab.setdefault(token, len(batch_vocab)))
+        n_features = len(self.vocab_hashes)
+        if not token_ids:
+            return csr_matrix((n_docs, n_features), dtype=np.int64)
+        hashes = np.fromiter((token_hash(token) for token in batch_vocab), dtype=np.uint64, count=len(batch_vocab))
+        token_cols = np.searchsorted(self.vocab_hashes, hashes)
+        token_cols[token_cols == n_features] = 0
+        token_known = self.vocab_hashes[token_cols] == hashes
+        token_ids = np.array(token_ids, dtype=np.int64)
+        known = token_known[token_ids]
+        rows = np.array(rows, dtype=np.int64)[known]
+        cols = token_cols[token_ids[known]]
+        data = np.ones(len(cols), dtype=np.int64)
+        # Duplicate (row, col) entries are summed into token counts
+        matrix = csr_matrix((data, (rows, cols)), shape=(n_docs, n_features))
+        matrix.sum_duplicates()
+        return matrix
+
+
+class CompactNB:
+    """
+    MultinomialNB over memory-mapped log-probabilities. When the artifact
+    carries the training counts, partial_fit can continue training; it
+    replaces the arrays instead of writing into the read-only mapping.
+    """
+
+    def __init__(self, classes, class_log_prior, feature_log_prob,
+                 feature_count=None, class_count=None, alpha=1.0, fit_prior=True):
+        self.classes_ = np.asarray(classes)
+        self.class_log_prior_ = class_log_prior
+        self.feature_log_prob_ = feature_log_prob
+        self.feature_count_ = feature_count
+        self.class_count_ = class_count
+        self.alpha = alpha
+        self.fit_prior = fit_prior
+
+    def _joint_log_likelihood(self, X):
+        return np.asarray(X @ self.feature_log_prob_.T, dtype=np.float64) + self.class_log_prior_
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self._joint_log_likelihood(X), axis=1)]
+
+    def predict_proba(self, X):
+        jll = self._joint_log_likelihood(X)
+        jll -= jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        proba /= proba.sum(axis=1, keepdims=True)
+        return proba
+
+    def partial_fit(self, X, y):
+        """Same update rule as MultinomialNB.partial_fit with fixed classes."""
+        if self.feature_count_ is None:
+            raise ValueError("Artifact has no training counts; re-export it to enable partial_fit.")
+        y = np.asarray(y)
+        Y = (y[:, None] == self.classes_[None, :]).astype(np.float64)
+        feature_count = np.asarray(self.feature_count_, dtype=np.float64) + np.asarray((X.T @ Y).T)
+        class_count = np.asarray(self.class_count_, dtype=np.float64) + Y.sum(axis=0)
+
+        smoothed = feature_count + self.alpha
+        self.feature_log_prob_ = (np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))).astype(np.float32)
+        if self.fit_prior:
+            self.class_log_prior_ = np.log(class_count) - np.log(class_count.sum())
+        self.feature_count_ = feature_count.astype(np.float32)
+        self.class_count_ = class_count
+        return self
+
+
+class CompactLinear:
+    """Inference-only binary linear classifier (e.g. SGDClassifier with log loss)."""
+
+    def __init__(self, classes, coef, intercept):
+        self.classes_ = np.asarray(classes)
+        self.coef_ = coef
+        self.intercept_ = intercept
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef_.T, dtype=np.float64).ravel() + self.intercept_[0]
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(np.int64)]
+
+    def predict_proba(self, X):
+        spam = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1.0 - spam, spam])
+
+
+def word_unigram_params(vectorizer):
+    """
+    get_params() of a Count/HashingVectorizer, checked to be plain word
+    unigrams split by token_pattern: the only configuration the artifact
+    and FastSpamScorer reproduce. Raises ValueError otherwise.
+    """
+    params = vectorizer.get_params()
+    if params['analyzer'] != 'word' or params['ngram_range'] != (1, 1) or params['preprocessor'] \
+            or params['tokenizer'] or params['strip_accents'] or params['binary']:
+        raise ValueError(f"Only word-unigram {type(vectorizer).__name__} configurations are supported.")
+    return params
+
+
+# HashingVectorizer parameters that are carried over in the artifact header
+_HASHING_PARAMS = ('n_features', 'token_pattern', 'lowercase', 'stop_words', 'alternate_sign', 'norm')
+
+
+def export_artifact(model, vectorizer, path=ARTIFACT_PATH):
+    """Writes a fitted vectorizer + classifier pair to `path`."""
+    if isinstance(vectorizer, HashingVectorizer):
+        arrays, vectorizer_header = _export_hashing(vectorizer)
+        order = slice(None)
+    elif isinstance(vectorizer, CountVectorizer):
+        arrays, vectorizer_header, order = _export_count(vectorizer)
+    elif isinstance(vectorizer, CompactVectorizer):
+        # Re-publishing a loaded artifact, columns are already in hash order
+        arrays = {'vocab_hashes': np.asarray(vectorizer.vocab_hashes)}
+        vectorizer_header = {'type': 'count', 'token_pattern': vectorizer.token_pattern,
+                             'lowercase': vectorizer.lowercase}
+        order = slice(None)
+    else:
+        raise ValueError(f"Cannot export vectorizer of type {type(vectorizer).__name__}.")
+
+    extra_header = {}
+    if isinstance(model, (MultinomialNB, CompactNB)):
+        model_type = 'multinomial_nb'
+        arrays['feature_log_prob'] = np.ascontiguousarray(model.feature_log_prob_[:, order], dtype=np.float32)
+        arrays['class_log_prior'] = np.asarray(model.class_log_prior_, dtype=np.float64)
+        # Training counts let CompactNB.partial_fit continue where training stopped
+        if model.feature_count_ is not None:
+            arrays['feature_count'] = np.ascontiguousarray(model.feature_count_[:, order], dtype=np.float32)
+            arrays['class_count'] = np.asarray(model.class_count_, dtype=np.float64)
+        extra_header = {'alpha': float(model.alpha), 'fit_prior': bool(model.fit_prior)}
+    elif isinstance(model, SGDClassifier) and model.loss == 'log_loss':
+        model_type = 'linear'
+        arrays['coef'] = np.ascontiguousarray(model.coef_[:, order], dtype=np.float32)
+        arrays['intercept'] = np.asarray(model.intercept_, dtype=np.float64)
+    else:
+        raise ValueError(f"Cannot export model of type {type(model).__name__}.")
+
+    _write(path, {
+        'format': FORMAT_VERSION,
+        'vectorizer': vectorizer_header,
+        'model_type': model_type,
+        'classes': [int(c) for c in model.classes_],
+        **extra_header,
+    }, arrays)
+
+
+def _export_hashing(vectorizer):
+    params = word_unigram_params(vectorizer)
+    header = {name: params[name] for name in _HASHING_PARAMS}
+    header['type'] = 'hashing'
+    return {}, header
+
+
+def _export_count(vectorizer):
+    params = word_unigram_params(vectorizer)
+    terms = vectorizer.get_feature_names_out()
+    hashes = np.array([token_hash(term) for term in terms], dtype=np.uint64)
+    order = np.argsort(hashes)
+    hashes = hashes[order]
+    if np.any(hashes[1:] == hashes[:-1]):
+        raise ValueError("Token hash collision in vocabulary.")
+    header = {'type': 'count', 'token_pattern': params['token_pattern'], 'lowercase': params['lowercase']}
+    return {'vocab_hashes': hashes}, header, order
+
+
+def _write(path, header, arrays):
+    header['arrays'] = {}
+    # Offsets are relative to the start of the (aligned) data section
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 4 + len(header_bytes)) // _ALIGN) * _ALIGN
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    # Atomic swap, so concurrent loaders never see a half-written file
+    os.replace(tmp_path, path)
+
+
+def load_artifact(path=ARTIFACT_PATH):
+    """Returns (model, vectorizer) memory-mapped from an exported artifact."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a spam model artifact.")
+        (header_len,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len))
+    if header['format'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {header['format']}.")
+    data_start = -(-(len(MAGIC) + 4 + header_len) // _ALIGN) * _ALIGN
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        arrays[name] = np.memmap(path, dtype=np.dtype(spec['dtype']), mode='r',
+                                 offset=data_start + spec['offset'], shape=tuple(spec['shape']))
+
+    vectorizer_header = dict(header['vectorizer'])
+    if vectorizer_header.pop('type', 'count') == 'hashing':
+        # Stateless: rebuilt from its parameters, no vocabulary to load
+        vectorizer = HashingVectorizer(**vectorizer_header)
+    else:
+        vectorizer = CompactVectorizer(arrays['vocab_hashes'], **vectorizer_header)
+
+    if header.get('model_type', 'multinomial_nb') == 'linear':
+        model = CompactLinear(header['classes'], arrays['coef'], np.array(arrays['intercept']))
+    else:
+        model = CompactNB(header['classes'], np.array(arrays['class_log_prior']), arrays['feature_log_prob'],
+                          arrays.get('feature_count'), arrays.get('class_count'),
+                          header.get('alpha', 1.0), header.get('fit_prior', True))
+    return model, vectorizer
+
+
+if __name__ == "__main__":
+    import joblib
+    model = joblib.load(os.path.join(_here, 'spam_model.pkl'))
+    vectorizer = joblib.load(os.path.join(_here, 'vectorizer.pkl'))
+    export_artifact(model, vectorizer)
+    print(f"Exported {len(vectorizer.vocabulary_)} features to {ARTIFACT_PATH} "
+          f"({os.path.getsize(ARTIFACT_PATH) / 1024:.0f} KiB)")
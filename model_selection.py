@@ -0,0 +1,156 @@
+"""
+Model selection sweep: vectorizer settings x classifier types.
+
+Each vectorizer configuration is fitted once and its train/test matrices
+are cached on disk (keyed by dataset digest and configuration), then every
+classifier is trained against the cached matrices. Both stages run across
+all cores in a process pool. The result table reports quality next to
+cost: accuracy, training time, inference latency per 1k emails (raw text
+in, labels out) and serialized model size.
+
+Usage: python model_selection.py [--workers N] [--cache-dir DIR]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.svm import LinearSVC
+from train_model import DEFAULT_CORPORA, load_dataset
+
+VECTORIZER_GRID = {
+    'count-1g': {'kind': 'count', 'ngram_range': (1, 1), 'min_df': 1},
+    'count-1g-min2': {'kind': 'count', 'ngram_range': (1, 1), 'min_df': 2},
+    'count-1-2g-min2': {'kind': 'count', 'ngram_range': (1, 2), 'min_df': 2},
+    'hash-2^18': {'kind': 'hashing', 'n_features': 2 ** 18},
+    'hash-2^20': {'kind': 'hashing', 'n_features': 2 ** 20},
+}
+CLASSIFIERS = ('nb', 'linear_svm', 'logreg')
+LATENCY_SAMPLE = 1000
+
+
+def make_vectorizer(spec):
+    if spec['kind'] == 'hashing':
+        return HashingVectorizer(stop_words='english', n_features=spec['n_features'],
+                                 alternate_sign=False, norm=None)
+    return CountVectorizer(stop_words='english', ngram_range=spec['ngram_range'], min_df=spec['min_df'])
+
+
+def make_classifier(name):
+    if name == 'linear_svm':
+        return LinearSVC()
+    if name == 'logreg':
+        return LogisticRegression(max_iter=1000)
+    return MultinomialNB()
+
+
+def _cache_key(data_digest, spec):
+    return hashlib.sha256(f"{data_digest}:{json.dumps(spec, sort_keys=True)}".encode()).hexdigest()[:16]
+
+
+def vectorize_job(name, spec, X_train, X_test, cache_dir, data_digest):
+    """Fits one vectorizer and caches its matrices. Returns (name, cache prefix, seconds)."""
+    prefix = os.path.join(cache_dir, _cache_key(data_digest, spec))
+    if os.path.exists(prefix + '.vectorizer.joblib'):
+        return name, prefix, 0.0
+    start = time.perf_counter()
+    vectorizer = make_vectorizer(spec)
+    sparse.save_npz(prefix + '.train.npz', sparse.csr_matrix(vectorizer.fit_transform(X_train)))
+    sparse.save_npz(prefix + '.test.npz', sparse.csr_matrix(vectorizer.transform(X_test)))
+    # Written last: its presence marks a complete cache entry
+    joblib.dump(vectorizer, prefix + '.vectorizer.joblib')
+    return name, prefix, time.perf_counter() - start
+
+
+def classifier_job(vec_name, clf_name, prefix, y_train, y_test, sample_texts):
+    """Trains one classifier on cached matrices and measures it."""
+    X_train = sparse.load_npz(prefix + '.train.npz')
+    X_test = sparse.load_npz(prefix + '.test.npz')
+    vectorizer = joblib.load(prefix + '.vectorizer.joblib')
+
+    model = make_classifier(clf_name)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    train_seconds = time.perf_counter() - start
+    accuracy = accuracy_score(y_test, model.predict(X_test))
+
+    # End-to-end latency: raw text through the vectorizer and the model
+    start = time.perf_counter()
+    model.predict(vectorizer.transform(sample_texts))
+    latency_ms = (time.perf_counter() - start) * 1000 * (1000 / max(len(sample_texts), 1))
+
+    return {
+        'vectorizer': vec_name,
+        'classifier': clf_name,
+        'accuracy': accuracy,
+        'train_seconds': train_seconds,
+        'latency_ms_per_1k': latency_ms,
+        'size_bytes': len(pickle.dumps((vectorizer, model), protocol=pickle.HIGHEST_PROTOCOL)),
+    }
+
+
+def _data_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+def run_sweep(workers=None, cache_dir='.model_selection_cache',
+              vectorizers=VECTORIZER_GRID, classifiers=CLASSIFIERS):
+    os.makedirs(cache_dir, exist_ok=True)
+    X, y = load_dataset()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_test = X_train.tolist(), X_test.tolist()
+    y_train, y_test = np.asarray(y_train), np.asarray(y_test)
+    sample_texts = X_test[:LATENCY_SAMPLE]
+    data_digest = _data_digest(DEFAULT_CORPORA)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        print(f"Vectorizing {len(vectorizers)} configurations...")
+        vec_futures = [pool.submit(vectorize_job, name, spec, X_train, X_test, cache_dir, data_digest)
+                       for name, spec in vectorizers.items()]
+        prefixes = {}
+        for future in vec_futures:
+            name, prefix, seconds = future.result()
+            prefixes[name] = prefix
+            print(f"  {name}: {'cached' if seconds == 0 else f'{seconds:.2f}s'}")
+
+        print(f"Training {len(prefixes) * len(classifiers)} models...")
+        clf_futures = [pool.submit(classifier_job, vec_name, clf_name, prefix, y_train, y_test, sample_texts)
+                       for vec_name, prefix in prefixes.items() for clf_name in classifiers]
+        results = [future.result() for future in clf_futures]
+
+    results.sort(key=lambda r: (-r['accuracy'], r['latency_ms_per_1k']))
+    print(f"\n{'Vectorizer':<18}{'Classifier':<12}{'Accuracy':>9}{'Train s':>9}{'ms/1k':>9}{'Size KiB':>10}")
+    for r in results:
+        print(f"{r['vectorizer']:<18}{r['classifier']:<12}{r['accuracy']*100:>8.2f}%"
+              f"{r['train_seconds']:>9.2f}{r['latency_ms_per_1k']:>9.1f}{r['size_bytes']/1024:>10.0f}")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sweep vectorizer and classifier settings.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--cache-dir', default='.model_selection_cache', help="Where vectorized matrices are cached")
+    parser.add_argument('--json', help="Also write the result rows to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = run_sweep(args.workers, args.cache_dir)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,116 @@
+"""
+Near-duplicate grouping of messages within a scan.
+
+Spam campaigns send many copies of one template with small changes (name,
+link, tracking id). Each message body is reduced to its set of word tokens
+and summarised by a MinHash signature: for each of NUM_PERM hash functions,
+the smallest hash over the set. Two signatures agree in about as many
+places as the Jaccard similarity of the two sets. NearDuplicateIndex
+buckets signatures by BANDS bands of ROWS values (LSH), so a message is only
+compared with messages it shares a whole band with. A message joins the first
+cluster whose representative is estimated at least `threshold` similar, or
+else starts a new cluster. SimHash was not used: on short emails a couple of
+changed tokens move its fingerprint by more bits than its bands can tolerate.
+"""
+import re
+import threading
+import zlib
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity of the token sets at which two bodies are the same message
+THRESHOLD = 0.8
+# Shorter texts have too few tokens for a meaningful signature
+MIN_TOKENS = 8
+# Only the start of a body is compared; templates differ early if at all
+MAX_CHARS = 16 * 1024
+
+_TOKEN = re.compile(r'(?u)\b\w\w+\b')
+# (a * x + b) mod p over 32-bit token hashes x, with a < 2**31 so nothing overflows 64 bits
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+
+
+def minhash(text):
+    """MinHash signature of `text`'s word tokens, or None if it has fewer than MIN_TOKENS distinct ones."""
+    tokens = set(_TOKEN.findall(text[:MAX_CHARS].lower()))
+    if len(tokens) < MIN_TOKENS:
+        return None
+    hashes = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens),
+                         dtype=np.uint64, count=len(tokens))
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the token sets behind two signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """
+    Groups messages of one scan into clusters of near-duplicates. Cluster
+    ids are the representative's message id. A verdict stored for a cluster
+    applies to every member. Safe to share between scanner threads.
+    """
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self._bands = [{} for _ in range(BANDS)]
+        self._signatures = {}
+        self._cluster_of = {}
+        self._sizes = {}
+        self._verdicts = {}
+        self._lock = threading.Lock()
+
+    def add(self, msg_id, text):
+        """Assigns `msg_id` to a cluster and returns the cluster id."""
+        signature = minhash(text)
+        keys = None if signature is None else \
+            [signature[band * ROWS:(band + 1) * ROWS].tobytes() for band in range(BANDS)]
+        with self._lock:
+            cluster = self._cluster_of.get(msg_id)
+            if cluster is not None:
+                return cluster
+            if keys is not None:
+                cluster = self._find(signature, keys)
+            if cluster is None:
+                cluster = msg_id
+                if keys is not None:
+                    self._signatures[msg_id] = signature
+                    for table, key in zip(self._bands, keys):
+                        table.setdefault(key, []).append(msg_id)
+            self._cluster_of[msg_id] = cluster
+            self._sizes[cluster] = self._sizes.get(cluster, 0) + 1
+        return cluster
+
+    def _find(self, signature, keys):
+        checked = set()
+        for table, key in zip(self._bands, keys):
+            for cluster in table.get(key, ()):
+                if cluster in checked:
+                    continue
+                if similarity(signature, self._signatures[cluster]) >= self.threshold:
+                    return cluster
+                checked.add(cluster)
+        return None
+
+    def cluster_of(self, msg_id):
+        return self._cluster_of.get(msg_id)
+
+    def size(self, cluster):
+        return self._sizes.get(cluster, 0)
+
+    def get_verdict(self, cluster):
+        """(label, spam_prob) decided for the cluster, or None."""
+        return self._verdicts.get(cluster)
+
+    def set_verdict(self, cluster, verdict):
+        self._verdicts[cluster] = verdict
+
+    def __len__(self):
+        """Number of clusters."""
+        return len(self._sizes)
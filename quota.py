@@ -0,0 +1,56 @@
+"""
+Gmail API quota accounting.
+
+Gmail charges each call a number of quota units and enforces a per-user
+budget of 250 units per second. TokenBucket hands out those units so
+concurrent workers stay under the limit instead of running into 429s.
+"""
+import threading
+import time
+
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'getProfile': 1,
+    'history.list': 2,
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.modify': 5,
+    'messages.trash': 5,
+    'messages.batchModify': 50,
+}
+PER_USER_UNITS_PER_SECOND = 250
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() reserves units up front and sleeps
+    off any deficit, so requests larger than the bucket (e.g. a 100-call
+    batch) are still admitted, just spaced out to the refill rate.
+    """
+
+    def __init__(self, rate=PER_USER_UNITS_PER_SECOND, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        # Quota units handed out so far, per API method
+        self.used = {}
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def penalize(self, seconds):
+        """Drains the bucket for `seconds`, e.g. after Gmail answered 429."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def acquire(self, units, method=None):
+        with self._lock:
+            if method is not None:
+                self.used[method] = self.used.get(method, 0) + units
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
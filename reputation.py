@@ -0,0 +1,172 @@
+"""
+Per-account sender and domain reputation.
+
+Every verdict the model makes, and every message the user moves to Spam or
+marks as not spam, adds to exponentially decayed spam/ham counts for the From
+address and its domain. Counts are stored in SQLite as (spam, ham, updated)
+and only decayed when they are read or written, so the store stays one small
+row per sender.
+When a sender (or, failing that, its domain) has enough recent evidence
+pointing one way, MailboxScanner takes that verdict from headers alone and
+skips the body fetch and inference.
+"""
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parseaddr
+
+REPUTATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reputation.sqlite3')
+
+# A verdict counts half as much after this long
+HALF_LIFE_DAYS = 30
+# Decayed messages needed before a sender or domain verdict is trusted
+MIN_EVIDENCE = 8
+# Smoothed spam share at or above which a sender is spam (ham at or below 1 - this)
+MIN_CONFIDENCE = 0.95
+# A user's action outweighs this many model verdicts
+USER_WEIGHT = 5.0
+# Message ids are remembered this long so re-scans do not count twice
+SEEN_RETENTION_DAYS = 4 * HALF_LIFE_DAYS
+
+_QUERY_CHUNK = 500
+
+
+def sender_keys(sender):
+    """('addr:user@example.com', 'domain:example.com') for a From header, or () if it has no address."""
+    address = parseaddr(sender or '')[1].strip().lower()
+    user, at, domain = address.rpartition('@')
+    if not at or not user or not domain:
+        return ()
+    return f'addr:{address}', f'domain:{domain}'
+
+
+class SenderReputation:
+    def __init__(self, path=REPUTATION_FILE, half_life_days=HALF_LIFE_DAYS, min_evidence=MIN_EVIDENCE,
+                 min_confidence=MIN_CONFIDENCE):
+        self.path = path
+        self.half_life = half_life_days * 86400
+        self.min_evidence = min_evidence
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS reputation (
+                account TEXT NOT NULL,
+                key TEXT NOT NULL,
+                spam REAL NOT NULL,
+                ham REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (account, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS seen (
+                account TEXT NOT NULL,
+                msg_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (account, msg_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS seen_created ON seen (created);
+        ''')
+
+    def _decay(self, value, updated, now):
+        return value * 0.5 ** (max(now - updated, 0) / self.half_life)
+
+    def _counts(self, account, keys, now):
+        """{key: (spam, ham)} decayed to `now`."""
+        keys = list(keys)
+        counts = {}
+        for start in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[start:start + _QUERY_CHUNK]
+            rows = self._conn.execute(
+                'SELECT key, spam, ham, updated FROM reputation WHERE account = ? AND key IN ({})'.format(
+                    ','.join('?' * len(chunk))),
+                (account, *chunk),
+            ).fetchall()
+            for key, spam, ham, updated in rows:
+                counts[key] = (self._decay(spam, updated, now), self._decay(ham, updated, now))
+        return counts
+
+    def _verdict(self, spam, ham):
+        """(label, spam_prob) if the counts are conclusive, else None."""
+        if spam + ham < self.min_evidence:
+            return None
+        # Laplace smoothing keeps a perfect record from reading as certainty
+        prob = (spam + 1) / (spam + ham + 2)
+        if prob >= self.min_confidence:
+            return 1, prob
+        if prob <= 1 - self.min_confidence:
+            return 0, prob
+        return None
+
+    def lookup(self, account, senders):
+        """
+        Returns {sender: (label, spam_prob)} for the From headers whose
+        address, or else domain, has a conclusive record. Once an address
+        has enough evidence of its own, its domain is not consulted.
+        """
+        keyed = {sender: sender_keys(sender) for sender in set(senders)}
+        with self._lock:
+            counts = self._counts(account, {key for keys in keyed.values() for key in keys}, time.time())
+        verdicts = {}
+        for sender, keys in keyed.items():
+            if not keys:
+                continue
+            address, domain = keys
+            spam, ham = counts.get(address, (0.0, 0.0))
+            if spam + ham >= self.min_evidence:
+                verdict = self._verdict(spam, ham)
+            else:
+                verdict = self._verdict(*counts.get(domain, (0.0, 0.0)))
+            if verdict is not None:
+                verdicts[sender] = verdict
+        return verdicts
+
+    def record(self, account, verdicts, weight=1.0):
+        """
+        Adds [(msg_id, sender, label), ...] to the counts. Messages already
+        recorded for `account` are skipped, so re-scanning the same mail
+        does not inflate a sender's record. Returns the number counted.
+        """
+        now = time.time()
+        with self._lock:
+            fresh = []
+            for msg_id, sender, label in verdicts:
+                # Without an address there is nothing to count; leave it unseen for a later scan
+                if not sender_keys(sender):
+                    continue
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO seen (account, msg_id, created) VALUES (?, ?, ?)', (account, msg_id, now))
+                if cursor.rowcount:
+                    fresh.append((sender, label))
+            self._add(account, fresh, weight, now)
+            self._conn.execute('DELETE FROM seen WHERE created < ?', (now - SEEN_RETENTION_DAYS * 86400,))
+            self._conn.commit()
+        return len(fresh)
+
+    def record_user_action(self, account, senders, label):
+        """Counts a user's verdict on messages from `senders`, e.g. after Move to Spam or Mark as Not Spam."""
+        now = time.time()
+        with self._lock:
+            self._add(account, [(sender, label) for sender in senders], USER_WEIGHT, now)
+            self._conn.commit()
+
+    def _add(self, account, labelled, weight, now):
+        deltas = {}
+        for sender, label in labelled:
+            for key in sender_keys(sender):
+                spam, ham = deltas.get(key, (0.0, 0.0))
+                deltas[key] = (spam + weight, ham) if int(label) == 1 else (spam, ham + weight)
+        if not deltas:
+            return
+        counts = self._counts(account, deltas, now)
+        rows = []
+        for key, (spam, ham) in deltas.items():
+            old_spam, old_ham = counts.get(key, (0.0, 0.0))
+            rows.append((account, key, old_spam + spam, old_ham + ham, now))
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO reputation (account, key, spam, ham, updated) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,179 @@
+"""
+Columnar store for scan results.
+
+Results are kept as one column per field, with a row index by message id,
+instead of a list of dicts rebuilt into a DataFrame on every rerun.
+Filters run as vector operations over the numeric columns and are cached
+until the store changes. Only the requested page is ever materialised,
+so rendering cost does not grow with the number of scanned messages.
+Selection is tracked by message id, never by row position. Rows from the
+same near-duplicate cluster can be expanded into the whole cluster, so
+one action covers a whole campaign.
+"""
+from array import array
+import numpy as np
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class ResultsStore:
+    def __init__(self):
+        self.ids = []
+        self.subjects = []
+        self.senders = []
+        self.snippets = []
+        # Near-duplicate cluster id per row; the message's own id if it was not clustered
+        self.clusters = []
+        self._members = {}
+        self._labels = array('b')
+        self._spam_probs = array('d')
+        # 0 once a message was moved or trashed; rows are never reordered
+        self._alive = array('b')
+        self._rows = {}
+        self.selected = set()
+        # Bumped on every change, e.g. to key widgets that show the store
+        self.version = 0
+        self._query_cache = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, msg_id):
+        return msg_id in self._rows
+
+    # Copies, not views: a NumPy view would pin the arrays and block appends
+    @property
+    def labels(self):
+        return np.array(self._labels, dtype=np.int8)
+
+    @property
+    def spam_probs(self):
+        return np.array(self._spam_probs, dtype=np.float64)
+
+    @property
+    def alive(self):
+        return np.array(self._alive, dtype=bool)
+
+    def add(self, results):
+        """Appends scanner results (dicts with id, subject, snippet, label, spam_prob, sender, cluster)."""
+        for result in results:
+            row = self._rows.get(result['id'])
+            if row is not None:
+                # Re-scanned: keep the row, refresh the verdict
+                self._labels[row] = int(result['label'])
+                self._spam_probs[row] = float(result['spam_prob'])
+                self._alive[row] = 1
+                continue
+            cluster = result.get('cluster') or result['id']
+            self._members.setdefault(cluster, []).append(len(self.ids))
+            self._rows[result['id']] = len(self.ids)
+            self.clusters.append(cluster)
+            self.ids.append(result['id'])
+            self.subjects.append(result['subject'])
+            self.senders.append(result.get('sender', ''))
+            self.snippets.append(result['snippet'])
+            self._labels.append(int(result['label']))
+            self._spam_probs.append(float(result['spam_prob']))
+            self._alive.append(1)
+        self._changed()
+
+    def remove(self, msg_ids):
+        """Drops messages from every view, e.g. after they were moved or trashed."""
+        for msg_id in msg_ids:
+            row = self._rows.pop(msg_id, None)
+            if row is not None:
+                self._alive[row] = 0
+            self.selected.discard(msg_id)
+        self._changed()
+
+    def relabel(self, msg_ids, label):
+        """Sets the verdict of messages the user labelled themselves, at full confidence."""
+        for msg_id in msg_ids:
+            row = self._rows.get(msg_id)
+            if row is not None:
+                self._labels[row] = int(label)
+                self._spam_probs[row] = float(label)
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._query_cache.clear()
+
+    def get(self, msg_id):
+        row = self._rows.get(msg_id)
+        return None if row is None else self._row(row)
+
+    def _row(self, row):
+        prob = self._spam_probs[row]
+        return {
+            'id': self.ids[row],
+            'subject': self.subjects[row],
+            'sender': self.senders[row],
+            'snippet': self.snippets[row],
+            'label': self._labels[row],
+            'spam_prob': prob,
+            'confidence': max(prob, 1.0 - prob),
+            'copies': self._cluster_size(self.clusters[row]),
+            'selected': self.ids[row] in self.selected,
+        }
+
+    def _cluster_size(self, cluster):
+        return sum(self._alive[row] for row in self._members[cluster])
+
+    def cluster_ids(self, msg_ids):
+        """The given ids plus every live near-duplicate of them, in scan order."""
+        rows = set()
+        for msg_id in msg_ids:
+            row = self._rows.get(msg_id)
+            if row is not None:
+                rows.update(r for r in self._members[self.clusters[row]] if self._alive[r])
+        return [self.ids[row] for row in sorted(rows)]
+
+    def query(self, label=None, sender=None, min_confidence=None):
+        """
+        Row numbers (in scan order) of live messages matching all given
+        filters: label (1 spam, 0 ham), a case-insensitive sender
+        substring, and the minimum confidence max(p, 1 - p) of the verdict.
+        """
+        key = (label, sender, min_confidence)
+        rows = self._query_cache.get(key)
+        if rows is not None:
+            return rows
+        mask = self.alive
+        if label is not None:
+            mask &= self.labels == label
+        if min_confidence is not None:
+            probs = self.spam_probs
+            mask &= np.maximum(probs, 1.0 - probs) >= min_confidence
+        rows = np.flatnonzero(mask)
+        if sender:
+            needle = sender.lower()
+            senders = self.senders
+            rows = rows[[needle in senders[row].lower() for row in rows.tolist()]] if len(rows) else rows
+        self._query_cache[key] = rows
+        return rows
+
+    def page(self, rows, page, page_size=DEFAULT_PAGE_SIZE):
+        """Materialises page number `page` (0-based) of a query() result as row dicts."""
+        start = page * page_size
+        return [self._row(row) for row in rows[start:start + page_size].tolist()]
+
+    def ids_of(self, rows):
+        return [self.ids[row] for row in rows.tolist()]
+
+    def spam_ids(self):
+        return self.ids_of(self.query(label=1))
+
+    def spam_count(self):
+        return len(self.query(label=1))
+
+    def select(self, msg_ids, selected=True):
+        msg_ids = [msg_id for msg_id in msg_ids if msg_id in self._rows]
+        if selected:
+            self.selected.update(msg_ids)
+        else:
+            self.selected.difference_update(msg_ids)
+
+    def selected_ids(self):
+        """Selected ids in scan order."""
+        return sorted(self.selected, key=self._rows.__getitem__)
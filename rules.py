@@ -0,0 +1,204 @@
+"""
+Rule-based pre-filter that runs before SpamFilter.
+
+A RuleSet decides a message from its sender and headers (at the metadata
+stage, before any body is fetched) or from its subject and text, and records
+which rule fired. Checks run in this order, and the first one to decide wins:
+
+1. Sender allow list (ham), then deny list (spam). Entries are full
+   addresses or domains; a domain also covers its subdomains.
+2. Header checks: authentication failure (DMARC fail, or SPF and DKIM
+   both failing in Authentication-Results), a Reply-To domain that differs
+   from the From domain, and a List-Unsubscribe header. Each check has a
+   label (1 spam, 0 ham) or is off (null, the default): forwarded and
+   mailing-list mail fails these checks often enough that none is on
+   unless the rules file turns it on.
+3. Keyword patterns (case-insensitive regexes). They are compiled into
+   one alternation of named groups, so the text is scanned once however
+   many patterns there are. Patterns that cannot share an alternation
+   (inline global flags such as (?s), named groups, or references to a
+   group by number) are searched on their own. The earliest match in the
+   text wins, and the first rule wins at the same position.
+
+The rules live in a JSON file (RULES_FILE), for example:
+
+    {
+      "allow": ["boss@example.com", "example.org"],
+      "deny": ["promo-mail.biz"],
+      "headers": {"auth_failure": 1, "reply_to_mismatch": null, "list_unsubscribe": null},
+      "keywords": [{"name": "prize", "pattern": "you (have )?won", "label": 1}]
+    }
+
+Without a file no rule is active. report() gives
+how often each rule decided a message and how long each check took.
+"""
+import json
+import os
+import re
+import threading
+import time
+from email.utils import parseaddr
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+# Headers the metadata stage asks Gmail for when rules are in use
+RULE_HEADERS = ['Subject', 'From', 'Reply-To', 'List-Unsubscribe', 'Authentication-Results']
+DEFAULT_HEADER_RULES = {'auth_failure': None, 'reply_to_mismatch': None, 'list_unsubscribe': None}
+
+_AUTH_RESULT = re.compile(r'\b(spf|dkim|dmarc)\s*=\s*(\w+)', re.I)
+# \1 or (?(1)...) outside an escape; in an alternation the number would point at another rule's group
+_NUMBERED_REF = re.compile(r'(?:^|[^\\])(?:\\\\)*(?:\\[1-9]|\(\?\(\d)')
+
+
+def _address(header):
+    return parseaddr(header or '')[1].strip().lower()
+
+
+def _domain(header):
+    return _address(header).rpartition('@')[2]
+
+
+def _base_domain(domain):
+    """'mail.example.co' -> 'example.co'; good enough to tell two senders' organisations apart."""
+    return '.'.join(domain.split('.')[-2:])
+
+
+class RuleSet:
+    def __init__(self, allow=(), deny=(), headers=None, keywords=()):
+        self.allow = frozenset(entry.strip().lower().lstrip('@') for entry in allow)
+        self.deny = frozenset(entry.strip().lower().lstrip('@') for entry in deny)
+        self.header_rules = dict(DEFAULT_HEADER_RULES)
+        for name, label in (headers or {}).items():
+            if name not in DEFAULT_HEADER_RULES:
+                raise ValueError(f"Unknown header rule: {name}")
+            self.header_rules[name] = label
+        self.keyword_labels = {}
+        groups = []
+        # [(group, compiled pattern)] of the patterns searched on their own
+        self._separate = []
+        for i, rule in enumerate(keywords):
+            # Group names must be identifiers; the rule name is kept separately
+            group = f'k{i}'
+            self.keyword_labels[group] = (rule['name'], int(rule['label']))
+            # Validate each pattern on its own so an error names the rule
+            try:
+                compiled = re.compile(rule['pattern'])
+                if compiled.flags & ~re.UNICODE or compiled.groupindex or _NUMBERED_REF.search(rule['pattern']):
+                    self._separate.append((group, re.compile(rule['pattern'], re.I)))
+                    continue
+            except re.error as e:
+                raise ValueError(f"Bad pattern for keyword rule {rule['name']!r}: {e}") from e
+            groups.append((group, f"(?P<{group}>{rule['pattern']})"))
+        try:
+            self._keywords = re.compile('|'.join(part for _, part in groups), re.I) if groups else None
+        except re.error as e:
+            raise ValueError(f"Keyword rule {self._rule_at(groups, e.pos)!r} cannot be combined "
+                             f"with the others: {e}") from e
+        self.checked = 0
+        self.hits = {}
+        self.seconds = {'senders': 0.0, 'headers': 0.0, 'keywords': 0.0}
+        self._lock = threading.Lock()
+
+    def _rule_at(self, groups, pos):
+        """Name of the rule whose part of the combined pattern covers position `pos`."""
+        end = 0
+        for group, part in groups:
+            end += len(part) + 1
+            if pos is not None and pos < end:
+                return self.keyword_labels[group][0]
+        return self.keyword_labels[groups[-1][0]][0]
+
+    @classmethod
+    def from_file(cls, path=RULES_FILE):
+        """Loads the rules from JSON; a missing file gives the default rules."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config.get('allow', ()), config.get('deny', ()), config.get('headers'),
+                   config.get('keywords', ()))
+
+    @staticmethod
+    def _listed(entries, sender):
+        address = _address(sender)
+        if not entries or not address:
+            return False
+        if address in entries:
+            return True
+        # The domain and each parent domain, e.g. a.b.com, b.com
+        labels = address.rpartition('@')[2].split('.')
+        return any('.'.join(labels[i:]) in entries for i in range(len(labels) - 1))
+
+    def _check_senders(self, sender):
+        if self._listed(self.allow, sender):
+            return 'allow_list', 0
+        if self._listed(self.deny, sender):
+            return 'deny_list', 1
+        return None
+
+    def _check_headers(self, headers):
+        for name, label in self.header_rules.items():
+            if label is None:
+                continue
+            if name == 'auth_failure':
+                results = {method.lower(): result.lower()
+                           for method, result in _AUTH_RESULT.findall(headers.get('authentication-results', ''))}
+                fired = results.get('dmarc') == 'fail' or \
+                    (results.get('spf') == 'fail' and results.get('dkim') == 'fail')
+            elif name == 'reply_to_mismatch':
+                reply_to = _domain(headers.get('reply-to'))
+                fired = bool(reply_to) and _base_domain(reply_to) != _base_domain(_domain(headers.get('from')))
+            else:
+                fired = bool(headers.get('list-unsubscribe'))
+            if fired:
+                return name, int(label)
+        return None
+
+    def _check_keywords(self, text):
+        matches = []
+        if self._keywords is not None:
+            match = self._keywords.search(text)
+            if match is not None:
+                matches.append((match.start(), int(match.lastgroup[1:])))
+        for group, pattern in self._separate:
+            match = pattern.search(text)
+            if match is not None:
+                matches.append((match.start(), int(group[1:])))
+        if not matches:
+            return None
+        return self.keyword_labels[f'k{min(matches)[1]}']
+
+    def check(self, sender, text, headers=None):
+        """
+        Returns (rule name, label) for the first rule that decides the
+        message, or None. `headers` maps header names to values; without
+        them the header checks are skipped.
+        """
+        spent = {}
+        decision = None
+        if self.allow or self.deny:
+            start = time.perf_counter()
+            decision = self._check_senders(sender)
+            spent['senders'] = time.perf_counter() - start
+        if decision is None and headers is not None:
+            start = time.perf_counter()
+            decision = self._check_headers({name.lower(): value for name, value in headers.items()})
+            spent['headers'] = time.perf_counter() - start
+        if decision is None and (self._keywords is not None or self._separate):
+            start = time.perf_counter()
+            decision = self._check_keywords(text)
+            spent['keywords'] = time.perf_counter() - start
+
+        with self._lock:
+            self.checked += 1
+            for stage, seconds in spent.items():
+                self.seconds[stage] += seconds
+            if decision is not None:
+                self.hits[decision[0]] = self.hits.get(decision[0], 0) + 1
+        return decision
+
+    def report(self):
+        """Messages checked, rule hit counts (most frequent first) and milliseconds spent per check."""
+        with self._lock:
+            hits = sorted(self.hits.items(), key=lambda item: -item[1])
+            timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.seconds.items()}
+        return {'checked': self.checked, 'hits': dict(hits), 'ms': timings}
@@ -1,8 +1,40 @@
-from gmail_service import GmailService
+from gmail_service import GmailService, GmailApiError, BATCH_SIZE
 from spam_filter import SpamFilter
+from scanner import ConcurrentScanner, MailboxScanner, SpamMover
+from message_cache import MessageCache
+from reputation import SenderReputation
+from near_duplicates import NearDuplicateIndex
+from rules import RULES_FILE, RuleSet
+from quota import PER_USER_UNITS_PER_SECOND, TokenBucket
+import argparse
 import time
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scan a Gmail inbox and move spam to the Spam folder.")
+    parser.add_argument('--query', default='is:unread', help="Gmail search query to scan (default: is:unread)")
+    parser.add_argument('--limit', type=int, default=None, help="Stop after this many messages (default: whole mailbox)")
+    parser.add_argument('--page-size', type=int, default=BATCH_SIZE, help="Messages listed and fetched per page")
+    parser.add_argument('--incremental', action='store_true', help="Only scan unread mail that arrived since the last run")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the local message/verdict cache")
+    parser.add_argument('--metadata-first', action='store_true', help="Classify from headers/snippet and fetch full bodies only when unsure")
+    parser.add_argument('--group-duplicates', action='store_true',
+                        help="Classify one message per group of near-identical messages")
+    parser.add_argument('--rules', default=RULES_FILE, help="JSON file of allow/deny lists, header and keyword rules")
+    parser.add_argument('--no-rules', action='store_true', help="Skip the rules stage")
+    parser.add_argument('--no-reputation', action='store_true', help="Do not read or write the sender reputation index")
+    parser.add_argument('--yes', action='store_true', help="Move spam while the scan runs, without asking")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Fetch and classify this many chunks concurrently (default: sequential)")
+    parser.add_argument('--chunk-size', type=int, default=25, help="Messages per concurrent fetch")
+    parser.add_argument('--rate', type=float, default=PER_USER_UNITS_PER_SECOND,
+                        help="Gmail quota units per second to stay under")
+    args = parser.parse_args()
+    if args.workers and args.incremental:
+        parser.error("--incremental cannot be combined with --workers")
+    return args
+
 def main():
+    args = parse_args()
     print("Initializing Gmail Spam Remover...")
     
     # Get user email
@@ -16,7 +48,7 @@ def main():
     if os.path.exists('token.json'):
         print("Checking existing login session...")
         try:
-            temp_service = GmailService(token_path='token.json')
+            temp_service = GmailService.from_token_file('token.json', interactive=False)
             existing_email = temp_service.get_email_address()
             if existing_email:
                 new_path = f'token_{existing_email}.json'
@@ -30,12 +62,8 @@ def main():
             print(f"Warning during migration: {e}")
 
     try:
-        # Initialize components
-        spam_filter = SpamFilter()
-        print("Spam filter loaded successfully.")
-        
         # Initialize with specific token path
-        gmail = GmailService(token_path=user_token_path)
+        gmail = GmailService.from_token_file(user_token_path)
         authenticated_email = gmail.get_email_address()
         
         if authenticated_email and authenticated_email.lower() != target_email.lower():
@@ -48,59 +76,115 @@ def main():
             
             # Re-initialize to trigger auth flow for the correct targeted email
             print("Please authenticate with the correct account in the browser...")
-            gmail = GmailService(token_path=user_token_path)
+            gmail = GmailService.from_token_file(user_token_path)
             authenticated_email = gmail.get_email_address()
             
             print(f"Successfully authenticated as {authenticated_email}")
         else:
             print(f"Successfully authenticated as {authenticated_email}")
 
-        print("\nScanning for unread emails...")
-        messages = gmail.get_unread_messages(max_results=50)
-        
-        if not messages:
-            print("No unread messages found.")
-            return
+        # The account's own model, personalised by feedback given in the app
+        spam_filter = SpamFilter.for_account(authenticated_email or target_email)
+        print("Spam filter loaded successfully.")
 
-        print(f"Found {len(messages)} unread messages. Analyzing...")
+        print("\nScanning for unread emails...")
+        cache = None if args.no_cache else MessageCache()
+        reputation = None if args.no_reputation else SenderReputation()
+        duplicates = NearDuplicateIndex() if args.group_duplicates else None
+        rules = None if args.no_rules else RuleSet.from_file(args.rules)
+        # Shared by every worker connection so the account stays under its quota
+        gmail.rate_limiter = TokenBucket(args.rate)
+        mover = None
+        if args.workers:
+            scanner = ConcurrentScanner(gmail, spam_filter, workers=args.workers, chunk_size=args.chunk_size,
+                                        cache=cache, account=authenticated_email,
+                                        metadata_first=args.metadata_first, reputation=reputation,
+                                        duplicates=duplicates, rules=rules)
+        else:
+            scanner = MailboxScanner(gmail, spam_filter, page_size=args.page_size, cache=cache, account=authenticated_email,
+                                     metadata_first=args.metadata_first, reputation=reputation,
+                                     duplicates=duplicates, rules=rules)
+        if args.yes:
+            # Moves run on their own connection while scanning continues, once listing is done
+            mover = SpamMover(gmail, after=scanner.listed)
         
         spam_count = 0
         ham_count = 0
         
         spam_ids = []
-        
-        for msg in messages:
-            msg_id = msg['id']
-            content = gmail.get_message_content(msg_id)
-            
-            if not content:
-                continue
-                
-            # Extract subject for logging (optional, get_message_content returns Subject: ...)
-            lines = content.split('\n')
-            subject = lines[0] if lines else "No Subject"
-            
-            if spam_filter.is_spam(content):
-                print(f"[SPAM] {subject}")
-                # Store ID for later processing
-                spam_ids.append(msg_id)
-                spam_count += 1
-            else:
-                print(f"[HAM]  {subject}")
-                ham_count += 1
+        moved_count = 0
+
+        if args.workers:
+            pages = scanner.iter_results(args.query, limit=args.limit)
+        elif args.incremental:
+            pages = scanner.iter_incremental_pages(authenticated_email, limit=args.limit)
+        else:
+            pages = scanner.iter_pages(args.query, limit=args.limit)
+        listing_error = None
+        try:
+            for page in pages:
+                if mover is not None:
+                    mover.put([r['id'] for r in page if r['label'] == 1])
+                for result in page:
+                    if result['label'] == 1:
+                        print(f"[SPAM] {result['subject']}")
+                        # Store ID for later processing
+                        if not args.yes:
+                            spam_ids.append(result['id'])
+                        spam_count += 1
+                    else:
+                        print(f"[HAM]  {result['subject']}")
+                        ham_count += 1
+        except GmailApiError as error:
+            # What was classified before the failure is still reported and can be moved
+            listing_error = error
+            print(f"Listing messages failed, the scan is incomplete: {error}")
+
+        if mover is not None:
+            moved, errors = mover.close()
+            moved_count = len(moved)
+            for msg_id, error in errors.items():
+                print(f"Failed to move {msg_id}: {error}")
+        for msg_id, error in scanner.errors.items():
+            print(f"Could not fetch {msg_id}: {error}")
+        if args.metadata_first:
+            print(f"Decided by rules: {scanner.stats['rules_path']}, "
+                  f"from sender reputation: {scanner.stats['reputation_path']}, "
+                  f"from metadata: {scanner.stats['metadata_path']}, "
+                  f"needed full body: {scanner.stats['full_path'] + scanner.stats['duplicate_path']}")
+        if rules is not None:
+            report = rules.report()
+            print(f"Rules decided {scanner.stats['rules_path']} of {report['checked']} messages checked: "
+                  + (", ".join(f"{rule} {hits}" for rule, hits in report['hits'].items()) or "no hits")
+                  + f" ({sum(report['ms'].values()):.1f} ms)")
+        if duplicates is not None:
+            print(f"Near-duplicates: {scanner.stats['duplicate_hits']} messages reused a verdict, "
+                  f"{len(duplicates)} distinct messages.")
+        if cache is not None:
+            print(f"Cache: {scanner.stats['content_cache_hits']} bodies and "
+                  f"{scanner.stats['verdict_cache_hits']} verdicts reused.")
+        print("Quota units used: " + ", ".join(f"{method} {units}" for method, units in sorted(gmail.quota_used.items())))
+
+        if spam_count + ham_count == 0:
+            if listing_error is None:
+                print("No unread messages found.")
+            return
                 
         print(f"\nAnalysis complete.")
-        print(f"Processed: {len(messages)}")
+        print(f"Processed: {spam_count + ham_count}")
         print(f"Spam detected: {spam_count}")
         print(f"Ham detected: {ham_count}")
         
-        if spam_count > 0:
+        if args.yes:
+            print(f"Moved {moved_count} messages to the SPAM folder.")
+        elif spam_count > 0:
             confirm = input(f"\nDo you want to move these {spam_count} spam emails to the SPAM folder? (y/n): ")
             if confirm.lower() == 'y':
                 print("Moving messages to Spam folder...")
-                for spam_id in spam_ids:
-                    gmail.move_to_spam(spam_id)
-                print("Done.")
+                moved, errors = gmail.move_to_spam_many(spam_ids)
+                print(f"Done. Moved {len(moved)} messages.")
+                for msg_id, error in errors.items():
+                    print(f"Failed to move {msg_id}: {error}")
             else:
                 print("Operation cancelled.")
 
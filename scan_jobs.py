@@ -0,0 +1,119 @@
+"""
+Background scan jobs.
+
+A ScanJob runs a MailboxScanner on its own thread and collects results as
+each page is classified, so a UI can show them while the rest of the scan
+is still waiting on Gmail, and stays responsive in the meantime. Jobs are
+addressed by id through a ScanJobRegistry and can be cancelled between
+pages; a cancelled incremental scan does not advance the saved history.
+"""
+import threading
+import time
+import uuid
+from scanner import MailboxScanner
+
+# Small pages put the first results on screen after one short round trip
+JOB_PAGE_SIZE = 25
+
+PENDING, RUNNING, DONE, CANCELLED, FAILED = 'pending', 'running', 'done', 'cancelled', 'failed'
+
+
+class ScanJob:
+    def __init__(self, gmail, spam_filter, limit=None, incremental=False, metadata_first=False,
+                 cache=None, account=None, query='is:unread', page_size=JOB_PAGE_SIZE, reputation=None,
+                 duplicates=None, rules=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.limit = limit
+        self.incremental = incremental
+        self.account = account
+        self.query = query
+        self.status = PENDING
+        self.error = None
+        self.started = self.finished = None
+        # The job's own client, so it never shares a connection with the UI thread
+        self.scanner = MailboxScanner(gmail.clone(), spam_filter, page_size=page_size, cache=cache,
+                                      account=account, metadata_first=metadata_first, reputation=reputation,
+                                      duplicates=duplicates, rules=rules)
+        self._results = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'scan-{self.id}', daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self.status = RUNNING
+        self._thread.start()
+        return self
+
+    def _run(self):
+        if self.incremental:
+            pages = self.scanner.iter_incremental_pages(self.account, limit=self.limit)
+        else:
+            pages = self.scanner.iter_pages(self.query, limit=self.limit)
+        status = DONE
+        try:
+            for page in pages:
+                with self._lock:
+                    self._results.extend(page)
+                if self._cancel.is_set():
+                    # Closing the generator skips saving the new historyId
+                    pages.close()
+                    status = CANCELLED
+                    break
+        except Exception as e:
+            self.error = e
+            status = FAILED
+            print(f"Scan job {self.id} failed: {e}")
+        finally:
+            # finished is set first: done jobs always have a finish time
+            self.finished = time.time()
+            self.status = status
+
+    def cancel(self):
+        """Asks the job to stop after the page it is working on."""
+        self._cancel.set()
+
+    @property
+    def done(self):
+        return self.status in (DONE, CANCELLED, FAILED)
+
+    @property
+    def count(self):
+        with self._lock:
+            return len(self._results)
+
+    def results_since(self, offset):
+        """Results that arrived after the first `offset` ones, in scan order."""
+        with self._lock:
+            return self._results[offset:]
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+class ScanJobRegistry:
+    """Process-wide table of scan jobs by id; keeps the newest finished ones."""
+
+    def __init__(self, max_finished=20):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, *args, **kwargs):
+        job = ScanJob(*args, **kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = sorted((j for j in self._jobs.values() if j.done), key=lambda j: j.finished)
+            for old in finished[:max(len(finished) - self.max_finished, 0)]:
+                del self._jobs[old.id]
+        return job.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
@@ -0,0 +1,532 @@
+"""
+Streaming mailbox scan.
+
+Listing, fetching, classification and actioning happen one page at a time,
+so only a single page of message bodies is ever held in memory no matter
+how large the mailbox is.
+"""
+import json
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from gmail_service import BATCH_SIZE, BATCH_MODIFY_SIZE, METADATA_HEADERS
+from rules import RULE_HEADERS
+
+SCAN_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scan_state.json')
+# Several accounts may finish a scan at once (batch_runner.py)
+_state_lock = threading.Lock()
+
+
+def load_scan_state(account, state_file=SCAN_STATE_FILE):
+    """
+    Returns (historyId, pending ids) saved by the last completed scan of
+    `account`. Pending ids were listed but not classified, because they were
+    past the scan limit or could not be fetched, and are scanned first next time.
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f).get(account)
+    except (OSError, ValueError):
+        return None, []
+    if isinstance(state, dict):
+        return state.get('history_id'), state.get('pending', [])
+    # Saved before pending ids were tracked: just the historyId
+    return state, []
+
+
+def save_scan_state(account, history_id, pending=(), state_file=SCAN_STATE_FILE):
+    with _state_lock:
+        _save_scan_state(account, history_id, pending, state_file)
+
+
+def _save_scan_state(account, history_id, pending, state_file):
+    try:
+        states = {}
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                states = json.load(f)
+        states[account] = {'history_id': history_id, 'pending': list(pending)}
+        tmp_file = state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(states, f)
+        os.replace(tmp_file, state_file)
+    except (OSError, ValueError) as e:
+        print(f"Failed to save scan state: {e}")
+
+
+class MailboxScanner:
+    def __init__(self, gmail, spam_filter, page_size=BATCH_SIZE, cache=None, account=None,
+                 metadata_first=False, reputation=None, duplicates=None, rules=None):
+        """
+        If a MessageCache is given, message text and verdicts for `account`
+        are looked up there first, so re-scans skip both the Gmail fetch and
+        inference for messages already seen.
+
+        With metadata_first=True, uncached messages are first classified
+        from their subject and snippet (format='metadata'); only those the
+        model is not confident about are fetched in full.
+
+        If a SenderReputation is given, every model verdict is added to it,
+        and with metadata_first=True messages from senders with a conclusive
+        record are decided from the From header alone, before any inference.
+
+        If a NearDuplicateIndex is given, fetched messages are grouped into
+        near-duplicate clusters and only the first message of each cluster
+        is classified; the rest of the cluster reuses its verdict.
+
+        If a RuleSet is given, it runs before any other stage: with
+        metadata_first=True on the sender, headers and subject + snippet,
+        before bodies are fetched; otherwise on the fetched message, before
+        inference. Messages it decides skip the model entirely.
+        """
+        self.gmail = gmail
+        self.spam_filter = spam_filter
+        self.page_size = page_size
+        self.cache = cache
+        self.account = account
+        self.metadata_first = metadata_first
+        self.reputation = reputation
+        self.duplicates = duplicates
+        self.rules = rules
+        self.errors = {}
+        # Set once the current scan's listing is exhausted; moves must wait for it, see SpamMover
+        self.listed = threading.Event()
+        # Set by iter_incremental_pages: False when it fell back to a full scan
+        self.incremental = False
+        self.stats = {
+            'content_cache_hits': 0, 'verdict_cache_hits': 0, 'fetched': 0, 'classified': 0,
+            # Verdicts copied from an earlier message of the same near-duplicate cluster
+            'duplicate_hits': 0,
+            # How many results were decided from sender reputation, metadata, the full body or a
+            # near-duplicate's full body
+            'rules_path': 0, 'reputation_path': 0, 'metadata_path': 0, 'full_path': 0, 'duplicate_path': 0,
+        }
+
+    def _get_cached_contents(self, msg_ids):
+        """Returns {msg_id: ParsedMessage} for the messages already cached."""
+        if self.cache is None:
+            return {}
+        contents = self.cache.get_contents(self.account, msg_ids)
+        self.stats['content_cache_hits'] += len(contents)
+        return contents
+
+    def _fetch_contents(self, msg_ids):
+        if not msg_ids:
+            return {}
+        parsed, errors = self.gmail.get_messages_content(msg_ids, self.page_size)
+        self.errors.update(errors)
+        fetched = {msg_id: message for msg_id, message in zip(msg_ids, parsed) if message is not None}
+        # A metadata failure does not count once the full fetch got the message
+        for msg_id in fetched:
+            self.errors.pop(msg_id, None)
+        self.stats['fetched'] += len(fetched)
+        if self.cache is not None and fetched:
+            self.cache.put_contents(self.account, fetched)
+        return fetched
+
+    @staticmethod
+    def _metadata_result(msg_id, meta, label, prob, path):
+        return {
+            'id': msg_id,
+            'subject': meta['subject'],
+            'sender': meta['from'],
+            'snippet': meta['snippet'][:200],
+            'label': int(label),
+            'spam_prob': float(prob),
+            'path': path,
+        }
+
+    def _classify_rules(self, fetched):
+        """Returns {msg_id: result} for the messages a rule decides from their metadata."""
+        results = {}
+        for msg_id, meta in fetched:
+            decision = self.rules.check(meta['from'], f"Subject: {meta['subject']}\n{meta['snippet']}",
+                                        meta['headers'])
+            if decision is not None:
+                rule, label = decision
+                results[msg_id] = {**self._metadata_result(msg_id, meta, label, label, 'rules'), 'rule': rule}
+        return results
+
+    def _classify_reputation(self, fetched):
+        """Returns {msg_id: result} for the messages whose sender has a conclusive record."""
+        verdicts = self.reputation.lookup(self.account, [meta['from'] for _, meta in fetched])
+        return {
+            msg_id: self._metadata_result(msg_id, meta, *verdicts[meta['from']], 'reputation')
+            for msg_id, meta in fetched if meta['from'] in verdicts
+        }
+
+    def _classify_metadata(self, msg_ids):
+        """
+        Classifies from the rules, the sender's reputation, then subject +
+        snippet. Returns {msg_id: result} for the confident verdicts;
+        everything else is left for a full fetch. Results cached for the
+        current model version are reused without a metadata request.
+        """
+        # One snapshot, so the verdicts are filed under the version that produced them
+        state = self.spam_filter.state
+        model_version = state[2]
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.get_metadata_results(self.account, msg_ids, model_version)
+            self.stats['verdict_cache_hits'] += len(cached)
+            msg_ids = [msg_id for msg_id in msg_ids if msg_id not in cached]
+        results = self._classify_metadata_uncached(msg_ids, state) if msg_ids else {}
+        if self.cache is not None and results:
+            self.cache.put_metadata_results(self.account, model_version, results)
+        return {**cached, **results}
+
+    def _classify_metadata_uncached(self, msg_ids, state):
+        headers = RULE_HEADERS if self.rules is not None else METADATA_HEADERS
+        metadata, errors = self.gmail.get_messages_metadata(msg_ids, self.page_size, headers)
+        self.errors.update(errors)
+        fetched = [(msg_id, meta) for msg_id, meta in zip(msg_ids, metadata) if meta is not None]
+        results = {}
+        if self.rules is not None and fetched:
+            results = self._classify_rules(fetched)
+            fetched = [(msg_id, meta) for msg_id, meta in fetched if msg_id not in results]
+        if self.reputation is not None and fetched:
+            results.update(self._classify_reputation(fetched))
+            fetched = [(msg_id, meta) for msg_id, meta in fetched if msg_id not in results]
+        if not fetched:
+            return results
+        texts = [f"Subject: {meta['subject']}\n{meta['snippet']}" for _, meta in fetched]
+        labels, probs = self.spam_filter.predict_many(texts, state)
+        self.stats['classified'] += len(fetched)
+        confident = self.spam_filter.is_confident(probs)
+        for (msg_id, meta), label, prob, sure in zip(fetched, labels, probs, confident):
+            if sure:
+                results[msg_id] = self._metadata_result(msg_id, meta, label, prob, 'metadata')
+        return results
+
+    def _get_verdicts(self, contents):
+        verdicts = {}
+        state = self.spam_filter.state
+        model_version = state[2]
+        if self.cache is not None:
+            verdicts = self.cache.get_verdicts(self.account, list(contents), model_version)
+            self.stats['verdict_cache_hits'] += len(verdicts)
+        pending = [msg_id for msg_id in contents if msg_id not in verdicts]
+        copies = {}
+        if self.duplicates is not None:
+            pending, copies = self._group_duplicates(contents, verdicts, pending)
+        if pending or copies:
+            labels, probs = self.spam_filter.predict_many([contents[msg_id].text for msg_id in pending], state)
+            new_verdicts = {msg_id: (int(label), float(prob)) for msg_id, label, prob in zip(pending, labels, probs)}
+            self.stats['classified'] += len(new_verdicts)
+            if self.duplicates is not None:
+                for msg_id in pending:
+                    cluster = self.duplicates.cluster_of(msg_id)
+                    if self.duplicates.get_verdict(cluster) is None:
+                        self.duplicates.set_verdict(cluster, new_verdicts[msg_id])
+                for msg_id, cluster in copies.items():
+                    new_verdicts[msg_id] = self.duplicates.get_verdict(cluster)
+                self.stats['duplicate_hits'] += len(copies)
+            if self.cache is not None:
+                self.cache.put_verdicts(self.account, model_version, new_verdicts)
+            verdicts.update(new_verdicts)
+        return verdicts
+
+    def _group_duplicates(self, contents, verdicts, pending):
+        """
+        Clusters this page's messages. Returns (to_classify, copies): the
+        pending ids that need inference, and {msg_id: cluster} for pending
+        ids that take their cluster's verdict instead. A cluster without a
+        verdict yet is classified through its first pending message.
+        """
+        clusters = {msg_id: self.duplicates.add(msg_id, contents[msg_id].text) for msg_id in contents}
+        for msg_id, verdict in verdicts.items():
+            if self.duplicates.get_verdict(clusters[msg_id]) is None:
+                self.duplicates.set_verdict(clusters[msg_id], verdict)
+        to_classify, copies, represented = [], {}, set()
+        for msg_id in pending:
+            cluster = clusters[msg_id]
+            if self.duplicates.get_verdict(cluster) is not None or cluster in represented:
+                copies[msg_id] = cluster
+            else:
+                represented.add(cluster)
+                to_classify.append(msg_id)
+        return to_classify, copies
+
+    def classify_ids(self, msg_ids):
+        """
+        Fetches and classifies one page of message ids.
+        Returns a list of dicts: id, subject, sender, snippet, label, spam_prob and
+        path ('rules', 'reputation', 'metadata', 'full' or 'duplicate', what the
+        verdict was based on). 'rules' results also carry the deciding rule's
+        name. With a NearDuplicateIndex, 'full' and 'duplicate' results carry
+        their cluster id; 'duplicate' ones took the verdict of the cluster's
+        representative rather than being classified on their own.
+        Messages that could not be fetched are recorded in self.errors.
+        """
+        contents = self._get_cached_contents(msg_ids)
+        missing = [msg_id for msg_id in msg_ids if msg_id not in contents]
+        quick = {}
+        if self.metadata_first and missing:
+            quick = self._classify_metadata(missing)
+            missing = [msg_id for msg_id in missing if msg_id not in quick]
+        contents.update(self._fetch_contents(missing))
+        ruled = {}
+        if self.rules is not None:
+            for msg_id, message in contents.items():
+                decision = self.rules.check(message.sender, message.text, message.headers)
+                if decision is not None:
+                    ruled[msg_id] = decision
+        verdicts = self._get_verdicts({msg_id: message for msg_id, message in contents.items()
+                                       if msg_id not in ruled})
+
+        results = []
+        for msg_id in msg_ids:
+            if msg_id in quick:
+                results.append(quick[msg_id])
+                self.stats[quick[msg_id]['path'] + '_path'] += 1
+                continue
+            if msg_id not in contents:
+                continue
+            message = contents[msg_id]
+            if msg_id in ruled:
+                rule, label = ruled[msg_id]
+                results.append({
+                    'id': msg_id,
+                    'subject': message.subject,
+                    'sender': message.sender,
+                    'snippet': message.snippet,
+                    'label': label,
+                    'spam_prob': float(label),
+                    'path': 'rules',
+                    'rule': rule,
+                })
+                self.stats['rules_path'] += 1
+                continue
+            label, prob = verdicts[msg_id]
+            result = {
+                'id': msg_id,
+                'subject': message.subject,
+                'sender': message.sender,
+                'snippet': message.snippet,
+                'label': int(label),
+                'spam_prob': float(prob),
+                'path': 'full',
+            }
+            if self.duplicates is not None:
+                result['cluster'] = self.duplicates.cluster_of(msg_id)
+                if result['cluster'] != msg_id:
+                    result['path'] = 'duplicate'
+            results.append(result)
+            self.stats[result['path'] + '_path'] += 1
+        if self.reputation is not None:
+            # Only model verdicts are fed back; a reputation verdict would only confirm itself,
+            # and a duplicate's verdict is its representative's counted again
+            self.reputation.record(self.account, [(r['id'], r['sender'], r['label'])
+                                                  for r in results if r['path'] in ('metadata', 'full')])
+        return results
+
+    def iter_pages(self, query='is:unread', limit=None, on_page=None):
+        """
+        Yields the classified results of each listed page as soon as it is
+        ready. The next page is only listed once the caller asks for it, and
+        self.listed is set when the listing is exhausted.
+        Moving messages out of the query's results while its pages are being
+        followed makes Gmail skip messages on later pages. So if on_page is
+        given (e.g. to move each page's spam), every page is listed first;
+        on_page(results) then runs before each page is yielded.
+        """
+        self.listed.clear()
+        pages = self.gmail.iter_message_pages(query, self.page_size, limit)
+        if on_page is not None:
+            pages = list(pages)
+            self.listed.set()
+        for stubs in pages:
+            results = self.classify_ids([msg['id'] for msg in stubs])
+            if on_page is not None:
+                on_page(results)
+            yield results
+        self.listed.set()
+
+    def _unclassified(self, msg_ids, results):
+        """Ids of `msg_ids` without a result whose fetch may still succeed later."""
+        done = {result['id'] for result in results}
+        return [msg_id for msg_id in msg_ids
+                if msg_id not in done and getattr(self.errors.get(msg_id), 'retryable', False)]
+
+    def iter_incremental_pages(self, account, limit=None, on_page=None, state_file=SCAN_STATE_FILE):
+        """
+        Like iter_pages('is:unread') but only scans messages added since the
+        last completed scan of `account`, using the Gmail history API, plus
+        the ids that scan left pending. Without a usable historyId (none
+        saved, or expired) every unread id is listed instead.
+        Once every page was consumed the new historyId is saved, together
+        with the ids that were listed but not classified (past `limit`, or
+        failed with a retryable error), so none of them is skipped for good
+        and the next scan is incremental even on a mailbox larger than `limit`.
+        """
+        self.listed.clear()
+        # Taken before listing so mail arriving mid-scan is picked up next time
+        new_history_id = self.gmail.get_history_id()
+        start_history_id, pending = load_scan_state(account, state_file)
+        msg_ids = None
+        if start_history_id:
+            added = self.gmail.get_added_message_ids(start_history_id)
+            if added is None:
+                print("History expired, falling back to a full scan.")
+            else:
+                msg_ids = list(dict.fromkeys(pending + added))
+        self.incremental = msg_ids is not None
+        if msg_ids is None:
+            # Listing costs little quota next to fetching, so the whole listing is
+            # taken and what lies past `limit` is left pending rather than unseen
+            msg_ids = [msg['id'] for stubs in self.gmail.iter_message_pages('is:unread', self.page_size)
+                       for msg in stubs]
+        self.listed.set()
+
+        todo = msg_ids if limit is None else msg_ids[:limit]
+        leftover = []
+        for start in range(0, len(todo), self.page_size):
+            page_ids = todo[start:start + self.page_size]
+            results = self.classify_ids(page_ids)
+            leftover.extend(self._unclassified(page_ids, results))
+            if on_page is not None:
+                on_page(results)
+            yield results
+        leftover.extend(msg_ids[len(todo):])
+
+        if new_history_id:
+            save_scan_state(account, new_history_id, leftover, state_file)
+
+
+class ConcurrentScanner:
+    """
+    Runs several fetch+classify chunks in flight at once on a thread pool.
+    Each worker thread gets its own GmailService clone (own connection) and
+    MailboxScanner; all of them share the account's rate limiter, cache,
+    reputation and near-duplicate indexes, rules and SpamFilter. Pages are
+    listed lazily and at most 2 * workers chunks are queued, so memory
+    stays bounded on large mailboxes.
+    """
+
+    def __init__(self, gmail, spam_filter, workers=8, chunk_size=25, cache=None, account=None,
+                 metadata_first=False, reputation=None, duplicates=None, rules=None):
+        self.gmail = gmail
+        self.spam_filter = spam_filter
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.account = account
+        self.metadata_first = metadata_first
+        self.reputation = reputation
+        self.duplicates = duplicates
+        self.rules = rules
+        # Set once iter_results has listed every page; moves must wait for it, see SpamMover
+        self.listed = threading.Event()
+        self._local = threading.local()
+        self._scanners = []
+        self._scanners_lock = threading.Lock()
+
+    def _thread_scanner(self):
+        scanner = getattr(self._local, 'scanner', None)
+        if scanner is None:
+            scanner = MailboxScanner(self.gmail.clone(), self.spam_filter, self.chunk_size,
+                                     self.cache, self.account, self.metadata_first, self.reputation,
+                                     self.duplicates, self.rules)
+            self._local.scanner = scanner
+            with self._scanners_lock:
+                self._scanners.append(scanner)
+        return scanner
+
+    def _classify_chunk(self, msg_ids):
+        return self._thread_scanner().classify_ids(msg_ids)
+
+    @property
+    def errors(self):
+        errors = {}
+        for scanner in self._scanners:
+            errors.update(scanner.errors)
+        return errors
+
+    @property
+    def stats(self):
+        totals = {}
+        for scanner in self._scanners:
+            for key, value in scanner.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def iter_results(self, query='is:unread', limit=None):
+        """Yields each chunk's classified results as soon as it completes."""
+        max_in_flight = 2 * self.workers
+        self.listed.clear()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scan') as pool:
+            pending = set()
+            for page in self.gmail.iter_message_pages(query, BATCH_SIZE, limit):
+                ids = [msg['id'] for msg in page]
+                for start in range(0, len(ids), self.chunk_size):
+                    pending.add(pool.submit(self._classify_chunk, ids[start:start + self.chunk_size]))
+                    while len(pending) >= max_in_flight:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield future.result()
+            self.listed.set()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+class SpamMover:
+    """
+    Background worker that moves spam ids to the Spam folder as they
+    arrive, grouping them into batchModify calls of up to `batch_size` ids.
+    Moving messages out of a query that is still being listed page by page
+    makes Gmail skip messages on later pages, so with `after` (a
+    threading.Event, e.g. the scanner's `listed`) ids are only queued
+    until it is set.
+    """
+
+    def __init__(self, gmail, batch_size=BATCH_MODIFY_SIZE, flush_interval=2.0, after=None):
+        self.gmail = gmail.clone()
+        self.after = after
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.moved = []
+        self.errors = {}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='spam-mover', daemon=True)
+        self._thread.start()
+
+    def put(self, msg_ids):
+        for msg_id in msg_ids:
+            self._queue.put(msg_id)
+
+    def _flush(self, batch):
+        if batch:
+            moved, errors = self.gmail.move_to_spam_many(batch)
+            self.moved.extend(moved)
+            self.errors.update(errors)
+
+    def _ready(self):
+        return self.after is None or self.after.is_set()
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                msg_id = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # Quiet period: send what we have instead of waiting for a full batch
+                if self._ready():
+                    self._flush(batch)
+                    batch = []
+                continue
+            if msg_id is None:
+                self._flush(batch)
+                return
+            batch.append(msg_id)
+            if len(batch) >= self.batch_size and self._ready():
+                self._flush(batch)
+                batch = []
+
+    def close(self):
+        """Flushes remaining ids and waits. Returns (moved, errors)."""
+        self._queue.put(None)
+        self._thread.join()
+        return self.moved, self.errors
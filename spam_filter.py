@@ -1,45 +1,220 @@
+import copy
+import hashlib
 import joblib
+import json
 import os
+import re
+import threading
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score
+from fast_scorer import FastSpamScorer
+from model_artifact import ARTIFACT_PATH, export_artifact, load_artifact
+
+# Models personalised by user feedback, one artifact per account, kept out of the repository
+ACCOUNT_MODELS_DIR = os.path.join(os.path.expanduser('~'), '.gmail_spam_remover', 'models')
+
+def account_model_path(account, models_dir=ACCOUNT_MODELS_DIR):
+    """Path of `account`'s personalised artifact, e.g. spam_model_me@example.com.bin."""
+    return os.path.join(models_dir, 'spam_model_' + re.sub(r'[^\w.@+-]', '_', account) + '.bin')
+
+def _file_digest(paths):
+    """Short SHA-256 hex digest over the contents of the given files."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
 
 class SpamFilter:
-    def __init__(self, model_path=None, vectorizer_path=None):
+    # Spam probabilities at or beyond these bounds count as confident verdicts
+    SPAM_THRESHOLD = 0.99
+    HAM_THRESHOLD = 0.01
+
+    def __init__(self, model_path=None, vectorizer_path=None, artifact_path=None):
+        """
+        By default loads the compact spam_model.bin artifact (memory-mapped,
+        no pickle) when it exists, else the joblib pickles. Passing explicit
+        pickle paths forces the pickles.
+        """
         _here = os.path.dirname(os.path.abspath(__file__))
-        if model_path is None:
-            model_path = os.path.join(_here, 'spam_model.pkl')
-        if vectorizer_path is None:
-            vectorizer_path = os.path.join(_here, 'vectorizer.pkl')
-        self.model = joblib.load(model_path)
-        self.vectorizer = joblib.load(vectorizer_path)
+        if artifact_path is None and model_path is None and vectorizer_path is None:
+            if os.path.exists(ARTIFACT_PATH):
+                artifact_path = ARTIFACT_PATH
+        self.artifact_path = artifact_path
+        self.model_path = model_path
+        # Where partial_update publishes the updated model; see for_account
+        self.update_path = None
+        self._update_lock = threading.Lock()
+        self._scorer = None
+        if artifact_path is not None:
+            model, vectorizer = load_artifact(artifact_path)
+            artifact_files = [artifact_path]
+        else:
+            if model_path is None:
+                model_path = os.path.join(_here, 'spam_model.pkl')
+            if vectorizer_path is None:
+                vectorizer_path = os.path.join(_here, 'vectorizer.pkl')
+            self.model_path = model_path
+            self.vectorizer_path = vectorizer_path
+            model = joblib.load(model_path)
+            vectorizer = joblib.load(vectorizer_path)
+            artifact_files = [model_path, vectorizer_path]
+        # (model, vectorizer, model_version), replaced as a whole by partial_update. model_version
+        # identifies the trained artifacts, e.g. to invalidate cached verdicts after a retrain
+        self.state = (model, vectorizer, _file_digest(artifact_files))
+        # Evaluation results are persisted next to the model, keyed by model_version
+        self.metrics_path = os.path.join(os.path.dirname(os.path.abspath(artifact_files[0])), 'model_metrics.json')
+
+    @property
+    def model(self):
+        return self.state[0]
+
+    @property
+    def vectorizer(self):
+        return self.state[1]
+
+    @property
+    def model_version(self):
+        return self.state[2]
+
+    @classmethod
+    def for_account(cls, account, models_dir=ACCOUNT_MODELS_DIR):
+        """
+        The model personalised for `account`, or the shared model while the
+        account has none. partial_update publishes to the account's own
+        artifact under models_dir, never to the shared model files.
+        """
+        path = account_model_path(account, models_dir)
+        spam_filter = cls(artifact_path=path) if os.path.exists(path) else cls()
+        spam_filter.update_path = path
+        return spam_filter
+
+    def _load_metrics(self):
+        try:
+            with open(self.metrics_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_metrics(self, metrics):
+        try:
+            tmp_path = self.metrics_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(metrics, f, indent=2)
+            os.replace(tmp_path, self.metrics_path)
+        except OSError as e:
+            print(f"Failed to save model metrics: {e}")
 
     def get_accuracy(self, data_dir='.'):
-        """Returns model accuracy (%) on the held-out test split."""
+        """
+        Returns model accuracy (%) on the held-out test split.
+        Computed once per model artifact and then read back from model_metrics.json.
+        """
+        model, vectorizer, model_version = self.state
+        metrics = self._load_metrics()
+        cached = metrics.get(model_version, {}).get('accuracy')
+        if cached is not None:
+            return cached
         try:
             df1 = pd.read_csv(os.path.join(data_dir, 'spam_ham_dataset.csv'))
             df2 = pd.read_csv(os.path.join(data_dir, 'emails.csv'))
             df2.rename(columns={'spam': 'label_num'}, inplace=True)
             df = pd.concat([df1[['text', 'label_num']], df2[['text', 'label_num']]], ignore_index=True)
             _, X_test, _, y_test = train_test_split(df['text'], df['label_num'], test_size=0.2, random_state=42)
-            X_test_vec = self.vectorizer.transform(X_test)
-            y_pred = self.model.predict(X_test_vec)
-            return round(accuracy_score(y_test, y_pred) * 100, 2)
+            X_test_vec = vectorizer.transform(X_test)
+            y_pred = model.predict(X_test_vec)
+            accuracy = round(accuracy_score(y_test, y_pred) * 100, 2)
         except Exception:
             return None
+        metrics.setdefault(model_version, {})['accuracy'] = accuracy
+        self._save_metrics(metrics)
+        return accuracy
 
     def predict(self, text):
         """
         Predicts if the text is spam or ham.
         Returns: 1 for spam, 0 for ham
         """
-        text_vec = self.vectorizer.transform([text])
-        prediction = self.model.predict(text_vec)
+        model, vectorizer, _ = self.state
+        prediction = model.predict(vectorizer.transform([text]))
         return prediction[0]
 
     def is_spam(self, text):
         return self.predict(text) == 1
 
+    def predict_many(self, texts, state=None):
+        """
+        Classifies a batch of texts with one transform and one model call.
+        None or empty bodies are treated as empty strings; order is preserved.
+        `state` is a snapshot of self.state to score with, so a caller can
+        file the verdicts under the model_version that produced them.
+        Returns: (labels, spam_probabilities) as NumPy arrays
+        """
+        model, vectorizer, _ = self.state if state is None else state
+        texts = ['' if t is None else t for t in texts]
+        if not texts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        text_vec = vectorizer.transform(texts)
+        proba = model.predict_proba(text_vec)
+        labels = model.classes_[np.argmax(proba, axis=1)]
+        spam_col = list(model.classes_).index(1)
+        return labels, proba[:, spam_col]
+
+    def partial_update(self, texts, labels):
+        """
+        Continues training on labelled examples with partial_fit and
+        publishes the result as a new model version, an artifact at
+        update_path. The update runs on a copy; the new artifact replaces the
+        old file with one os.replace and self.state is swapped in a single
+        assignment, so concurrent predictions always see either the old or
+        the new model, vectorizer and version together.
+        Returns: the new model_version
+        """
+        if self.update_path is None:
+            raise ValueError("No update_path to publish to; use SpamFilter.for_account.")
+        texts = ['' if t is None else t for t in texts]
+        with self._update_lock:
+            model, vectorizer, _ = self.state
+            text_vec = vectorizer.transform(texts)
+            if self.artifact_path is not None:
+                # Shallow copy: CompactNB.partial_fit replaces, never mutates, its arrays
+                model = copy.copy(model)
+            else:
+                model = copy.deepcopy(model)
+            model.partial_fit(text_vec, labels)
+            os.makedirs(os.path.dirname(self.update_path), exist_ok=True)
+            export_artifact(model, vectorizer, self.update_path)
+            # Re-map the published file so memory stays shared with other processes
+            model, vectorizer = load_artifact(self.update_path)
+            version = _file_digest([self.update_path])
+            self.artifact_path = self.update_path
+            self.state = (model, vectorizer, version)
+        return version
+
+    def fast_scorer(self):
+        """
+        FastSpamScorer for the current model (same verdicts as predict, for
+        single-message hooks), rebuilt when partial_update publishes a new one.
+        """
+        model, vectorizer, model_version = self.state
+        scorer = self._scorer
+        if scorer is None or scorer[0] != model_version:
+            scorer = self._scorer = (model_version, FastSpamScorer(model, vectorizer))
+        return scorer[1]
+
+    def is_confident(self, spam_probs):
+        """Boolean array marking probabilities outside the ambiguous band."""
+        spam_probs = np.asarray(spam_probs)
+        return (spam_probs >= self.SPAM_THRESHOLD) | (spam_probs <= self.HAM_THRESHOLD)
+
+    def is_spam_many(self, texts):
+        """Returns a boolean NumPy array, one entry per input text."""
+        labels, _ = self.predict_many(texts)
+        return labels == 1
+
 if __name__ == "__main__":
     # Simple test
     filter = SpamFilter()
@@ -48,3 +223,5 @@ if __name__ == "__main__":
     
     print(f"Ham test: {'Spam' if filter.is_spam(test_ham) else 'Ham'}")
     print(f"Spam test: {'Spam' if filter.is_spam(test_spam) else 'Ham'}")
+    print(f"Batch test: {filter.is_spam_many([test_ham, test_spam, None]).tolist()}")
+    print(f"Fast path test: {[filter.fast_scorer().is_spam(t) for t in (test_ham, test_spam)]}")
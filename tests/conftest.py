@@ -0,0 +1,43 @@
+import os
+import sys
+
+import joblib
+import pytest
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import SyntheticMailbox  # noqa: E402
+from mime_parser import parse_message  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def mailbox():
+    return SyntheticMailbox(300, spam_ratio=0.4, seed=7)
+
+
+@pytest.fixture(scope='session')
+def corpus(mailbox):
+    """(texts, labels) of the synthetic mailbox, in the form the model is trained on."""
+    texts = [parse_message(message).text for message in mailbox.messages.values()]
+    return texts, [mailbox.labels[msg_id] for msg_id in mailbox.ids]
+
+
+@pytest.fixture
+def pickled_model(corpus, tmp_path):
+    """A MultinomialNB + CountVectorizer trained on the first 200 texts, pickled like train_model does."""
+    texts, labels = corpus
+    vectorizer = CountVectorizer()
+    model = MultinomialNB().fit(vectorizer.fit_transform(texts[:200]), labels[:200])
+    model_path, vectorizer_path = str(tmp_path / 'spam_model.pkl'), str(tmp_path / 'vectorizer.pkl')
+    joblib.dump(model, model_path)
+    joblib.dump(vectorizer, vectorizer_path)
+    return model_path, vectorizer_path
+
+
+@pytest.fixture
+def trained_filter(pickled_model):
+    from spam_filter import SpamFilter
+    model_path, vectorizer_path = pickled_model
+    return SpamFilter(model_path=model_path, vectorizer_path=vectorizer_path)
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import joblib
+import pytest
+
+import batch_runner
+from benchmark import UNLIMITED_RATE, FakeGmailHttp
+from gmail_service import GmailService
+from model_artifact import export_artifact
+
+
+def _args(*argv):
+    old_argv = sys.argv
+    sys.argv = ['batch_runner.py', '--no-cache', '--no-rules', '--no-reputation',
+                '--rate', str(UNLIMITED_RATE), *argv]
+    try:
+        return batch_runner.parse_args()
+    finally:
+        sys.argv = old_argv
+
+
+@pytest.fixture
+def fake_accounts(mailbox, trained_filter, monkeypatch):
+    """Token files open a fake Gmail over the synthetic mailbox; 'broken' ones fail to load."""
+    https = {}
+
+    def from_token_file(token_path, interactive=True, rate_limiter=None):
+        if 'broken' in token_path:
+            raise ValueError("token has been revoked")
+        http = https[token_path] = FakeGmailHttp(mailbox)
+        return GmailService(http=http, rate_limiter=rate_limiter)
+
+    monkeypatch.setattr(batch_runner.GmailService, 'from_token_file', from_token_file)
+    monkeypatch.setattr(batch_runner, 'get_account_filter', lambda account: trained_filter)
+    return https
+
+
+def test_run_once_cleans_every_account(mailbox, fake_accounts, tmp_path):
+    tokens = [str(tmp_path / f'token_{name}.json') for name in ('a', 'b', 'broken')]
+    summaries = {s['token']: s for s in batch_runner.run_once(tokens, _args('--accounts', '2'))}
+
+    for token in tokens[:2]:
+        s = summaries[token]
+        assert s['error'] is None
+        assert s['account'] == 'bench@example.com'
+        assert s['scanned'] == len(mailbox.ids)
+        assert 0 < s['spam'] < s['scanned']
+        assert s['moved'] == s['spam']
+        assert s['failed'] == 0
+        assert s['quota_units'] > 0
+    assert summaries[tokens[2]]['error'] == "token has been revoked"
+    assert summaries[tokens[2]]['scanned'] == 0
+
+
+def test_dry_run_moves_nothing(mailbox, fake_accounts, tmp_path):
+    token = str(tmp_path / 'token_a.json')
+    summary = batch_runner.clean_account(token, _args('--dry-run', '--account-workers', '3', '--limit', '50'))
+    assert summary['error'] is None
+    assert summary['scanned'] == 50
+    assert summary['spam'] > 0
+    assert summary['moved'] == 0
+
+
+def test_account_filter_is_reloaded_when_its_artifact_changes(pickled_model, tmp_path, monkeypatch):
+    models_dir = str(tmp_path / 'models')
+    monkeypatch.setattr(batch_runner, '_account_filters', {})
+    monkeypatch.setattr(batch_runner, 'account_model_path',
+                        lambda account: os.path.join(models_dir, f'{account}.bin'))
+    monkeypatch.setattr(batch_runner.SpamFilter, 'for_account', classmethod(
+        lambda cls, account: cls(artifact_path=os.path.join(models_dir, f'{account}.bin'))))
+    model, vectorizer = (joblib.load(path) for path in pickled_model)
+    os.makedirs(models_dir)
+    path = os.path.join(models_dir, 'me.bin')
+    export_artifact(model, vectorizer, path)
+
+    first = batch_runner.get_account_filter('me')
+    assert batch_runner.get_account_filter('me') is first
+    os.utime(path, (0, 0))
+    assert batch_runner.get_account_filter('me') is not first
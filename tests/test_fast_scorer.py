@@ -0,0 +1,39 @@
+import joblib
+import numpy as np
+import pytest
+
+from model_artifact import export_artifact
+from spam_filter import SpamFilter
+
+
+@pytest.fixture(params=['pickles', 'artifact'])
+def spam_filter(request, pickled_model, tmp_path):
+    model_path, vectorizer_path = pickled_model
+    if request.param == 'pickles':
+        return SpamFilter(model_path=model_path, vectorizer_path=vectorizer_path)
+    artifact_path = str(tmp_path / 'spam_model.bin')
+    export_artifact(joblib.load(model_path), joblib.load(vectorizer_path), artifact_path)
+    return SpamFilter(artifact_path=artifact_path)
+
+
+def test_predictions_match_spam_filter(spam_filter, corpus):
+    texts = corpus[0] + ['', 'Subject: \n', 'Subject: WIN a FREE prize NOW!!!\nclick here']
+    scorer = spam_filter.fast_scorer()
+    assert [scorer.predict(text) for text in texts] == [spam_filter.predict(text) for text in texts]
+
+
+def test_probabilities_match_predict_many(spam_filter, corpus):
+    texts = corpus[0][:50]
+    _, expected = spam_filter.predict_many(texts)
+    scorer = spam_filter.fast_scorer()
+    np.testing.assert_allclose([scorer.spam_probability(text) for text in texts], expected, atol=1e-6)
+
+
+def test_scorer_follows_partial_update(spam_filter, corpus, tmp_path):
+    spam_filter.update_path = str(tmp_path / 'models' / 'account.bin')
+    old_scorer = spam_filter.fast_scorer()
+    texts, labels = corpus
+    spam_filter.partial_update(texts[200:], labels[200:])
+    scorer = spam_filter.fast_scorer()
+    assert scorer is not old_scorer
+    assert [scorer.predict(text) for text in texts] == [spam_filter.predict(text) for text in texts]
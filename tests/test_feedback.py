@@ -0,0 +1,71 @@
+import pytest
+
+from feedback import FeedbackStore, OnlineLearner
+from spam_filter import SpamFilter, account_model_path
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FeedbackStore(str(tmp_path / 'feedback.sqlite3'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def account_filter(trained_filter, tmp_path):
+    trained_filter.update_path = account_model_path('me@example.com', str(tmp_path / 'models'))
+    return trained_filter
+
+
+def test_pending_is_per_account_until_applied(store):
+    store.add('me', [('m1', 'win money', 1), ('m2', 'lunch?', 0)])
+    store.add('other', [('m3', 'hello', 0)])
+    rows = store.pending('me')
+    assert [(text, label) for _, text, label in rows] == [('win money', 1), ('lunch?', 0)]
+    assert len(store.pending('me', limit=1)) == 1
+
+    store.mark_applied([rows[0][0]], 'v2')
+    assert [text for _, text, _ in store.pending('me')] == ['lunch?']
+    assert [text for _, text, _ in store.pending('other')] == ['hello']
+
+
+def test_apply_pending_publishes_a_new_version_in_batches(store, account_filter, tmp_path):
+    text = 'quick question about the offer'
+    old_state = account_filter.state
+    _, (old_prob,) = account_filter.predict_many([text])
+    # Teach the model the opposite of what it leans towards
+    label = int(old_prob < 0.5)
+    store.add('me@example.com', [(f'm{i}', text, label) for i in range(100)])
+    learner = OnlineLearner(account_filter, store, 'me@example.com', batch_size=30)
+
+    assert learner.apply_pending() == 100
+    assert store.pending('me@example.com') == []
+    assert account_filter.model_version != old_state[2]
+    assert account_filter.artifact_path == account_filter.update_path
+    _, (new_prob,) = account_filter.predict_many([text])
+    assert new_prob > old_prob if label == 1 else new_prob < old_prob
+    # The update ran on a copy: a snapshot taken before it still scores with the old model
+    _, (snapshot_prob,) = account_filter.predict_many([text], old_state)
+    assert snapshot_prob == old_prob
+
+    reloaded = SpamFilter.for_account('me@example.com', str(tmp_path / 'models'))
+    assert reloaded.model_version == account_filter.model_version
+
+
+def test_submit_trains_on_a_background_thread(store, account_filter):
+    store.add('me@example.com', [('m1', 'cheap pills now', 1)])
+    version = account_filter.model_version
+    learner = OnlineLearner(account_filter, store, 'me@example.com')
+    learner.submit()
+    learner._thread.join(timeout=30)
+    assert store.pending('me@example.com') == []
+    assert account_filter.model_version != version
+
+
+def test_failed_update_leaves_feedback_pending(store, trained_filter):
+    store.add('me@example.com', [('m1', 'cheap pills now', 1)])
+    # No update_path: partial_update refuses to publish
+    learner = OnlineLearner(trained_filter, store, 'me@example.com')
+    assert learner.apply_pending() == 0
+    assert isinstance(learner.last_error, ValueError)
+    assert len(store.pending('me@example.com')) == 1
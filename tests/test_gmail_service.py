@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import gmail_service
+from benchmark import UNLIMITED_RATE, FakeGmailHttp, SyntheticMailbox, _gmail
+from gmail_service import GmailApiError, GmailService
+from quota import TokenBucket
+
+
+class RateLimitedHttp(FakeGmailHttp):
+    """Answers 429 to the first `failures` gets of each id in `limited`."""
+
+    def __init__(self, mailbox, limited, failures=1):
+        super().__init__(mailbox)
+        self.remaining = {msg_id: failures for msg_id in limited}
+        self.gets = {}
+
+    def _cached(self, method, uri, body):
+        msg_id = uri.split('/messages/', 1)[-1].split('?', 1)[0] if '/messages/' in uri else None
+        if msg_id is not None:
+            self.gets[msg_id] = self.gets.get(msg_id, 0) + 1
+            if self.remaining.get(msg_id):
+                self.remaining[msg_id] -= 1
+                return 429, json.dumps({'error': {'code': 429, 'message': 'Too many concurrent requests',
+                                                  'errors': [{'reason': 'rateLimitExceeded'}]}}).encode('utf-8')
+        return super()._cached(method, uri, body)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(gmail_service, '_backoff', lambda attempt: 0.0)
+
+
+@pytest.fixture
+def small_mailbox():
+    return SyntheticMailbox(30, spam_ratio=0.5, seed=3)
+
+
+def test_contents_are_aligned_with_requested_ids(small_mailbox):
+    gmail, _ = _gmail(small_mailbox)
+    msg_ids = list(reversed(small_mailbox.ids))
+    contents, errors = gmail.get_messages_content(msg_ids, batch_size=7)
+    assert errors == {}
+    for msg_id, message in zip(msg_ids, contents):
+        subject = next(h['value'] for h in small_mailbox.messages[msg_id]['payload']['headers']
+                       if h['name'] == 'Subject')
+        assert message.subject == subject
+
+
+def test_missing_message_is_reported_per_id(small_mailbox):
+    gmail, _ = _gmail(small_mailbox)
+    msg_ids = small_mailbox.ids[:3] + ['does-not-exist'] + small_mailbox.ids[3:5]
+    contents, errors = gmail.get_messages_content(msg_ids)
+    assert contents[3] is None
+    assert all(message is not None for i, message in enumerate(contents) if i != 3)
+    assert list(errors) == ['does-not-exist']
+    error = errors['does-not-exist']
+    assert isinstance(error, GmailApiError)
+    assert error.status == 404
+    assert not error.retryable
+
+
+def test_rate_limited_items_are_retried(small_mailbox):
+    limited = small_mailbox.ids[2:5]
+    http = RateLimitedHttp(small_mailbox, limited)
+    gmail = GmailService(http=http, rate_limiter=TokenBucket(UNLIMITED_RATE))
+    contents, errors = gmail.get_messages_content(small_mailbox.ids)
+    assert errors == {}
+    assert all(message is not None for message in contents)
+    # Only the throttled messages were asked for twice
+    assert {msg_id for msg_id, count in http.gets.items() if count > 1} == set(limited)
+
+
+def test_retries_give_up_after_max_retries(small_mailbox):
+    limited = small_mailbox.ids[:1]
+    http = RateLimitedHttp(small_mailbox, limited, failures=gmail_service.MAX_RETRIES + 1)
+    gmail = GmailService(http=http, rate_limiter=TokenBucket(UNLIMITED_RATE))
+    contents, errors = gmail.get_messages_content(small_mailbox.ids[:5])
+    assert contents[0] is None
+    assert errors[limited[0]].rate_limited
+    assert errors[limited[0]].attempts == gmail_service.MAX_RETRIES + 1
+    assert http.gets[limited[0]] == gmail_service.MAX_RETRIES + 1
@@ -0,0 +1,112 @@
+import sqlite3
+import time
+
+import pytest
+
+from message_cache import MessageCache
+from mime_parser import ParsedMessage
+
+
+def _message(body, sender='a@example.com', headers=None):
+    return ParsedMessage('Subject line', sender, body, len(body), headers)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MessageCache(str(tmp_path / 'cache.sqlite3'))
+    yield cache
+    cache.close()
+
+
+def test_contents_round_trip_with_sender_and_headers(cache):
+    headers = {'From': 'a@example.com', 'Authentication-Results': 'dmarc=fail'}
+    cache.put_contents('me', {'m1': _message('hello', headers=headers), 'm2': _message('bye', sender='')})
+    contents = cache.get_contents('me', ['m1', 'm2', 'missing'])
+    assert contents['m1'] == _message('hello', headers=headers)
+    assert contents['m2'] == _message('bye', sender='')
+    assert 'missing' not in contents
+    assert cache.get_contents('someone-else', ['m1']) == {}
+
+
+def test_verdicts_are_keyed_by_model_version(cache):
+    cache.put_verdicts('me', 'v1', {'m1': (1, 0.9)})
+    assert cache.get_verdicts('me', ['m1'], 'v1') == {'m1': (1, 0.9)}
+    assert cache.get_verdicts('me', ['m1'], 'v2') == {}
+
+
+def test_new_model_version_purges_the_accounts_old_verdicts(cache):
+    cache.put_verdicts('me', 'v1', {'m1': (1, 0.9)})
+    cache.put_verdicts('other', 'x1', {'m1': (0, 0.1)})
+    cache.put_verdicts('me', 'v2', {'m2': (0, 0.2)})
+    rows = cache._conn.execute('SELECT account, msg_id, model_version FROM verdicts ORDER BY account').fetchall()
+    assert rows == [('me', 'm2', 'v2'), ('other', 'm1', 'x1')]
+
+
+def test_eviction_keeps_the_most_recently_used_messages(tmp_path):
+    # Each stored text is 'Subject: Subject line\n' + 18 bytes = 40 bytes
+    cache = MessageCache(str(tmp_path / 'cache.sqlite3'), max_bytes=100)
+    for i in range(2):
+        cache.put_contents('me', {f'm{i}': _message('x' * 18)})
+        cache.put_verdicts('me', 'v1', {f'm{i}': (0, 0.1)})
+        time.sleep(0.01)
+    # m0 becomes the most recently used, so m1 is evicted next
+    cache.get_contents('me', ['m0'])
+    cache.put_contents('me', {'m2': _message('x' * 18)})
+    assert set(cache.get_contents('me', ['m0', 'm1', 'm2'])) == {'m0', 'm2'}
+    assert cache.get_verdicts('me', ['m0', 'm1'], 'v1') == {'m0': (0, 0.1)}
+    total = cache._conn.execute('SELECT SUM(size) FROM contents').fetchone()[0]
+    assert total <= 100
+    cache.close()
+
+
+def test_cache_written_before_sender_column_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE contents (account TEXT NOT NULL, msg_id TEXT NOT NULL, text TEXT NOT NULL, '
+                 'size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (account, msg_id))')
+    conn.execute("INSERT INTO contents VALUES ('me', 'm1', 'Subject: Hi\nbody', 16, 0)")
+    conn.commit()
+    conn.close()
+    cache = MessageCache(path)
+    assert cache.get_contents('me', ['m1']) == {'m1': ParsedMessage('Hi', '', 'body', 4, None)}
+    cache.close()
+
+
+def test_metadata_results_are_kept_apart_from_full_verdicts(cache):
+    result = {'id': 'm1', 'subject': 'Hi', 'sender': 'a@example.com', 'snippet': 'hi',
+              'label': 1, 'spam_prob': 1.0, 'path': 'rules', 'rule': 'deny'}
+    cache.put_metadata_results('me', 'v1', {'m1': result})
+    cache.put_verdicts('me', 'v1', {'m2': (0, 0.1)})
+    assert cache.get_metadata_results('me', ['m1', 'm2'], 'v1') == {'m1': result}
+    assert cache.get_verdicts('me', ['m1', 'm2'], 'v1') == {'m2': (0, 0.1)}
+    assert cache.get_metadata_results('me', ['m1'], 'v2') == {}
+    # They have no cached content, but eviction keeps them
+    cache.max_bytes = 0
+    cache.put_contents('me', {'m3': _message('x' * 10)})
+    assert cache.get_metadata_results('me', ['m1'], 'v1') == {'m1': result}
+    cache.put_verdicts('me', 'v2', {'m2': (0, 0.1)})
+    assert cache.get_metadata_results('me', ['m1'], 'v1') == {}
+
+
+def test_old_metadata_results_expire(cache):
+    result = {'id': 'm1', 'subject': '', 'sender': '', 'snippet': '', 'label': 0, 'spam_prob': 0.1,
+              'path': 'metadata'}
+    cache.put_metadata_results('me', 'v1', {'m1': result})
+    cache._conn.execute('UPDATE verdicts SET created = 0')
+    cache.put_metadata_results('me', 'v1', {})
+    assert cache.get_metadata_results('me', ['m1'], 'v1') == {}
+
+
+def test_cache_written_before_metadata_results_is_upgraded(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE verdicts (account TEXT NOT NULL, msg_id TEXT NOT NULL, model_version TEXT NOT NULL,
+                               label INTEGER NOT NULL, spam_prob REAL NOT NULL,
+                               PRIMARY KEY (account, msg_id, model_version));
+        INSERT INTO verdicts VALUES ('me', 'm1', 'v1', 1, 0.9);
+    ''')
+    conn.close()
+    cache = MessageCache(path)
+    assert cache.get_verdicts('me', ['m1'], 'v1') == {'m1': (1, 0.9)}
+    cache.close()
@@ -0,0 +1,89 @@
+import base64
+
+from mime_parser import MAX_BODY_BYTES, ParsedMessage, parse_message
+
+
+def _part(mime_type, text, **extra):
+    data = base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+    return {'mimeType': mime_type, 'headers': [], 'body': {'size': len(text), 'data': data}, **extra}
+
+
+def _multipart(mime_type, parts):
+    return {'mimeType': mime_type, 'headers': [], 'body': {'size': 0}, 'parts': parts}
+
+
+def _message(payload, headers=()):
+    payload['headers'] = payload['headers'] + [{'name': name, 'value': value} for name, value in headers]
+    return {'id': 'm1', 'payload': payload}
+
+
+def test_nested_multipart_prefers_first_plain_part():
+    attachment = _part('text/plain', 'attached notes', filename='notes.txt')
+    payload = _multipart('multipart/mixed', [
+        _multipart('multipart/related', [
+            _multipart('multipart/alternative', [
+                _part('text/plain', 'the plain body'),
+                _part('text/html', '<p>the html body</p>'),
+            ]),
+            {'mimeType': 'image/png', 'filename': 'logo.png', 'headers': [], 'body': {'size': 10}},
+        ]),
+        attachment,
+    ])
+    message = parse_message(_message(payload, [('Subject', 'Hello'), ('From', 'a@example.com')]))
+    assert message.subject == 'Hello'
+    assert message.sender == 'a@example.com'
+    assert message.body == 'the plain body'
+    assert message.text == 'Subject: Hello\nthe plain body'
+
+
+def test_attachment_is_not_taken_as_body():
+    payload = _multipart('multipart/mixed', [
+        _part('text/plain', 'attached notes', filename='notes.txt'),
+        _part('text/html', '<p>real body</p>'),
+    ])
+    assert parse_message(_message(payload)).body == 'real body'
+
+
+def test_html_only_message_is_stripped_to_text():
+    markup = ('<html><head><style>p {color: red}</style><title>ignored</title></head><body>'
+              '<script>var x = 1;</script><p>First &amp; foremost</p><div>second line</div>'
+              '<!-- a comment --></body></html>')
+    message = parse_message(_message(_part('text/html', markup)))
+    assert message.body == 'First & foremost\nsecond line'
+
+
+def test_empty_plain_alternative_falls_back_to_html():
+    payload = _multipart('multipart/alternative', [_part('text/plain', '  \n'), _part('text/html', '<b>Win</b> now')])
+    assert parse_message(_message(payload)).body == 'Win now'
+
+
+def test_missing_content_type_is_plain_text():
+    part = _part(None, 'no type')
+    del part['mimeType']
+    assert parse_message(_message(part)).body == 'no type'
+
+
+def test_body_is_capped_but_size_is_reported():
+    text = 'x' * (MAX_BODY_BYTES + 1000)
+    message = parse_message(_message(_part('text/plain', text)))
+    assert len(message.body) == MAX_BODY_BYTES
+    assert message.size == len(text)
+
+
+def test_charset_is_honoured():
+    text = 'café'
+    data = base64.urlsafe_b64encode(text.encode('latin-1')).decode('ascii')
+    part = {'mimeType': 'text/plain', 'body': {'size': 4, 'data': data},
+            'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="ISO-8859-1"'}]}
+    assert parse_message(_message(part)).body == text
+
+
+def test_rule_headers_are_kept_and_restored():
+    headers = [('Subject', 'Hi'), ('From', 'a@example.com'), ('Authentication-Results', 'mx; dmarc=fail'),
+               ('X-Mailer', 'ignored')]
+    message = parse_message(_message(_part('text/plain', 'body'), headers))
+    assert message.headers == {'Subject': 'Hi', 'From': 'a@example.com', 'Authentication-Results': 'mx; dmarc=fail'}
+
+    restored = ParsedMessage.from_text(message.text, message.sender, message.headers)
+    assert (restored.subject, restored.sender, restored.body, restored.headers) == \
+        (message.subject, message.sender, message.body, message.headers)
@@ -0,0 +1,64 @@
+import copy
+
+import joblib
+import numpy as np
+import pytest
+
+from model_artifact import CompactNB, CompactVectorizer, export_artifact, load_artifact
+
+
+@pytest.fixture
+def artifact(pickled_model, tmp_path):
+    model, vectorizer = (joblib.load(path) for path in pickled_model)
+    path = str(tmp_path / 'spam_model.bin')
+    export_artifact(model, vectorizer, path)
+    return model, vectorizer, path
+
+
+def test_round_trip_matches_pickled_model(artifact, corpus):
+    model, vectorizer, path = artifact
+    compact_model, compact_vectorizer = load_artifact(path)
+    assert isinstance(compact_model, CompactNB)
+    assert isinstance(compact_vectorizer, CompactVectorizer)
+
+    texts = corpus[0]
+    expected = model.predict_proba(vectorizer.transform(texts))
+    actual = compact_model.predict_proba(compact_vectorizer.transform(texts))
+    # Log-probabilities are stored as float32
+    np.testing.assert_allclose(actual, expected, atol=1e-4)
+    np.testing.assert_array_equal(compact_model.predict(compact_vectorizer.transform(texts)),
+                                  model.predict(vectorizer.transform(texts)))
+
+
+def test_re_export_of_loaded_artifact_is_identical(artifact, tmp_path):
+    _, _, path = artifact
+    model, vectorizer = load_artifact(path)
+    copy_path = str(tmp_path / 'copy.bin')
+    export_artifact(model, vectorizer, copy_path)
+    with open(path, 'rb') as original, open(copy_path, 'rb') as copied:
+        assert original.read() == copied.read()
+
+
+def test_partial_fit_matches_multinomial_nb(artifact, corpus):
+    model, vectorizer, path = artifact
+    compact_model, compact_vectorizer = load_artifact(path)
+    texts, labels = corpus
+    new_texts, new_labels = texts[200:], labels[200:]
+
+    expected = copy.deepcopy(model).partial_fit(vectorizer.transform(new_texts), new_labels)
+    actual = compact_model.partial_fit(compact_vectorizer.transform(new_texts), new_labels)
+
+    # Artifact columns are in token-hash order; compare through a common set of texts
+    np.testing.assert_allclose(actual.class_log_prior_, expected.class_log_prior_)
+    np.testing.assert_allclose(actual.predict_proba(compact_vectorizer.transform(texts)),
+                               expected.predict_proba(vectorizer.transform(texts)), atol=1e-4)
+    np.testing.assert_allclose(np.sort(np.asarray(actual.feature_count_), axis=1),
+                               np.sort(expected.feature_count_, axis=1))
+
+
+def test_partial_fit_leaves_loaded_arrays_untouched(artifact, corpus):
+    _, _, path = artifact
+    compact_model, compact_vectorizer = load_artifact(path)
+    before = np.array(compact_model.feature_log_prob_)
+    copy.copy(compact_model).partial_fit(compact_vectorizer.transform(corpus[0][:10]), corpus[1][:10])
+    np.testing.assert_array_equal(compact_model.feature_log_prob_, before)
@@ -0,0 +1,62 @@
+import threading
+
+from near_duplicates import NearDuplicateIndex, minhash, similarity
+
+TEMPLATE = ("Dear {name}, you have been selected to receive an exclusive reward from our partners. "
+            "Claim your prize today by visiting {link} before the offer expires at midnight. "
+            "This message was sent to you as a valued member of our rewards programme.")
+
+
+def _campaign(name, link):
+    return TEMPLATE.format(name=name, link=link)
+
+
+def test_signature_similarity_tracks_token_overlap():
+    a = minhash(_campaign('Alice', 'http://win.example/a1'))
+    b = minhash(_campaign('Bob', 'http://win.example/b2'))
+    c = minhash("Hi team, the quarterly planning meeting moves to Thursday afternoon in room four, "
+                "please bring the budget figures and the hiring plan.")
+    assert similarity(a, a) == 1.0
+    assert similarity(a, b) >= 0.8
+    assert similarity(a, c) < 0.3
+
+
+def test_short_texts_have_no_signature():
+    assert minhash('too short to tell') is None
+
+
+def test_campaign_copies_share_a_cluster():
+    index = NearDuplicateIndex()
+    first = index.add('m1', _campaign('Alice', 'http://win.example/a1'))
+    assert first == 'm1'
+    assert index.add('m2', _campaign('Bob', 'http://win.example/b2')) == 'm1'
+    assert index.add('m3', "Lunch at noon? The usual place by the river, I will book a table for four people.") == 'm3'
+    assert index.add('m4', 'ok thanks') == 'm4'
+    assert index.add('m5', 'ok thanks') == 'm5'
+    assert len(index) == 4
+    assert index.size('m1') == 2
+    assert index.cluster_of('m2') == 'm1'
+    # Adding a message again keeps its cluster
+    assert index.add('m2', 'something else entirely') == 'm1'
+    assert index.size('m1') == 2
+
+
+def test_verdicts_are_per_cluster():
+    index = NearDuplicateIndex()
+    cluster = index.add('m1', _campaign('Alice', 'http://win.example/a1'))
+    assert index.get_verdict(cluster) is None
+    index.set_verdict(cluster, (1, 0.99))
+    assert index.get_verdict(index.add('m2', _campaign('Bob', 'http://win.example/b2'))) == (1, 0.99)
+
+
+def test_concurrent_adds_form_one_cluster():
+    index = NearDuplicateIndex()
+    threads = [threading.Thread(target=index.add, args=(f'm{i}', _campaign(f'User{i}', f'http://win.example/{i}')))
+               for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(index) == 1
+    (cluster,) = {index.cluster_of(f'm{i}') for i in range(20)}
+    assert index.size(cluster) == 20
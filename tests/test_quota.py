@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+import quota
+from quota import TokenBucket
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.slept.append(seconds)
+            self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(quota, 'time', clock)
+    return clock
+
+
+def test_burst_up_to_capacity_then_waits_for_refill(clock):
+    bucket = TokenBucket(rate=100)
+    assert bucket.acquire(60) == 0
+    assert bucket.acquire(40) == 0
+    assert bucket.acquire(50) == pytest.approx(0.5)
+    # The sleep paid the deficit off, so the bucket is empty but not in debt
+    clock.now += 0.25
+    assert bucket.acquire(25) == 0
+
+
+def test_request_larger_than_the_bucket_is_spaced_out(clock):
+    bucket = TokenBucket(rate=50, capacity=50)
+    assert bucket.acquire(150) == pytest.approx(2.0)
+    assert clock.slept == [pytest.approx(2.0)]
+
+
+def test_idle_time_refills_only_up_to_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=20)
+    bucket.acquire(20)
+    clock.now += 60
+    assert bucket.acquire(20) == 0
+    assert bucket.acquire(10) == pytest.approx(1.0)
+
+
+def test_penalize_drains_the_bucket(clock):
+    bucket = TokenBucket(rate=100)
+    bucket.penalize(2.0)
+    assert bucket.acquire(5) == pytest.approx(2.05)
+
+
+def test_used_units_are_counted_per_method(clock):
+    bucket = TokenBucket()
+    bucket.acquire(quota.QUOTA_UNITS['messages.get'], 'messages.get')
+    bucket.acquire(quota.QUOTA_UNITS['messages.get'], 'messages.get')
+    bucket.acquire(quota.QUOTA_UNITS['messages.batchModify'], 'messages.batchModify')
+    bucket.acquire(1)
+    assert bucket.used == {'messages.get': 10, 'messages.batchModify': 50}
+
+
+def test_concurrent_acquires_queue_behind_each_other(clock):
+    # Time stands still, so every reservation lands on the same bucket
+    clock.sleep = clock.slept.append
+    bucket = TokenBucket(rate=100)
+    threads = [threading.Thread(target=bucket.acquire, args=(10,)) for _ in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 300 units against a full 100-unit bucket: each of the last 20 waits 0.1s longer than the one before
+    assert sorted(clock.slept) == pytest.approx([i / 10 for i in range(1, 21)])
@@ -0,0 +1,69 @@
+import pytest
+
+from reputation import USER_WEIGHT, SenderReputation, sender_keys
+
+
+@pytest.fixture
+def reputation(tmp_path):
+    reputation = SenderReputation(str(tmp_path / 'reputation.sqlite3'), min_evidence=4, min_confidence=0.8)
+    yield reputation
+    reputation.close()
+
+
+def _verdicts(sender, label, count, prefix='m'):
+    return [(f'{prefix}{i}', sender, label) for i in range(count)]
+
+
+def test_sender_keys():
+    assert sender_keys('Promo <Deals@Shop.Example>') == ('addr:deals@shop.example', 'domain:shop.example')
+    assert sender_keys('undisclosed-recipients') == ()
+    assert sender_keys(None) == ()
+
+
+def test_verdict_needs_enough_evidence(reputation):
+    reputation.record('me', _verdicts('a@spam.example', 1, 3))
+    assert reputation.lookup('me', ['a@spam.example']) == {}
+    # Counts decay a little between writes, so one more than min_evidence
+    reputation.record('me', _verdicts('a@spam.example', 1, 2, prefix='n'))
+    label, prob = reputation.lookup('me', ['a@spam.example'])['a@spam.example']
+    assert label == 1
+    assert prob == pytest.approx(6 / 7)
+    assert reputation.lookup('someone-else', ['a@spam.example']) == {}
+
+
+def test_rescanned_messages_count_once(reputation):
+    assert reputation.record('me', _verdicts('a@spam.example', 1, 3)) == 3
+    assert reputation.record('me', _verdicts('a@spam.example', 1, 3)) == 0
+    assert reputation.record('me', [('x', '', 1)]) == 0
+    assert reputation.lookup('me', ['a@spam.example']) == {}
+
+
+def test_domain_is_used_until_the_address_has_its_own_record(reputation):
+    reputation.record('me', _verdicts('bulk@shop.example', 1, 6))
+    assert reputation.lookup('me', ['new@shop.example'])['new@shop.example'][0] == 1
+    reputation.record('me', _verdicts('billing@shop.example', 0, 6, prefix='h'))
+    verdicts = reputation.lookup('me', ['billing@shop.example', 'new@shop.example'])
+    # The domain is now split, but the address has a clean record of its own
+    assert verdicts == {'billing@shop.example': (0, pytest.approx(1 / 8))}
+
+
+def test_mixed_record_is_inconclusive(reputation):
+    reputation.record('me', _verdicts('a@example.com', 1, 5) + _verdicts('a@example.com', 0, 5, prefix='h'))
+    assert reputation.lookup('me', ['a@example.com']) == {}
+
+
+def test_user_actions_outweigh_model_verdicts(reputation):
+    reputation.record('me', _verdicts('news@example.com', 0, 1))
+    assert reputation.lookup('me', ['news@example.com']) == {}
+    # One Mark as Not Spam is enough evidence on its own
+    reputation.record_user_action('me', ['new@example.com'], 0)
+    label, prob = reputation.lookup('me', ['new@example.com'])['new@example.com']
+    assert label == 0
+    assert prob == pytest.approx(1 / (USER_WEIGHT + 2))
+
+
+def test_counts_decay_with_age(reputation):
+    reputation.record('me', _verdicts('a@spam.example', 1, 6))
+    # Two half-lives ago: 6 messages now weigh 1.5, below min_evidence
+    reputation._conn.execute('UPDATE reputation SET updated = updated - ?', (2 * reputation.half_life,))
+    assert reputation.lookup('me', ['a@spam.example']) == {}
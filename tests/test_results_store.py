@@ -0,0 +1,80 @@
+import pytest
+
+from results_store import ResultsStore
+
+
+def _result(msg_id, label, spam_prob, sender='a@example.com', cluster=None):
+    return {'id': msg_id, 'subject': f'Subject {msg_id}', 'sender': sender, 'snippet': f'snippet {msg_id}',
+            'label': label, 'spam_prob': spam_prob, 'cluster': cluster}
+
+
+@pytest.fixture
+def store():
+    store = ResultsStore()
+    store.add([
+        _result('m1', 1, 0.99, 'Promo <deals@shop.example>', cluster='c1'),
+        _result('m2', 0, 0.02, 'Alice <alice@example.com>'),
+        _result('m3', 1, 0.70, 'deals@shop.example', cluster='c1'),
+        _result('m4', 0, 0.40, 'bob@example.com'),
+        _result('m5', 1, 0.98, 'other@spam.example', cluster='c1'),
+    ])
+    return store
+
+
+def test_query_filters_combine(store):
+    assert store.ids_of(store.query()) == ['m1', 'm2', 'm3', 'm4', 'm5']
+    assert store.ids_of(store.query(label=1)) == ['m1', 'm3', 'm5']
+    assert store.ids_of(store.query(sender='SHOP.example')) == ['m1', 'm3']
+    assert store.ids_of(store.query(min_confidence=0.9)) == ['m1', 'm2', 'm5']
+    assert store.ids_of(store.query(label=1, sender='shop', min_confidence=0.9)) == ['m1']
+    assert store.spam_ids() == ['m1', 'm3', 'm5']
+    assert store.spam_count() == 3
+
+
+def test_page_materialises_only_the_requested_rows(store):
+    rows = store.query()
+    page = store.page(rows, 1, page_size=2)
+    assert [row['id'] for row in page] == ['m3', 'm4']
+    assert page[0]['confidence'] == pytest.approx(0.70)
+    assert page[1]['confidence'] == pytest.approx(0.60)
+    assert page[0]['copies'] == 3
+    assert store.page(rows, 3, page_size=2) == []
+
+
+def test_changes_invalidate_cached_queries(store):
+    version = store.version
+    spam = store.query(label=1)
+    assert store.query(label=1) is spam
+    store.relabel(['m4'], 1)
+    assert store.version > version
+    assert store.ids_of(store.query(label=1)) == ['m1', 'm3', 'm4', 'm5']
+    assert store.get('m4')['spam_prob'] == 1.0
+
+    store.add([_result('m2', 1, 0.95)])
+    assert store.get('m2')['label'] == 1
+    assert len(store) == 5
+
+
+def test_removed_rows_leave_every_view(store):
+    store.select(['m1', 'm3', 'unknown'])
+    assert store.selected == {'m1', 'm3'}
+    store.remove(['m1'])
+    assert 'm1' not in store
+    assert store.get('m1') is None
+    assert store.selected_ids() == ['m3']
+    assert store.ids_of(store.query(label=1)) == ['m3', 'm5']
+    assert store.get('m3')['copies'] == 2
+    assert store.cluster_ids(['m3']) == ['m3', 'm5']
+
+
+def test_selection_is_by_id_in_scan_order(store):
+    store.select(['m5', 'm2'])
+    assert store.selected_ids() == ['m2', 'm5']
+    assert store.get('m5')['selected']
+    store.select(['m5'], selected=False)
+    assert store.selected_ids() == ['m2']
+
+
+def test_cluster_ids_expand_to_near_duplicates(store):
+    assert store.cluster_ids(['m1', 'm4']) == ['m1', 'm3', 'm4', 'm5']
+    assert store.cluster_ids(['unknown']) == []
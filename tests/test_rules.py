@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from rules import RuleSet
+
+DMARC_FAIL = {'Authentication-Results': 'mx.google.com; spf=pass; dkim=pass; dmarc=fail (p=NONE)'}
+
+
+def test_sender_lists_cover_subdomains_and_allow_wins():
+    rules = RuleSet(allow=['boss@example.com', 'friends.org'], deny=['example.com', '@promo.biz'])
+    assert rules.check('Boss <BOSS@example.com>', '') == ('allow_list', 0)
+    assert rules.check('x@mail.friends.org', '') == ('allow_list', 0)
+    assert rules.check('sales@news.example.com', '') == ('deny_list', 1)
+    assert rules.check('a@promo.biz', '') == ('deny_list', 1)
+    assert rules.check('a@notpromo.biz', '') is None
+
+
+def test_header_rules_are_off_by_default():
+    rules = RuleSet()
+    assert rules.check('a@example.com', 'hello', DMARC_FAIL) is None
+    assert rules.check('a@example.com', 'hello', {'List-Unsubscribe': '<mailto:u@example.com>'}) is None
+
+
+def test_enabled_header_rules():
+    rules = RuleSet(headers={'auth_failure': 1, 'reply_to_mismatch': 1, 'list_unsubscribe': 0})
+    assert rules.check('a@example.com', '', DMARC_FAIL) == ('auth_failure', 1)
+    assert rules.check('a@example.com', '', {'authentication-results': 'spf=fail dkim=fail'}) == ('auth_failure', 1)
+    assert rules.check('a@example.com', '', {'authentication-results': 'spf=fail dkim=pass'}) is None
+    assert rules.check('a@example.com', '', {'From': 'a@mail.example.com', 'Reply-To': 'b@example.com'}) is None
+    assert rules.check('a@example.com', '', {'From': 'a@example.com', 'Reply-To': 'b@other.net'}) \
+        == ('reply_to_mismatch', 1)
+    assert rules.check('a@example.com', '', {'List-Unsubscribe': '<mailto:u@example.com>'}) == ('list_unsubscribe', 0)
+    # Without headers the checks are skipped
+    assert rules.check('a@example.com', '', None) is None
+    with pytest.raises(ValueError):
+        RuleSet(headers={'no_such_rule': 1})
+
+
+def test_keywords_are_case_insensitive_and_earliest_match_wins():
+    rules = RuleSet(keywords=[
+        {'name': 'prize', 'pattern': 'you (have )?won', 'label': 1},
+        {'name': 'invoice', 'pattern': r'invoice #\d+', 'label': 0},
+    ])
+    assert rules.check('', 'Subject: YOU HAVE WON\nclaim now') == ('prize', 1)
+    assert rules.check('', 'Invoice #42: you won a discount') == ('invoice', 0)
+    assert rules.check('', 'nothing to see') is None
+
+
+def test_patterns_that_cannot_be_combined_are_searched_on_their_own():
+    rules = RuleSet(keywords=[
+        {'name': 'shouting', 'pattern': r'(.)\1{5}', 'label': 1},
+        {'name': 'dotall', 'pattern': '(?s)free.money', 'label': 1},
+        {'name': 'named', 'pattern': '(?P<word>lottery) (?P=word)', 'label': 1},
+        {'name': 'plain', 'pattern': 'unsubscribe', 'label': 0},
+    ])
+    assert rules.check('', 'free\nmoney') == ('dotall', 1)
+    assert rules.check('', 'LOTTERY lottery') == ('named', 1)
+    assert rules.check('', 'unsubscribe here!!!!!!') == ('plain', 0)
+    assert rules.check('', '!!!!!! unsubscribe') == ('shouting', 1)
+    # A backreference must not match across rules: 'ab' repeated is not one character repeated
+    assert rules.check('', 'ababababab') is None
+
+
+def test_bad_pattern_names_the_rule():
+    with pytest.raises(ValueError, match="'broken'"):
+        RuleSet(keywords=[{'name': 'ok', 'pattern': 'fine', 'label': 1},
+                          {'name': 'broken', 'pattern': 'unclosed (', 'label': 1}])
+
+
+def test_from_file_and_report(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'deny': ['spam.example'], 'headers': {'auth_failure': 1},
+                                'keywords': [{'name': 'prize', 'pattern': 'won', 'label': 1}]}))
+    rules = RuleSet.from_file(str(path))
+    rules.check('a@spam.example', '')
+    rules.check('a@example.com', 'you won')
+    rules.check('a@example.com', 'you won')
+    rules.check('a@example.com', 'hello', DMARC_FAIL)
+    report = rules.report()
+    assert report['checked'] == 4
+    assert report['hits'] == {'prize': 2, 'deny_list': 1, 'auth_failure': 1}
+    assert set(report['ms']) == {'senders', 'headers', 'keywords'}
+
+    assert RuleSet.from_file(str(tmp_path / 'missing.json')).check('a@example.com', 'won', DMARC_FAIL) is None
@@ -0,0 +1,54 @@
+import functools
+
+from benchmark import UNLIMITED_RATE, FakeGmailHttp
+from gmail_service import GmailService
+from quota import TokenBucket
+from scan_jobs import CANCELLED, DONE, ScanJob, ScanJobRegistry
+from scanner import load_scan_state
+
+
+def _gmail(mailbox, latency=0.0):
+    return GmailService(http=FakeGmailHttp(mailbox, latency=latency), rate_limiter=TokenBucket(UNLIMITED_RATE))
+
+
+def test_job_collects_every_page(mailbox, trained_filter):
+    job = ScanJobRegistry().start(_gmail(mailbox), trained_filter, page_size=40)
+    job.join(timeout=30)
+    assert job.status == DONE
+    assert job.finished >= job.started
+    assert [r['id'] for r in job.results_since(0)] == mailbox.ids
+    assert job.results_since(job.count) == []
+
+
+def test_cancel_stops_after_the_current_page(mailbox, trained_filter):
+    registry = ScanJobRegistry()
+    job = registry.start(_gmail(mailbox, latency=0.02), trained_filter, page_size=25)
+    assert registry.cancel(job.id) is job
+    job.join(timeout=30)
+    assert job.status == CANCELLED
+    assert job.done
+    assert job.count == 25
+    assert registry.cancel('no-such-job') is None
+
+
+def test_cancelled_incremental_scan_keeps_the_saved_history(mailbox, trained_filter, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    job = ScanJob(_gmail(mailbox, latency=0.02), trained_filter, incremental=True, account='me', page_size=25)
+    job.scanner.iter_incremental_pages = functools.partial(job.scanner.iter_incremental_pages,
+                                                           state_file=state_file)
+    job.start()
+    job.cancel()
+    job.join(timeout=30)
+    assert job.status == CANCELLED
+    assert load_scan_state('me', state_file) == (None, [])
+
+
+def test_registry_keeps_only_the_newest_finished_jobs(mailbox, trained_filter):
+    registry = ScanJobRegistry(max_finished=2)
+    jobs = []
+    for _ in range(4):
+        job = registry.start(_gmail(mailbox), trained_filter, limit=10)
+        job.join(timeout=30)
+        jobs.append(job)
+    # Pruning happens when a job starts, so the newest one is not counted yet
+    assert [registry.get(job.id) is not None for job in jobs] == [False, True, True, True]
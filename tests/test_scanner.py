@@ -0,0 +1,224 @@
+import json
+from urllib.parse import urlparse
+
+import pytest
+
+from benchmark import UNLIMITED_RATE, FakeGmailHttp, SyntheticMailbox
+from gmail_service import GmailApiError, GmailService
+from message_cache import MessageCache
+from quota import TokenBucket
+from scanner import ConcurrentScanner, MailboxScanner, SpamMover, load_scan_state, save_scan_state
+
+
+class LiveMailboxHttp(FakeGmailHttp):
+    """
+    FakeGmailHttp whose listing drops messages moved to Spam, as Gmail's
+    is:unread does. Page tokens are offsets, so a move during pagination
+    shifts later pages just like the real API can.
+    """
+
+    def __init__(self, mailbox):
+        super().__init__(mailbox)
+        self.moved = set()
+        self.listed_after_move = False
+
+    def _cached(self, method, uri, body):
+        path = urlparse(uri).path
+        if path.endswith('/messages/batchModify'):
+            ids = set(json.loads(body)['ids'])
+            self.moved.update(ids)
+            self._ids = [msg_id for msg_id in self._ids if msg_id not in ids]
+        elif path.endswith('/messages') and method == 'GET':
+            self.listed_after_move = self.listed_after_move or bool(self.moved)
+            return self._dispatch(method, uri, body)
+        return super()._cached(method, uri, body)
+
+
+def _live_gmail(mailbox):
+    http = LiveMailboxHttp(mailbox)
+    return GmailService(http=http, rate_limiter=TokenBucket(UNLIMITED_RATE)), http
+
+
+@pytest.fixture
+def inbox():
+    return SyntheticMailbox(120, spam_ratio=0.5, seed=11)
+
+
+def test_on_page_moves_do_not_skip_later_pages(inbox, trained_filter):
+    gmail, http = _live_gmail(inbox)
+    scanner = MailboxScanner(gmail, trained_filter, page_size=20)
+
+    def move_spam(results):
+        gmail.move_to_spam_many([r['id'] for r in results if r['label'] == 1])
+
+    scanned = [r['id'] for page in scanner.iter_pages(on_page=move_spam) for r in page]
+    assert sorted(scanned) == sorted(inbox.ids)
+    assert http.moved
+    assert not http.listed_after_move
+
+
+def test_spam_mover_waits_for_the_listing(inbox, trained_filter):
+    gmail, http = _live_gmail(inbox)
+    scanner = ConcurrentScanner(gmail, trained_filter, workers=4, chunk_size=10)
+    mover = SpamMover(gmail, batch_size=1, flush_interval=0.01, after=scanner.listed)
+    scanned = []
+    for page in scanner.iter_results():
+        scanned.extend(r['id'] for r in page)
+        mover.put([r['id'] for r in page if r['label'] == 1])
+    moved, errors = mover.close()
+    assert sorted(scanned) == sorted(inbox.ids)
+    assert errors == {}
+    assert set(moved) == http.moved
+    assert not http.listed_after_move
+
+
+def test_sequential_spam_mover_waits_for_the_listing(inbox, trained_filter):
+    gmail, http = _live_gmail(inbox)
+    scanner = MailboxScanner(gmail, trained_filter, page_size=20)
+    mover = SpamMover(gmail, batch_size=1, flush_interval=0.01, after=scanner.listed)
+    scanned = []
+    for page in scanner.iter_pages():
+        scanned.extend(r['id'] for r in page)
+        mover.put([r['id'] for r in page if r['label'] == 1])
+    mover.close()
+    assert sorted(scanned) == sorted(inbox.ids)
+    assert not http.listed_after_move
+
+
+class IncrementalGmail:
+    """Wraps a GmailService with a scripted history: `added` ids since any saved historyId, None = expired."""
+
+    def __init__(self, gmail, history_id, added):
+        self._gmail = gmail
+        self.history_id = history_id
+        self.added = added
+        self.history_calls = []
+
+    def get_history_id(self):
+        return self.history_id
+
+    def get_added_message_ids(self, start_history_id):
+        self.history_calls.append(start_history_id)
+        return None if self.added is None else list(self.added)
+
+    def __getattr__(self, name):
+        return getattr(self._gmail, name)
+
+
+def _scan_ids(scanner, account, state_file, limit=None):
+    return [r['id'] for page in scanner.iter_incremental_pages(account, limit=limit, state_file=state_file)
+            for r in page]
+
+
+def test_full_scan_past_limit_leaves_the_rest_pending(inbox, trained_filter, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    gmail, _ = _live_gmail(inbox)
+    scanner = MailboxScanner(IncrementalGmail(gmail, '10', None), trained_filter, page_size=20)
+
+    first = _scan_ids(scanner, 'me', state_file, limit=50)
+    assert first == inbox.ids[:50]
+    assert not scanner.incremental
+    assert load_scan_state('me', state_file) == ('10', inbox.ids[50:])
+
+    # Next run is incremental: pending ids first, then newly added mail
+    scanner = MailboxScanner(IncrementalGmail(gmail, '11', ['new-1']), trained_filter, page_size=20)
+    second = _scan_ids(scanner, 'me', state_file, limit=50)
+    assert scanner.incremental
+    assert second == inbox.ids[50:100]
+    assert load_scan_state('me', state_file) == ('11', inbox.ids[100:] + ['new-1'])
+
+
+def test_incremental_scan_uses_saved_history(inbox, trained_filter, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    save_scan_state('me', '7', [], state_file)
+    gmail, _ = _live_gmail(inbox)
+    history = IncrementalGmail(gmail, '8', inbox.ids[3:6])
+    scanner = MailboxScanner(history, trained_filter)
+    assert _scan_ids(scanner, 'me', state_file) == inbox.ids[3:6]
+    assert history.history_calls == ['7']
+    assert load_scan_state('me', state_file) == ('8', [])
+
+
+def test_retryable_failures_stay_pending_and_others_are_dropped(inbox, trained_filter, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    gmail, http = _live_gmail(inbox)
+    # 'gone' is not in the mailbox, so fetching it fails with a 404
+    http._ids = inbox.ids[:5] + ['retry-me', 'gone']
+    scanner = MailboxScanner(IncrementalGmail(gmail, '3', None), trained_filter, page_size=20)
+    classify = scanner.classify_ids
+
+    def flaky(ids):
+        scanner.errors['retry-me'] = GmailApiError('messages.get', status=503, retryable=True)
+        return classify([i for i in ids if i != 'retry-me'])
+
+    scanner.classify_ids = flaky
+    assert _scan_ids(scanner, 'me', state_file) == inbox.ids[:5]
+    assert scanner.errors['gone'].status == 404
+    assert load_scan_state('me', state_file) == ('3', ['retry-me'])
+
+
+def test_abandoned_scan_saves_nothing(inbox, trained_filter, tmp_path):
+    state_file = str(tmp_path / 'scan_state.json')
+    gmail, _ = _live_gmail(inbox)
+    scanner = MailboxScanner(IncrementalGmail(gmail, '3', None), trained_filter, page_size=20)
+    pages = scanner.iter_incremental_pages('me', state_file=state_file)
+    next(pages)
+    pages.close()
+    assert load_scan_state('me', state_file) == (None, [])
+
+
+def test_state_saved_before_pending_ids_still_loads(tmp_path):
+    state_file = tmp_path / 'scan_state.json'
+    state_file.write_text(json.dumps({'me': '42'}))
+    assert load_scan_state('me', str(state_file)) == ('42', [])
+
+
+class MetadataCountingGmail:
+    """Wraps a GmailService, recording the ids of every metadata request and failing those in `fail`."""
+
+    def __init__(self, gmail, fail=()):
+        self._gmail = gmail
+        self.fail = set(fail)
+        self.metadata_ids = []
+
+    def get_messages_metadata(self, msg_ids, *args):
+        msg_ids = list(msg_ids)
+        self.metadata_ids.extend(msg_ids)
+        metadata, errors = self._gmail.get_messages_metadata(msg_ids, *args)
+        for i, msg_id in enumerate(msg_ids):
+            if msg_id in self.fail:
+                metadata[i] = None
+                errors[msg_id] = GmailApiError('messages.get', status=503, retryable=True)
+        return metadata, errors
+
+    def __getattr__(self, name):
+        return getattr(self._gmail, name)
+
+
+def test_metadata_verdicts_are_cached(inbox, trained_filter, tmp_path):
+    cache = MessageCache(str(tmp_path / 'cache.sqlite3'))
+    gmail, _ = _live_gmail(inbox)
+    counting = MetadataCountingGmail(gmail)
+    scanner = MailboxScanner(counting, trained_filter, page_size=20, cache=cache, account='me', metadata_first=True)
+    first = [r for page in scanner.iter_pages() for r in page]
+    quick = {r['id']: r for r in first if r['path'] == 'metadata'}
+    assert quick
+
+    counting.metadata_ids.clear()
+    scanner = MailboxScanner(counting, trained_filter, page_size=20, cache=cache, account='me', metadata_first=True)
+    second = {r['id']: r for page in scanner.iter_pages() for r in page}
+    assert not set(quick) & set(counting.metadata_ids)
+    assert all(second[msg_id] == result for msg_id, result in quick.items())
+    assert scanner.stats['metadata_path'] == len(quick)
+    cache.close()
+
+
+def test_metadata_errors_are_kept_unless_the_full_fetch_succeeds(inbox, trained_filter):
+    gmail, http = _live_gmail(inbox)
+    # 'gone' is not in the mailbox, so its full fetch fails too
+    http._ids = inbox.ids[:5] + ['gone']
+    counting = MetadataCountingGmail(gmail, fail=[inbox.ids[0], 'gone'])
+    scanner = MailboxScanner(counting, trained_filter, metadata_first=True)
+    scanned = [r['id'] for page in scanner.iter_pages() for r in page]
+    assert sorted(scanned) == sorted(inbox.ids[:5])
+    assert set(scanner.errors) == {'gone'}
@@ -0,0 +1,71 @@
+import json
+import mailbox
+from email.message import EmailMessage
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from model_artifact import load_artifact
+from train_model import _is_holdout, iter_corpus, train_streaming
+
+
+@pytest.fixture
+def jsonl_corpus(corpus, tmp_path):
+    path = tmp_path / 'corpus.jsonl'
+    texts, labels = corpus
+    path.write_text(''.join(json.dumps({'text': t, 'label': l}) + '\n' for t, l in zip(texts, labels)))
+    return str(path)
+
+
+def _write_mbox(path, subjects):
+    box = mailbox.mbox(str(path))
+    for subject in subjects:
+        message = EmailMessage()
+        message['Subject'] = subject
+        message.set_content(f'Body of {subject}')
+        box.add(message)
+    box.close()
+
+
+def test_iter_corpus_chunks_every_format(corpus, jsonl_corpus, tmp_path):
+    texts, labels = corpus
+    csv_path = str(tmp_path / 'corpus.csv')
+    pd.DataFrame({'text': texts, 'label_num': labels}).to_csv(csv_path, index=False)
+    mbox_path = tmp_path / 'spam.mbox'
+    _write_mbox(mbox_path, ['one', 'two', 'three'])
+
+    chunks = list(iter_corpus([csv_path, jsonl_corpus, f'{mbox_path}:1'], chunksize=128))
+    assert all(len(chunk_texts) <= 128 for chunk_texts, _ in chunks)
+    streamed_texts = [t for chunk_texts, _ in chunks for t in chunk_texts]
+    streamed_labels = [l for _, chunk_labels in chunks for l in chunk_labels]
+    assert streamed_texts[:2 * len(texts)] == texts + texts
+    assert streamed_labels == labels + labels + [1, 1, 1]
+    assert streamed_texts[-1].startswith('Subject: three\nBody of three')
+
+
+def test_mbox_corpus_needs_a_label(tmp_path):
+    mbox_path = tmp_path / 'ham.mbox'
+    _write_mbox(mbox_path, ['one'])
+    with pytest.raises(ValueError):
+        list(iter_corpus([str(mbox_path)]))
+
+
+def test_streamed_nb_does_not_depend_on_chunk_size(jsonl_corpus, corpus, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    train_streaming([jsonl_corpus], n_features=2 ** 12, chunksize=7)
+    small_chunks = joblib.load('spam_model.pkl')
+    train_streaming([jsonl_corpus], n_features=2 ** 12, chunksize=10000)
+    one_chunk = joblib.load('spam_model.pkl')
+    np.testing.assert_allclose(small_chunks.feature_count_, one_chunk.feature_count_)
+
+    texts, labels = corpus
+    trained = [l for t, l in zip(texts, labels) if not _is_holdout(t)]
+    assert one_chunk.class_count_.sum() == len(trained)
+
+    # The exported artifact scores like the pickled pair
+    model, vectorizer = load_artifact('spam_model.bin')
+    pickled_vectorizer = joblib.load('vectorizer.pkl')
+    np.testing.assert_array_equal(model.predict(vectorizer.transform(texts)),
+                                  one_chunk.predict(pickled_vectorizer.transform(texts)))
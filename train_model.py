@@ -1,61 +1,236 @@
+import argparse
+import json
+import mailbox
+import time
+import zlib
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.linear_model import SGDClassifier
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.metrics import accuracy_score, classification_report, precision_score, recall_score
 import joblib
+from model_artifact import export_artifact
 
-def train():
+FEATURE_OPTIONS = ('count', 'hashing')
+DEFAULT_HASHING_FEATURES = 2 ** 20
+DEFAULT_CORPORA = ['spam_ham_dataset.csv', 'emails.csv']
+DEFAULT_CHUNKSIZE = 5000
+
+def load_dataset():
     # Load dataset
     print("Loading datasets...")
     df1 = pd.read_csv('spam_ham_dataset.csv')
     df2 = pd.read_csv('emails.csv')
-    
+
     # Preprocessing
     # df1 has 'text' and 'label_num'
     # df2 has 'text' and 'spam' -> rename 'spam' to 'label_num'
     df2.rename(columns={'spam': 'label_num'}, inplace=True)
-    
+
     # Combined dataset
     df = pd.concat([df1[['text', 'label_num']], df2[['text', 'label_num']]], ignore_index=True)
     print(f"Total samples after merging: {len(df)}")
+    return df['text'], df['label_num']
 
-    X = df['text']
-    y = df['label_num']
-    
-    # Split into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    # Vectorization
-    print("Vectorizing text...")
-    vectorizer = CountVectorizer(stop_words='english')
+def build_vectorizer(features, n_features=DEFAULT_HASHING_FEATURES):
+    """
+    'count' learns a vocabulary that has to be shipped with the model;
+    'hashing' maps tokens into a fixed n_features space and needs none.
+    """
+    if features == 'hashing':
+        # Non-negative raw counts so MultinomialNB can use the features too
+        return HashingVectorizer(stop_words='english', n_features=n_features, alternate_sign=False, norm=None)
+    return CountVectorizer(stop_words='english')
+
+def build_classifier(classifier):
+    if classifier == 'linear':
+        return SGDClassifier(loss='log_loss', random_state=42)
+    return MultinomialNB()
+
+def fit_and_evaluate(features, classifier, X_train, X_test, y_train, y_test, n_features):
+    """Returns (vectorizer, model, y_pred, metrics) for one configuration."""
+    start = time.perf_counter()
+    vectorizer = build_vectorizer(features, n_features)
     X_train_vec = vectorizer.fit_transform(X_train)
-    X_test_vec = vectorizer.transform(X_test)
-    
-    # Train model
-    print("Training Multinomial Naive Bayes model...")
-    model = MultinomialNB()
+    model = build_classifier(classifier)
     model.fit(X_train_vec, y_train)
-    
-    # Evaluation
-    print("Evaluating model...")
-    y_pred = model.predict(X_test_vec)
-    acc = accuracy_score(y_test, y_pred)
-    prec = precision_score(y_test, y_pred)
-    rec = recall_score(y_test, y_pred)
-    
-    print(f"Accuracy = {acc*100:.2f}%")
-    print(f"Precision = {prec*100:.2f}%")
-    print(f"Recall = {rec*100:.2f}%")
-    
-    print("\nClassification Report:")
+    train_seconds = time.perf_counter() - start
+
+    y_pred = model.predict(vectorizer.transform(X_test))
+    metrics = {
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred),
+        'recall': recall_score(y_test, y_pred),
+        'train_seconds': train_seconds,
+    }
+    return vectorizer, model, y_pred, metrics
+
+def train(features='count', classifier='nb', n_features=DEFAULT_HASHING_FEATURES):
+    X, y = load_dataset()
+
+    # Split into training and testing sets
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Train both feature options so they can be compared side by side
+    results = {}
+    for option in FEATURE_OPTIONS:
+        print(f"Training {classifier} on {option} features...")
+        results[option] = fit_and_evaluate(option, classifier, X_train, X_test, y_train, y_test, n_features)
+
+    print(f"\n{'Features':<10}{'Accuracy':>10}{'Precision':>11}{'Recall':>9}{'Train s':>9}")
+    for option, (_, _, _, metrics) in results.items():
+        print(f"{option:<10}{metrics['accuracy']*100:>9.2f}%{metrics['precision']*100:>10.2f}%"
+              f"{metrics['recall']*100:>8.2f}%{metrics['train_seconds']:>9.2f}")
+
+    vectorizer, model, y_pred, _ = results[features]
+    print(f"\nClassification Report ({features}):")
     print(classification_report(y_test, y_pred))
-    
+
     # Save model and vectorizer
     print("Saving model and vectorizer...")
     joblib.dump(model, 'spam_model.pkl')
     joblib.dump(vectorizer, 'vectorizer.pkl')
+    # Pickle-free, memory-mappable copy that SpamFilter loads by default
+    export_artifact(model, vectorizer, 'spam_model.bin')
     print("Done!")
 
+def _iter_csv(path, chunksize):
+    # Label column is 'label_num' in spam_ham_dataset.csv and 'spam' in emails.csv
+    columns = pd.read_csv(path, nrows=0).columns
+    label_col = 'label_num' if 'label_num' in columns else 'spam'
+    for chunk in pd.read_csv(path, usecols=['text', label_col], chunksize=chunksize):
+        chunk = chunk.dropna()
+        yield chunk['text'].astype(str).tolist(), chunk[label_col].astype(int).tolist()
+
+def _iter_jsonl(path, chunksize):
+    """One {"text": ..., "label": 0/1} object per line."""
+    texts, labels = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            texts.append(record['text'])
+            labels.append(int(record['label']))
+            if len(texts) >= chunksize:
+                yield texts, labels
+                texts, labels = [], []
+    if texts:
+        yield texts, labels
+
+def _mbox_text(message):
+    body = ''
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain':
+            payload = part.get_payload(decode=True)
+            if payload:
+                body = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+                break
+    return f"Subject: {message.get('Subject', '')}\n{body}"
+
+def _iter_mbox(path, label, chunksize):
+    """Every message in the mbox gets the same label."""
+    texts = []
+    for message in mailbox.mbox(path, create=False):
+        texts.append(_mbox_text(message))
+        if len(texts) >= chunksize:
+            yield texts, [label] * len(texts)
+            texts = []
+    if texts:
+        yield texts, [label] * len(texts)
+
+def iter_corpus(sources, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Yields (texts, labels) chunks from CSV, JSONL and mbox corpora without
+    loading any of them fully. mbox sources are given as 'path:LABEL'.
+    """
+    for source in sources:
+        if source.endswith('.csv'):
+            yield from _iter_csv(source, chunksize)
+        elif source.endswith('.jsonl'):
+            yield from _iter_jsonl(source, chunksize)
+        else:
+            path, sep, label = source.rpartition(':')
+            if not sep or label not in ('0', '1'):
+                raise ValueError(f"mbox corpus needs a label, e.g. '{source}:1'")
+            yield from _iter_mbox(path, int(label), chunksize)
+
+def _is_holdout(text):
+    # Stable 20% test split that needs no shuffling or row count
+    return zlib.crc32(text.encode('utf-8', errors='replace')) % 5 == 0
+
+def train_streaming(sources=DEFAULT_CORPORA, classifier='nb', n_features=DEFAULT_HASHING_FEATURES,
+                    chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Out-of-core training: corpora are read chunk by chunk and the model is
+    updated with partial_fit over stateless hashing features, so memory use
+    does not depend on corpus size. A second pass scores the holdout rows.
+    """
+    vectorizer = build_vectorizer('hashing', n_features)
+    model = build_classifier(classifier)
+
+    print("Training on streamed chunks...")
+    start = time.perf_counter()
+    n_train = 0
+    for texts, labels in iter_corpus(sources, chunksize):
+        train_rows = [(t, l) for t, l in zip(texts, labels) if not _is_holdout(t)]
+        if not train_rows:
+            continue
+        X = vectorizer.transform([t for t, _ in train_rows])
+        model.partial_fit(X, [l for _, l in train_rows], classes=[0, 1])
+        n_train += len(train_rows)
+        print(f"  {n_train} samples trained", end='\r')
+    print(f"\nTrained on {n_train} samples in {time.perf_counter() - start:.2f}s")
+    if n_train == 0:
+        print("No training data found.")
+        return
+
+    print("Evaluating model...")
+    tp = fp = fn = tn = 0
+    for texts, labels in iter_corpus(sources, chunksize):
+        test_rows = [(t, l) for t, l in zip(texts, labels) if _is_holdout(t)]
+        if not test_rows:
+            continue
+        y_pred = model.predict(vectorizer.transform([t for t, _ in test_rows]))
+        for (_, actual), predicted in zip(test_rows, y_pred):
+            if predicted == 1:
+                tp += actual == 1
+                fp += actual == 0
+            else:
+                fn += actual == 1
+                tn += actual == 0
+    total = tp + fp + fn + tn
+    if total:
+        print(f"Accuracy = {(tp + tn) / total * 100:.2f}%")
+        print(f"Precision = {tp / max(tp + fp, 1) * 100:.2f}%")
+        print(f"Recall = {tp / max(tp + fn, 1) * 100:.2f}%")
+
+    print("Saving model and vectorizer...")
+    joblib.dump(model, 'spam_model.pkl')
+    joblib.dump(vectorizer, 'vectorizer.pkl')
+    export_artifact(model, vectorizer, 'spam_model.bin')
+    print("Done!")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the spam classifier.")
+    parser.add_argument('--features', choices=FEATURE_OPTIONS, default='count',
+                        help="Feature extractor to save (both are trained and compared)")
+    parser.add_argument('--classifier', choices=('nb', 'linear'), default='nb',
+                        help="MultinomialNB or a logistic-loss linear model (SGDClassifier)")
+    parser.add_argument('--n-features', type=int, default=DEFAULT_HASHING_FEATURES,
+                        help="Width of the hashing feature space")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Out-of-core training with partial_fit on hashing features")
+    parser.add_argument('--corpus', action='append',
+                        help="Streaming corpus: .csv, .jsonl or mbox as PATH:LABEL (repeatable)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help="Rows per streamed chunk")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    train()
+    args = parse_args()
+    if args.streaming:
+        train_streaming(args.corpus or DEFAULT_CORPORA, args.classifier, args.n_features, args.chunksize)
+    else:
+        train(args.features, args.classifier, args.n_features)